@@ -6,3 +6,155 @@ UPSTREAM_REQUEST_TIMEOUT = 6000
 UPSTREAM_CONNECT_TIMEOUT = 20
 PROJECT_CACHE_TIMEOUT = 120
 CNT_ADRESS_CACHE_TIMEOUT = 120
+
+# UNKNOWN PROJECTS
+# Time in seconds a project name that is not in projects.json is remembered as unknown, unless projects.json changes
+UNKNOWN_PROJECT_CACHE_TIMEOUT = 5
+# Maximum number of remembered unknown project names
+UNKNOWN_PROJECT_CACHE_SIZE = 4096
+
+# ACCESS LOG
+# Maximum number of access log records buffered in memory between two flushes
+ACCESS_LOG_BUFFER_SIZE = 10000
+# Interval in seconds in which buffered access log records are written
+ACCESS_LOG_FLUSH_INTERVAL = 1
+
+# TRACING
+# Maximum number of finished traces buffered in memory between two flushes
+TRACE_BUFFER_SIZE = 2000
+# Interval in seconds in which buffered traces are written
+TRACE_FLUSH_INTERVAL = 1
+
+# IOLOOP WATCHDOG
+# Default threshold in seconds after which a blocked IOLoop is reported as stalled
+WATCHDOG_STALL_THRESHOLD = 0.5
+# Interval of the IOLoop heartbeat in seconds
+WATCHDOG_HEARTBEAT_INTERVAL = 0.1
+# Number of recent stalls kept for reporting
+WATCHDOG_STALL_HISTORY = 50
+
+# WEBSOCKET UPSTREAMS
+# Timeouts in seconds for connecting to an upstream WebSocket and for the whole handshake
+WS_UPSTREAM_CONNECT_TIMEOUT = 5
+WS_UPSTREAM_HANDSHAKE_TIMEOUT = 10
+# Exponential backoff in seconds for upstreams that failed to connect
+WS_UPSTREAM_BACKOFF_BASE = 0.5
+WS_UPSTREAM_BACKOFF_MAX = 10
+# Time in seconds successful resolutions of hostnames are reused
+RESOLVE_CACHE_TIMEOUT = 5
+# Maximum number of cached resolutions
+RESOLVE_CACHE_SIZE = 4096
+
+# AUTOSTART RESTRICTION
+# Number of client addresses for which the autostart_restrict decision is cached
+AUTOSTART_RESTRICT_CACHE_SIZE = 4096
+
+# AUTOSTART READINESS
+# Maximum time in seconds to wait for the services of an autostarted project to accept requests
+AUTOSTART_READY_TIMEOUT = 60
+# Interval in seconds in which services that are not ready yet are checked again
+AUTOSTART_PROBE_INTERVAL = 0.25
+# Maximum time in seconds for a single readiness check (TCP connection or HTTP request)
+AUTOSTART_PROBE_TIMEOUT = 2
+# Maximum time in seconds for the warm-up request to a service
+AUTOSTART_WARMUP_TIMEOUT = 60
+
+# STATUS API
+# Interval in seconds in which the status of all projects is refreshed, for the landing page and the status API
+STATUS_REFRESH_INTERVAL = 2
+# Maximum time in seconds a request for status changes waits for a change
+STATUS_LONG_POLL_TIMEOUT = 30
+# Number of removed projects remembered for clients that ask for changes, clients with older versions get all projects
+STATUS_REMOVED_HISTORY = 256
+
+# CONTROL API
+# Time in seconds over which the throughput of projects is averaged
+TRAFFIC_WINDOW = 10
+
+# CONFIG RELOAD
+# Interval in seconds in which the system config file is checked for changes, if watching it is enabled
+CONFIG_WATCH_INTERVAL = 2
+
+# SHUTDOWN AND RESTART
+# Maximum time in seconds to wait for running requests and WebSocket connections to finish when stopping
+SHUTDOWN_DRAIN_TIMEOUT = 30
+# Maximum time in seconds a new process has to take over the listening sockets when restarting
+RESTART_READY_TIMEOUT = 30
+
+# CLIENT CONNECTIONS
+# Time in seconds a keep-alive connection may be idle, and the maximum time for receiving the headers of a request
+CLIENT_IDLE_TIMEOUT = 75
+# Maximum time in seconds for receiving the body of a request. None for no limit, uploads of any size are streamed
+# to the upstream (see UPLOAD_MAX_SIZE) and may take as long as the client needs.
+CLIENT_BODY_TIMEOUT: float | None = None
+# Maximum size in bytes of the headers of a request
+CLIENT_MAX_HEADER_SIZE = 64 * 1024
+# Maximum number of open client connections (of all listeners), limited to a third of the open file limit
+CLIENT_MAX_CONNECTIONS = 10000
+# Number of requests after which a keep-alive connection is closed
+CLIENT_MAX_REQUESTS_PER_CONNECTION = 1000
+# Maximum time in seconds for answering a connection beyond the maximum (eg. a TLS handshake the client doesn't finish)
+CLIENT_REJECT_TIMEOUT = 2
+
+# CONCURRENCY LIMITS
+# Maximum number of concurrent upstream HTTP requests
+MAX_CONCURRENT_REQUESTS = 1024
+# Maximum number of concurrent upstream HTTP requests per project
+MAX_CONCURRENT_REQUESTS_PER_PROJECT = 128
+# Maximum number of concurrent (running and waiting) HTTP requests per client IP
+MAX_CONCURRENT_REQUESTS_PER_CLIENT = 512
+# Maximum number of HTTP requests per project that wait for a free slot
+REQUEST_QUEUE_SIZE = 512
+# Maximum time in seconds an HTTP request waits for a free slot
+REQUEST_QUEUE_TIMEOUT = 10
+# Value of the Retry-After header for rejected requests in seconds
+REQUEST_RETRY_AFTER = 1
+
+# ENGINE
+# Number of threads that run blocking engine calls
+ENGINE_MAX_WORKERS = 8
+# Time in seconds the engine status of a project is reused
+ENGINE_STATUS_CACHE_TIMEOUT = 2
+
+# DIRECT ROUTING
+# Maximum time in seconds to wait for a connection to the container network address of a service when checking it
+DIRECT_ROUTING_PROBE_TIMEOUT = 0.5
+# Time in seconds published ports are used, after a container network address was not reachable
+DIRECT_ROUTING_RETRY_INTERVAL = 300
+
+# LOAD BALANCING
+# Interval in seconds in which the addresses of the containers of a service in use are refreshed in the background
+ENDPOINT_REFRESH_INTERVAL = 10
+# Time in seconds a container that could not be connected to is skipped, if the service has other containers
+ENDPOINT_EJECT_TIME = 10
+
+# STATIC FILES
+# Maximum number of static files kept open
+STATIC_FILE_HANDLE_CACHE_SIZE = 256
+
+# RESPONSE BUFFERING
+# Maximum size in bytes of an upstream response body that is kept in memory, larger bodies are buffered on disk
+UPSTREAM_BODY_MEMORY_LIMIT = 16 * 1024 * 1024
+# Maximum size in bytes of an upstream response body, larger responses are answered with 502 Bad Gateway
+UPSTREAM_BODY_MAX_SIZE = 1024 * 1024 * 1024
+# Size in bytes of the chunks in which bodies buffered on disk are sent to the client
+UPSTREAM_BODY_CHUNK_SIZE = 256 * 1024
+# Maximum number of bytes of a body buffered on disk that wait to be written to the file, reading the upstream
+# response pauses until they are written
+UPSTREAM_BODY_MAX_PENDING_WRITES = 8 * 1024 * 1024
+
+# STREAMING RESPONSES
+# Time in seconds the upstream server may send nothing for a streamed response (Server-Sent Events or chunked without
+# Content-Length), before the response is closed
+STREAM_IDLE_TIMEOUT = 300
+# Interval in seconds in which idle Server-Sent Events streams get a heartbeat comment, to detect closed clients
+STREAM_HEARTBEAT_INTERVAL = 15
+# Maximum number of bytes of a streamed response waiting to be sent to a slow client, the stream is closed beyond
+STREAM_MAX_PENDING = 64 * 1024 * 1024
+
+# UPLOADS
+# Maximum size in bytes of request bodies that are streamed to the upstream server (requests with
+# Expect: 100-continue). Other request bodies are read into memory and limited by Tornado (100 MB).
+UPLOAD_MAX_SIZE = 16 * 1024 * 1024 * 1024
+# Time in seconds the upstream server has to answer an upload with 100 Continue, the body is sent anyway afterwards
+UPSTREAM_EXPECT_TIMEOUT = 1
@@ -5,12 +5,21 @@ from tempfile import TemporaryDirectory
 
 import click
 from click import ClickException, echo
-from riptide.config.document.config import Config
 from riptide.config.files import riptide_main_config_file
 from riptide.engine.loader import load_engine
 from riptide.util import get_riptide_version_raw
-from riptide_proxy import LOGGER_NAME
+from riptide_proxy import (
+    CLIENT_BODY_TIMEOUT,
+    CLIENT_IDLE_TIMEOUT,
+    CLIENT_MAX_CONNECTIONS,
+    CLIENT_MAX_HEADER_SIZE,
+    CLIENT_MAX_REQUESTS_PER_CONNECTION,
+    LOGGER_NAME,
+    WATCHDOG_STALL_THRESHOLD,
+)
+from riptide_proxy.balancer import ROUND_ROBIN, STRATEGIES
 from riptide_proxy.privileges import drop_privileges
+from riptide_proxy.server.reload import read_system_config
 from riptide_proxy.server.starter import run_proxy
 from riptide_proxy.ssl_key import create_keys
 
@@ -41,7 +50,164 @@ def print_version():
     default="INFO",
     help="Log level. Default: INFO",
 )
-def main(user, loglevel, version=False):
+@click.option(
+    "--access-log",
+    type=click.Path(dir_okay=False, allow_dash=True),
+    default=None,
+    help="Write a structured access log (one JSON line per request) to this file. Use - for stdout.",
+)
+@click.option(
+    "--trace-file",
+    type=click.Path(dir_okay=False, allow_dash=True),
+    default=None,
+    help="Trace the phases of each request and write the traces (one JSON line per request) to this file. "
+    "Use - for stdout.",
+)
+@click.option(
+    "--trace-propagate",
+    is_flag=True,
+    help="Only with --trace-file: Send a W3C traceparent header to the upstream containers.",
+)
+@click.option(
+    "--stall-threshold",
+    type=click.FloatRange(min=0),
+    default=WATCHDOG_STALL_THRESHOLD,
+    show_default=True,
+    help="Log a warning with the stack of the IOLoop thread whenever it is blocked for longer than this many "
+    "seconds. 0 disables the IOLoop watchdog.",
+)
+@click.option(
+    "--watch-config",
+    is_flag=True,
+    help="Reload the system config whenever the file changes. It is always reloaded on SIGHUP.",
+)
+@click.option(
+    "--direct-routing",
+    is_flag=True,
+    help="Send requests to the addresses of the containers in their container network instead of the ports they "
+    "publish on the host, if these are reachable (Docker on Linux). Falls back to the published ports otherwise.",
+)
+@click.option(
+    "--load-balancing",
+    type=click.Choice(STRATEGIES),
+    default=ROUND_ROBIN,
+    show_default=True,
+    help="How requests for services with multiple containers are spread across them. cookie-hash sends requests "
+    "with the same --affinity-cookie (or from the same client IP) to the same container.",
+)
+@click.option(
+    "--affinity-cookie",
+    default=None,
+    help="Only with --load-balancing cookie-hash: Name of the cookie that selects the container, "
+    "eg. the session cookie of the application.",
+)
+@click.option(
+    "--static-files",
+    type=click.Path(dir_okay=False, exists=True),
+    default=None,
+    help="JSON file with rules for static files that are served from the source directories of the projects instead "
+    'of by their services, eg. {"project": {"service": [{"prefix": "/build/", "dir": "public/build"}, '
+    '{"glob": "/*.ico", "dir": "public"}]}}. Directories are relative to the source directory of the project.',
+)
+@click.option(
+    "--collapse-requests",
+    is_flag=True,
+    help="Send identical concurrent GET requests without cookies or authorization to the containers only once, "
+    "eg. for bundles requested by multiple tabs while a dev server builds them.",
+)
+@click.option(
+    "--readiness-path",
+    default=None,
+    help="Path (eg. /health) requested from autostarted services until they answer without 502, 503 or 504, "
+    "before the browser is sent to them. By default, autostart waits until the services accept TCP connections.",
+)
+@click.option(
+    "--warmup-path",
+    default=None,
+    help="Path requested once from autostarted services when they are ready, before the browser is sent to them, "
+    "eg. to fill caches of the application.",
+)
+@click.option(
+    "--control-api",
+    is_flag=True,
+    help="Serve the admin API on control.<proxy url>: inspect and flush caches, list running requests and "
+    "WebSocket connections, show the throughput of projects and change concurrency limits.",
+)
+@click.option(
+    "--control-restrict",
+    multiple=True,
+    help="Only with --control-api: Network (CIDR) of clients allowed to use the admin API. Can be given multiple "
+    "times. Default: only localhost.",
+)
+@click.option(
+    "--client-idle-timeout",
+    type=click.FloatRange(min=0, min_open=True),
+    default=CLIENT_IDLE_TIMEOUT,
+    show_default=True,
+    help="Seconds after which idle keep-alive connections of clients are closed. Clients must also send the "
+    "headers of a request within this time.",
+)
+@click.option(
+    "--client-body-timeout",
+    type=click.FloatRange(min=0, min_open=True),
+    default=CLIENT_BODY_TIMEOUT,
+    help="Maximum time in seconds for receiving the body of a request. No limit by default.",
+)
+@click.option(
+    "--client-max-header-size",
+    type=click.IntRange(min=1024),
+    default=CLIENT_MAX_HEADER_SIZE,
+    show_default=True,
+    help="Maximum size in bytes of the headers of a request.",
+)
+@click.option(
+    "--client-max-connections",
+    type=click.IntRange(min=1),
+    default=None,
+    help=f"Maximum number of open client connections, further clients get a 503 response. "
+    f"Default: {CLIENT_MAX_CONNECTIONS}, but at most a third of the open file limit.",
+)
+@click.option(
+    "--client-max-requests",
+    type=click.IntRange(min=1),
+    default=CLIENT_MAX_REQUESTS_PER_CONNECTION,
+    show_default=True,
+    help="Number of requests after which a keep-alive connection is closed.",
+)
+@click.option(
+    "--header-rules",
+    type=click.Path(dir_okay=False, exists=True),
+    default=None,
+    help="JSON file with rules that remove, rewrite, set or add headers of the requests to and the responses of "
+    'projects, eg. {"*": {"response": {"remove": ["X-Powered-By"]}}, "project": {"request": {"set": {"X-Env": '
+    '"dev"}}, "response": {"rewrite": [{"header": "Location", "pattern": "^http:", "replace": "https:"}]}}}. '
+    "The rules of * apply to all projects.",
+)
+def main(
+    user,
+    loglevel,
+    access_log,
+    trace_file,
+    trace_propagate,
+    stall_threshold,
+    watch_config,
+    direct_routing,
+    load_balancing,
+    affinity_cookie,
+    static_files,
+    collapse_requests,
+    readiness_path,
+    warmup_path,
+    control_api,
+    control_restrict,
+    client_idle_timeout,
+    client_body_timeout,
+    client_max_header_size,
+    client_max_connections,
+    client_max_requests,
+    header_rules,
+    version=False,
+):
     """
     HTTP and Websocket Reverse Proxy for Riptide Projects.
 
@@ -69,13 +235,7 @@ def main(user, loglevel, version=False):
     # Read system config
     try:
         config_path = riptide_main_config_file()
-        system_config = Config.from_yaml(config_path)
-        # Remove the hooks from the base configuration, since there are (currently)
-        # no proxy hooks anyway, and this way we don't have to process them.
-        if system_config.internal_contains("hooks"):
-            system_config.internal_delete("hooks")
-        system_config.validate()
-        system_config.freeze()
+        system_config = read_system_config(config_path)
     except FileNotFoundError as e:
         raise ClickException("Main config file not found. Run riptide config-edit-user.") from e
     except Exception as e:
@@ -105,6 +265,27 @@ def main(user, loglevel, version=False):
             http_port=system_config["proxy"]["ports"]["http"],
             https_port=system_config["proxy"]["ports"]["https"],
             ssl_options=ssl_options,
+            access_log=access_log,
+            trace_file=trace_file,
+            trace_propagate=trace_propagate,
+            stall_threshold=stall_threshold,
+            config_path=config_path,
+            watch_config=watch_config,
+            direct_routing=direct_routing,
+            load_balancing=load_balancing,
+            affinity_cookie=affinity_cookie,
+            static_files=static_files,
+            collapse_requests=collapse_requests,
+            readiness_path=readiness_path,
+            warmup_path=warmup_path,
+            control_api=control_api,
+            control_restrict=list(control_restrict) or None,
+            client_idle_timeout=client_idle_timeout,
+            client_body_timeout=client_body_timeout,
+            client_max_header_size=client_max_header_size,
+            client_max_connections=client_max_connections,
+            client_max_requests=client_max_requests,
+            header_rules=header_rules,
         )
 
 
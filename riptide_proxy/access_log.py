@@ -0,0 +1,84 @@
+"""Structured per-request access log"""
+
+from __future__ import annotations
+
+import json
+import time
+from typing import Any
+
+from riptide_proxy import ACCESS_LOG_BUFFER_SIZE, ACCESS_LOG_FLUSH_INTERVAL
+from riptide_proxy.batched_writer import BatchedWriter
+
+# Order of the fields in a record tuple, also the order of the keys in the written JSON lines.
+FIELDS = (
+    "time",
+    "remote_ip",
+    "method",
+    "host",
+    "uri",
+    "project",
+    "service",
+    "resolve_status",
+    "status",
+    "bytes_in",
+    "bytes_out",
+    "upstream_ttfb_ms",
+    "total_ms",
+)
+
+AccessLogRecord = tuple[Any, ...]
+
+
+class AccessLog(BatchedWriter[AccessLogRecord]):
+    """Access log that writes one JSON line per request. See BatchedWriter for how records are written."""
+
+    def __init__(
+        self,
+        target: str,
+        buffer_size: int = ACCESS_LOG_BUFFER_SIZE,
+        flush_interval: float = ACCESS_LOG_FLUSH_INTERVAL,
+    ):
+        super().__init__(target, buffer_size, flush_interval)
+
+    def log(
+        self,
+        remote_ip: str | None,
+        method: str | None,
+        host: str,
+        uri: str | None,
+        project: str | None,
+        service: str | None,
+        resolve_status: str | None,
+        status: int,
+        bytes_in: int,
+        bytes_out: int,
+        upstream_ttfb: float | None,
+        total: float,
+    ):
+        """Queue a record. Times are in seconds. Must be called from the IOLoop thread."""
+        self.append(
+            (
+                time.time(),
+                remote_ip,
+                method,
+                host,
+                uri,
+                project,
+                service,
+                resolve_status,
+                status,
+                bytes_in,
+                bytes_out,
+                upstream_ttfb,
+                total,
+            )
+        )
+
+    def format(self, record: AccessLogRecord) -> str:
+        """Format a record tuple as a JSON line. Durations are converted to milliseconds."""
+        entry = dict(zip(FIELDS, record))
+        entry["time"] = time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(record[0]))
+        if entry["upstream_ttfb_ms"] is not None:
+            entry["upstream_ttfb_ms"] = round(entry["upstream_ttfb_ms"] * 1000, 3)
+        entry["total_ms"] = round(entry["total_ms"] * 1000, 3)
+        return json.dumps(entry, separators=(",", ":")) + "\n"
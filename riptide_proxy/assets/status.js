@@ -0,0 +1,24 @@
+// Keeps the project list of the landing page up to date, using the status API of the proxy.
+var source = new EventSource('/___riptide_proxy_api/changes?since=' + window.status_version);
+
+source.onmessage = function (ev) {
+    var changes = JSON.parse(ev.data);
+    if (changes.full || changes.removed.length > 0 || changes.load_errors !== undefined) {
+        // Projects were added or removed (or the proxy restarted), render the list again.
+        location.reload();
+        return;
+    }
+    changes.projects.forEach(function (project) {
+        var list = document.querySelector('.service-list[data-project="' + project.name + '"]');
+        if (!list) {
+            location.reload();
+            return;
+        }
+        Object.keys(project.services).forEach(function (serviceName) {
+            var elem = list.querySelector('[data-service="' + serviceName + '"]');
+            if (elem) {
+                elem.classList.toggle('started', project.services[serviceName].running);
+            }
+        });
+    });
+};
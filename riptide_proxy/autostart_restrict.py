@@ -1,28 +1,102 @@
 """Checks auto-start related restrictions (whether a client is allowed to start projects via the server or not)"""
 
+from __future__ import annotations
+
 import ipaddress
 import logging
+from bisect import bisect_right
+from functools import lru_cache
 
-from riptide_proxy import LOGGER_NAME
+from riptide_proxy import AUTOSTART_RESTRICT_CACHE_SIZE, LOGGER_NAME
 
 logger = logging.getLogger(LOGGER_NAME)
 
 
-def check_permission(ipv4address: str | None, config) -> bool:
-    if "autostart_restrict" not in config:
-        return True
-    if ipv4address is None:
-        return False
-    try:
-        ipv4address_network = ipaddress.ip_network(f"{ipv4address}/32")
-    except ValueError as err:
-        logger.warning(f"Invalid IPv4 addresss for client: {ipv4address}: {err}")
-
-    for network_str in config["autostart_restrict"]:
+class AutostartRestriction:
+    """
+    The compiled autostart_restrict setting of the proxy configuration.
+
+    The networks are merged into sorted, non-overlapping address intervals per IP version, so a lookup is a binary
+    search. Decisions for recently seen client addresses are cached.
+    """
+
+    def __init__(self, networks: list[str] | None):
+        """
+        :param networks: The networks clients must be in, as CIDR strings. None if autostart is not restricted.
+                         Invalid networks are logged and ignored.
+        """
+        self.restricted = networks is not None
+        # IP version => (sorted interval starts, matching interval ends)
+        self._intervals: dict[int, tuple[list[int], list[int]]] = {4: ([], []), 6: ([], [])}
+        self._cache: dict[str, bool] = {}
+
+        ranges: dict[int, list[tuple[int, int]]] = {4: [], 6: []}
+        for network_str in networks or []:
+            try:
+                network = ipaddress.ip_network(network_str, strict=False)
+            except ValueError as err:
+                logger.warning(f"Invalid network in system config autostart_restrict: {network_str}: {err}")
+                continue
+            ranges[network.version].append(
+                (int(network.network_address), int(network.network_address) + network.num_addresses - 1)
+            )
+
+        for version, version_ranges in ranges.items():
+            starts, ends = self._intervals[version]
+            for start, end in sorted(version_ranges):
+                if ends and start <= ends[-1] + 1:
+                    ends[-1] = max(ends[-1], end)
+                else:
+                    starts.append(start)
+                    ends.append(end)
+
+    @classmethod
+    def from_config(cls, config) -> AutostartRestriction:
+        """Compile the restriction of the proxy configuration (the proxy section of the system config)"""
+        if "autostart_restrict" not in config:
+            return cls(None)
+        return cls(list(config["autostart_restrict"]))
+
+    def allows(self, address: str | None) -> bool:
+        """Whether the client with the given IPv4 or IPv6 address is allowed to auto-start projects."""
+        if not self.restricted:
+            return True
+        if address is None:
+            return False
         try:
-            network = ipaddress.ip_network(network_str)
-            if network.overlaps(ipv4address_network):
-                return True
+            return self._cache[address]
+        except KeyError:
+            pass
+        decision = self._lookup(address)
+        if len(self._cache) >= AUTOSTART_RESTRICT_CACHE_SIZE:
+            self._cache.clear()
+        self._cache[address] = decision
+        return decision
+
+    def _lookup(self, address: str) -> bool:
+        try:
+            ip = ipaddress.ip_address(address)
         except ValueError as err:
-            logger.warning(f"Invalid IPv4 network in system config autostart_restrict: {network_str}: {err}")
-    return False
+            logger.warning(f"Invalid IP address for client: {address}: {err}")
+            return False
+        if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+            ip = ip.ipv4_mapped
+        starts, ends = self._intervals[ip.version]
+        value = int(ip)
+        index = bisect_right(starts, value) - 1
+        return index >= 0 and value <= ends[index]
+
+
+@lru_cache(maxsize=8)
+def _compile(networks: tuple[str, ...] | None) -> AutostartRestriction:
+    return AutostartRestriction(list(networks) if networks is not None else None)
+
+
+def check_permission(ipv4address: str | None, config) -> bool:
+    """
+    Check whether the client is allowed to auto-start projects according to the given proxy configuration.
+
+    Handlers should use the restriction compiled at startup (RuntimeStorage.autostart_restriction) instead.
+    """
+    networks = tuple(config["autostart_restrict"]) if "autostart_restrict" in config else None
+    return _compile(networks).allows(ipv4address)
@@ -0,0 +1,143 @@
+"""Spreads the requests for a service across the containers (replicas) that run it"""
+
+from __future__ import annotations
+
+import bisect
+import logging
+import time
+import zlib
+
+from riptide_proxy import ENDPOINT_EJECT_TIME, LOGGER_NAME
+from tornado.httputil import HTTPServerRequest
+
+logger = logging.getLogger(LOGGER_NAME)
+
+ROUND_ROBIN = "round-robin"
+LEAST_OUTSTANDING = "least-outstanding"
+COOKIE_HASH = "cookie-hash"
+STRATEGIES = (ROUND_ROBIN, LEAST_OUTSTANDING, COOKIE_HASH)
+
+# Number of points of each endpoint on the hash ring
+_RING_POINTS = 64
+
+
+class Endpoints:
+    """
+    The upstream addresses of a service, with the state needed to balance requests across them.
+    The addresses are refreshed in place, so the state of addresses that are still in use is kept.
+    """
+
+    __slots__ = ("addresses", "refreshed_at", "outstanding", "ejected_until", "_next", "_ring")
+
+    def __init__(self, addresses: list[str], refreshed_at: float):
+        """
+        :param addresses:       Addresses (incl. scheme and port) of the containers of the service, at least one.
+        :param refreshed_at:    Time (time.monotonic) the addresses were received from the engine.
+        """
+        self.addresses = addresses
+        self.refreshed_at = refreshed_at
+        # Address => number of running upstream requests
+        self.outstanding: dict[str, int] = {}
+        # Address => time (time.monotonic) until which it is not used, because a connection to it failed
+        self.ejected_until: dict[str, float] = {}
+        self._next = 0
+        self._ring: tuple[list[int], list[str]] | None = None
+
+    def update(self, addresses: list[str], refreshed_at: float):
+        """Replace the addresses with ones newly received from the engine."""
+        self.refreshed_at = refreshed_at
+        if addresses == self.addresses:
+            return
+        self.addresses = addresses
+        self._ring = None
+        for address in list(self.ejected_until):
+            if address not in addresses:
+                del self.ejected_until[address]
+
+    def available(self, now: float) -> list[str]:
+        """The addresses that are not ejected. All addresses, if all of them are ejected."""
+        if not self.ejected_until:
+            return self.addresses
+        available = [address for address in self.addresses if self.ejected_until.get(address, 0.0) <= now]
+        if len(available) == len(self.addresses):
+            self.ejected_until.clear()
+        return available or self.addresses
+
+    def started(self, address: str):
+        """An upstream request to the address was started."""
+        self.outstanding[address] = self.outstanding.get(address, 0) + 1
+
+    def finished(self, address: str):
+        """An upstream request to the address was finished."""
+        remaining = self.outstanding.get(address, 0) - 1
+        if remaining > 0:
+            self.outstanding[address] = remaining
+        else:
+            self.outstanding.pop(address, None)
+
+    def ring(self) -> tuple[list[int], list[str]]:
+        """The hash ring of the addresses: sorted hashes and the address of each of them."""
+        if self._ring is None:
+            points = sorted(
+                (zlib.crc32(f"{address}#{i}".encode()), address)
+                for address in self.addresses
+                for i in range(_RING_POINTS)
+            )
+            self._ring = ([point for point, _ in points], [address for _, address in points])
+        return self._ring
+
+
+class LoadBalancer:
+    """
+    Picks the endpoint of a service for each request.
+
+    ``round-robin`` uses the endpoints in turn, ``least-outstanding`` the endpoint with the fewest running requests
+    and open WebSocket connections.
+    ``cookie-hash`` sends all requests with the same value of the affinity cookie (or without it, from the same client
+    IP) to the same endpoint, by consistent hashing, so only few clients move when endpoints are added or removed.
+    Endpoints a connection failed to are skipped for ENDPOINT_EJECT_TIME seconds.
+    """
+
+    def __init__(self, strategy: str = ROUND_ROBIN, affinity_cookie: str | None = None):
+        """
+        :param strategy:        One of STRATEGIES.
+        :param affinity_cookie: Only for cookie-hash: Name of the cookie whose value selects the endpoint.
+        """
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown load balancing strategy {strategy}.")
+        self.strategy = strategy
+        self.affinity_cookie = affinity_cookie
+
+    def pick(self, endpoints: Endpoints, request: HTTPServerRequest) -> str:
+        """The address to send the request to."""
+        if len(endpoints.addresses) == 1:
+            return endpoints.addresses[0]
+        available = endpoints.available(time.monotonic())
+        if self.strategy == LEAST_OUTSTANDING:
+            outstanding = endpoints.outstanding
+            return min(available, key=lambda address: outstanding.get(address, 0))
+        if self.strategy == COOKIE_HASH:
+            return self._pick_by_hash(endpoints, available, self._affinity_key(request))
+        endpoints._next = (endpoints._next + 1) % len(available)
+        return available[endpoints._next]
+
+    def eject(self, endpoints: Endpoints, address: str):
+        """Skip the address for a while, because a connection to it failed."""
+        if len(endpoints.addresses) > 1:
+            logger.warning(f"Could not connect to {address}, not using it for {ENDPOINT_EJECT_TIME} seconds.")
+        endpoints.ejected_until[address] = time.monotonic() + ENDPOINT_EJECT_TIME
+
+    def _affinity_key(self, request: HTTPServerRequest) -> str:
+        if self.affinity_cookie is not None and self.affinity_cookie in request.cookies:
+            return request.cookies[self.affinity_cookie].value
+        return request.remote_ip or ""
+
+    @staticmethod
+    def _pick_by_hash(endpoints: Endpoints, available: list[str], key: str) -> str:
+        hashes, addresses = endpoints.ring()
+        start = bisect.bisect(hashes, zlib.crc32(key.encode()))
+        for i in range(len(addresses)):
+            address = addresses[(start + i) % len(addresses)]
+            if address in available:
+                return address
+        return available[0]
@@ -0,0 +1,97 @@
+"""Bounded in-memory buffer with a batched background writer for line-based log files"""
+
+from __future__ import annotations
+
+import logging
+import sys
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Generic, TextIO, TypeVar
+
+import tornado.ioloop
+
+from riptide_proxy import LOGGER_NAME
+
+logger = logging.getLogger(LOGGER_NAME)
+R = TypeVar("R")
+
+
+class BatchedWriter(ABC, Generic[R]):
+    """
+    Writes records as lines to a file without blocking the IOLoop.
+
+    Records are only appended to a bounded ring buffer on the IOLoop. A periodic callback swaps the buffer out
+    and hands the batch to a single writer thread that formats and writes it.
+    If the writer can't keep up, the oldest records are dropped and the number of dropped records is logged.
+    """
+
+    def __init__(self, target: str, buffer_size: int, flush_interval: float):
+        """
+        :param target:          Path of the file (opened for appending) or "-" for stdout.
+        :param buffer_size:     Maximum number of records held in memory between two flushes.
+        :param flush_interval:  Time in seconds between two flushes.
+        """
+        self.target = target
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._buffer: deque[R] = deque(maxlen=buffer_size)
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix=f"riptide_proxy_{self.__class__.__name__}"
+        )
+        self._running_write: Future | None = None
+        self._periodic: tornado.ioloop.PeriodicCallback | None = None
+        self._file: TextIO | None = None
+
+    @abstractmethod
+    def format(self, record: R) -> str:
+        """Format a record as a line, including the line break. Called in the writer thread."""
+
+    def start(self):
+        """Open the target and start the periodic flush on the current IOLoop."""
+        if self.target == "-":
+            self._file = sys.stdout
+        else:
+            self._file = open(self.target, "a", encoding="utf-8")
+        self._periodic = tornado.ioloop.PeriodicCallback(self.flush, self.flush_interval * 1000)
+        self._periodic.start()
+
+    def append(self, record: R):
+        """Queue a record. Must be called from the IOLoop thread."""
+        if len(self._buffer) == self.buffer_size:
+            self.dropped += 1
+        self._buffer.append(record)
+
+    def flush(self):
+        """Hand all buffered records to the writer thread. Skipped while a previous batch is still being written."""
+        if not self._buffer or (self._running_write is not None and not self._running_write.done()):
+            return
+        batch = self._buffer
+        self._buffer = deque(maxlen=self.buffer_size)
+        if self.dropped:
+            logger.warning(f"{self.__class__.__name__}: buffer full, dropped {self.dropped} records.")
+            self.dropped = 0
+        self._running_write = self._executor.submit(self._write, batch)
+
+    def close(self):
+        """Stop the periodic flush and synchronously write everything that is left."""
+        if self._periodic is not None:
+            self._periodic.stop()
+            self._periodic = None
+        self._executor.shutdown(wait=True)
+        if self._buffer:
+            self._write(self._buffer)
+            self._buffer = deque(maxlen=self.buffer_size)
+        if self._file is not None and self._file is not sys.stdout:
+            self._file.close()
+        self._file = None
+
+    def _write(self, batch: deque[R]):
+        if self._file is None:
+            return
+        try:
+            self._file.write("".join(self.format(record) for record in batch))
+            self._file.flush()
+        except Exception as ex:
+            logger.error(f"{self.__class__.__name__}: could not write to {self.target}: {ex}")
@@ -0,0 +1,95 @@
+"""Collapses identical concurrent upstream GET requests into one"""
+
+from __future__ import annotations
+
+import asyncio
+from collections.abc import Hashable
+
+from tornado.httputil import HTTPHeaders, HTTPServerRequest
+
+# Request headers that are part of the key of a request. Responses that vary by other headers are not shared.
+KEY_HEADERS = (
+    "Host",
+    "Accept",
+    "Accept-Encoding",
+    "Accept-Language",
+    "Origin",
+    "If-None-Match",
+    "If-Modified-Since",
+    "X-Requested-With",
+)
+_KEY_HEADERS_LOWER = frozenset(header.lower() for header in KEY_HEADERS)
+# Requests with these headers are never collapsed
+_CREDENTIAL_HEADERS = ("Authorization", "Cookie", "Proxy-Authorization", "Range")
+
+
+class SharedResponse:
+    """An upstream response that is sent to all requests that waited for it."""
+
+    __slots__ = ("code", "reason", "headers", "body")
+
+    def __init__(self, code: int, reason: str | None, headers: HTTPHeaders, body: bytes):
+        self.code = code
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+
+class RequestCollapser:
+    """
+    Lets identical GET requests to the same upstream address share one upstream request while it is running, eg.
+    when a dev server is still building a bundle and multiple tabs request it.
+
+    Only requests without body and without credentials (cookies, authorization) are collapsed. Requests are
+    identical if their address, URI and KEY_HEADERS are. The first request (the leader) is sent, the others wait for
+    its response. Responses that set cookies, are private or vary by other headers are not shared, the waiting
+    requests are sent on their own then, as are they if the leader fails.
+    """
+
+    def __init__(self):
+        # Key => response of the running leader, None if it can't be shared
+        self._in_flight: dict[Hashable, asyncio.Future[SharedResponse | None]] = {}
+        # Number of requests that were answered with the response of another request
+        self.collapsed = 0
+
+    @staticmethod
+    def key(address: str, request: HTTPServerRequest) -> Hashable | None:
+        """The key of the request, None if it can't be collapsed."""
+        if request.method != "GET" or request.body:
+            return None
+        headers = request.headers
+        for header in _CREDENTIAL_HEADERS:
+            if header in headers:
+                return None
+        return (address, request.uri, *(headers.get(header) for header in KEY_HEADERS))
+
+    def leader(self, key: Hashable) -> asyncio.Future[SharedResponse | None] | None:
+        """
+        The response of the running request with the same key. If there is none, the request becomes the leader for
+        the key and must call finish.
+        """
+        running = self._in_flight.get(key)
+        if running is None:
+            self._in_flight[key] = asyncio.get_running_loop().create_future()
+        return running
+
+    def finish(self, key: Hashable, response: SharedResponse | None):
+        """Hand the response of the leader to the requests that wait for it."""
+        running = self._in_flight.pop(key, None)
+        if running is not None:
+            running.set_result(response)
+
+    @staticmethod
+    def shareable(headers: HTTPHeaders) -> bool:
+        """Whether a response with these headers can be sent to other clients."""
+        if "Set-Cookie" in headers:
+            return False
+        cache_control = headers.get("Cache-Control", "").lower()
+        if "private" in cache_control or "no-store" in cache_control:
+            return False
+        for vary in headers.get_list("Vary"):
+            for header in vary.split(","):
+                header = header.strip().lower()
+                if header and header not in _KEY_HEADERS_LOWER:
+                    return False
+        return True
@@ -0,0 +1,63 @@
+"""Routing to the addresses of containers in their own network, instead of the ports they publish on the host"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+
+from riptide.config.document.project import Project
+from riptide_proxy import DIRECT_ROUTING_PROBE_TIMEOUT, DIRECT_ROUTING_RETRY_INTERVAL, LOGGER_NAME
+from riptide_proxy.engine_adapter import AsyncEngine
+
+logger = logging.getLogger(LOGGER_NAME)
+
+
+class DirectRouting:
+    """
+    Finds the addresses of service containers in their container network (eg. the Docker bridge network), so requests
+    don't pass through the published port (docker-proxy or NAT) first.
+
+    Only engines that expose a Docker client (as riptide-engine-docker does) are supported. Each address is checked
+    with a TCP connection before it is used. If a container network address is not reachable from the proxy (eg. with
+    Docker Desktop, where containers run in a VM), direct routing is paused for DIRECT_ROUTING_RETRY_INTERVAL seconds
+    and the published ports are used.
+    """
+
+    def __init__(self, async_engine: AsyncEngine):
+        self.async_engine = async_engine
+        # Time (time.monotonic) until which container network addresses are not tried
+        self.paused_until = 0.0
+
+    async def addresses_for(self, project: Project, service_name: str) -> list[tuple[str, int]] | None:
+        """
+        The reachable container network addresses of the containers of the service, None if the published ports have
+        to be used.
+        """
+        if time.monotonic() < self.paused_until:
+            return None
+        addresses = await self.async_engine.network_addresses_for(project, service_name)
+        if not addresses:
+            return None
+        reachable = await asyncio.gather(*(_probe(*address) for address in addresses))
+        if None in reachable:
+            logger.warning(
+                f"Container network addresses of {project['name']}/{service_name} are not reachable, "
+                f"using published ports for the next {DIRECT_ROUTING_RETRY_INTERVAL} seconds."
+            )
+            self.paused_until = time.monotonic() + DIRECT_ROUTING_RETRY_INTERVAL
+            return None
+        return [address for address, ok in zip(addresses, reachable) if ok] or None
+
+
+async def _probe(host: str, port: int) -> bool | None:
+    """Whether the service accepts connections, None if the host is not reachable at all."""
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), DIRECT_ROUTING_PROBE_TIMEOUT)
+    except ConnectionRefusedError:
+        # The network is reachable, the service is just not listening (yet).
+        return False
+    except (OSError, asyncio.TimeoutError):
+        return None
+    writer.close()
+    return True
@@ -0,0 +1,87 @@
+"""
+Addresses of all containers of a service and the running services of all projects, for engines with a Docker client
+(like riptide-engine-docker). The engine API of riptide-lib only knows one container per service, no container
+network addresses and only the status of one project at a time.
+"""
+
+from __future__ import annotations
+
+import logging
+from functools import partial
+from typing import Any
+
+from riptide.config.document.project import Project
+from riptide.engine.abstract import AbstractEngine
+from riptide_proxy import LOGGER_NAME
+from riptide_proxy.engine_adapter import ContainerAddresses, RunningServices
+
+logger = logging.getLogger(LOGGER_NAME)
+
+# Labels riptide-engine-docker puts on the containers of a service
+DOCKER_LABEL_PROJECT = "riptide_project"
+DOCKER_LABEL_SERVICE = "riptide_service"
+
+
+def docker_container_addresses(engine: AbstractEngine) -> ContainerAddresses | None:
+    """The lookup of container addresses for AsyncEngine, None if the engine has no Docker client."""
+    client = _docker_client(engine)
+    if client is None:
+        return None
+    return partial(_container_addresses_for, engine, client)
+
+
+def docker_running_services(engine: AbstractEngine) -> RunningServices | None:
+    """The listing of running services for AsyncEngine, None if the engine has no Docker client."""
+    client = _docker_client(engine)
+    if client is None:
+        return None
+    return partial(_running_services, client)
+
+
+def _docker_client(engine: AbstractEngine) -> Any:
+    client: Any = getattr(engine, "client", None)
+    if client is None or not hasattr(client, "containers"):
+        return None
+    return client
+
+
+def _running_services(client: Any) -> dict[str, set[str]] | None:
+    """The names of the running services of all projects, by project name, from one listing of all containers."""
+    try:
+        containers = client.containers.list(filters={"label": [DOCKER_LABEL_PROJECT, DOCKER_LABEL_SERVICE]})
+    except Exception as ex:
+        logger.debug(f"Could not list the running containers: {ex}")
+        return None
+    running: dict[str, set[str]] = {}
+    for container in containers:
+        labels = container.labels
+        running.setdefault(labels[DOCKER_LABEL_PROJECT], set()).add(labels[DOCKER_LABEL_SERVICE])
+    return running
+
+
+def _container_addresses_for(
+    engine: AbstractEngine, client: Any, project: Project, service_name: str, network: bool
+) -> list[tuple[str, int]] | None:
+    """The published (or with network, the container network) addresses of the running containers of the service."""
+    try:
+        port = int(project["app"]["services"][service_name]["port"])
+        containers = client.containers.list(
+            filters={"label": [f"{DOCKER_LABEL_PROJECT}={project['name']}", f"{DOCKER_LABEL_SERVICE}={service_name}"]}
+        )
+        if not containers:
+            containers = [client.containers.get(engine.container_name_for(project, service_name))]  # type: ignore
+    except Exception as ex:
+        logger.debug(f"No container addresses for {project['name']}/{service_name}: {ex}")
+        return None
+    addresses = []
+    for container in containers:
+        settings = container.attrs["NetworkSettings"]
+        if network:
+            ip = next((net["IPAddress"] for net in settings["Networks"].values() if net.get("IPAddress")), None)
+            if ip:
+                addresses.append((ip, port))
+        else:
+            bindings = (settings.get("Ports") or {}).get(f"{port}/tcp")
+            if bindings:
+                addresses.append(("127.0.0.1", int(bindings[0]["HostPort"])))
+    return addresses
@@ -0,0 +1,152 @@
+"""Async access to the blocking engine API of riptide-lib"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections.abc import Callable, Hashable, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, TypeVar
+
+from riptide.config.document.project import Project
+from riptide.engine.abstract import AbstractEngine
+from riptide_proxy import ENGINE_MAX_WORKERS, ENGINE_STATUS_CACHE_TIMEOUT, LOGGER_NAME
+
+logger = logging.getLogger(LOGGER_NAME)
+
+T = TypeVar("T")
+
+# Blocking lookup of the addresses of the containers of a service: (project, service name, network) => the published
+# addresses (or with network, the container network addresses), None if they are not available.
+ContainerAddresses = Callable[[Project, str, bool], "list[tuple[str, int]] | None"]
+# Blocking listing of the running containers of all projects: project name => names of its running services, None if
+# it is not available.
+RunningServices = Callable[[], "dict[str, set[str]] | None"]
+
+
+class AsyncEngine:
+    """
+    Runs the blocking lookups of an engine in a thread pool and returns awaitables.
+
+    Concurrent lookups for the same project (and service) share one engine call, distinct lookups run in parallel.
+    Status results are reused for ENGINE_STATUS_CACHE_TIMEOUT seconds, so pages that show the status of many projects
+    query the engine at most once per project in that time, no matter how many clients request them. With a listing
+    of the running services, the status of many projects is taken from a single listing of all containers.
+    """
+
+    def __init__(
+        self,
+        engine: AbstractEngine,
+        max_workers: int = ENGINE_MAX_WORKERS,
+        container_addresses: ContainerAddresses | None = None,
+        running_services: RunningServices | None = None,
+    ):
+        """
+        :param container_addresses: Lookup of the addresses of all containers of a service, if the engine supports
+                                    it (see docker_containers). The engine API only knows one container per service.
+        :param running_services:    Listing of the running services of all projects, if the engine supports it (see
+                                    docker_containers). The engine API only has the status of one project.
+        """
+        self.engine = engine
+        self.container_addresses = container_addresses
+        self.running_services = running_services
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="riptide_proxy_engine")
+        self._running: dict[Hashable, asyncio.Future] = {}
+        # Project name => (time the engine was asked, status)
+        self._status_cache: dict[str, tuple[float, dict[str, bool]]] = {}
+        # Project name => time of the last call to forget
+        self._forgotten: dict[str, float] = {}
+
+    async def status(self, project: Project) -> dict[str, bool]:
+        """The engine status (running or not) of all services of the project."""
+        name = project["name"]
+        cached = self._cached_status(name)
+        if cached is not None:
+            return cached
+        asked_at = time.monotonic()
+        status = await self._call(("status", name), self.engine.status, project)
+        self._cache_status(name, asked_at, status)
+        return status
+
+    async def statuses(self, projects: Iterable[Project]) -> dict[str, dict[str, bool]]:
+        """
+        The engine status of all services of multiple projects, by project name. With a listing of the running
+        services, one listing is used for all projects that have no cached status, otherwise (or if the listing
+        fails) the engine is asked per project.
+        """
+        projects = list(projects)
+        if self.running_services is not None:
+            uncached = [project for project in projects if self._cached_status(project["name"]) is None]
+            if uncached:
+                asked_at = time.monotonic()
+                running = await self._call("running_services", self.running_services)
+                if running is not None:
+                    for project in uncached:
+                        running_in_project = running.get(project["name"], set())
+                        status = {name: name in running_in_project for name in project["app"]["services"]}
+                        self._cache_status(project["name"], asked_at, status)
+        results = await asyncio.gather(*(self.status(project) for project in projects))
+        return {project["name"]: result for project, result in zip(projects, results)}
+
+    def _cached_status(self, project_name: str) -> dict[str, bool] | None:
+        cached = self._status_cache.get(project_name)
+        if cached is not None and time.monotonic() - cached[0] <= ENGINE_STATUS_CACHE_TIMEOUT:
+            return cached[1]
+        return None
+
+    def _cache_status(self, project_name: str, asked_at: float, status: dict[str, bool]):
+        # Don't cache results the engine computed before the project was started or stopped.
+        if self._forgotten.get(project_name, 0.0) < asked_at:
+            self._status_cache[project_name] = (asked_at, status)
+
+    async def address_for(self, project: Project, service_name: str) -> tuple[str, int] | None:
+        """The address of the service container, None if it is not running."""
+        return await self._call(
+            ("address_for", project["name"], service_name), self.engine.address_for, project, service_name
+        )
+
+    async def addresses_for(self, project: Project, service_name: str) -> list[tuple[str, int]]:
+        """The addresses of all containers (replicas) of the service, empty if it is not running."""
+        if self.container_addresses is not None:
+            replicas = await self._call(
+                ("replica_addresses_for", project["name"], service_name),
+                self.container_addresses,
+                project,
+                service_name,
+                False,
+            )
+            if replicas:
+                return replicas
+        # Without container addresses, the engine resolves the (single) container itself.
+        address = await self.address_for(project, service_name)
+        return [address] if address is not None else []
+
+    async def network_addresses_for(self, project: Project, service_name: str) -> list[tuple[str, int]] | None:
+        """
+        The addresses of all containers of the service in their container network, with the port the service listens
+        on in the container. None if the engine doesn't expose them.
+        """
+        if self.container_addresses is None:
+            return None
+        return await self._call(
+            ("network_addresses_for", project["name"], service_name),
+            self.container_addresses,
+            project,
+            service_name,
+            True,
+        )
+
+    def forget(self, project_name: str):
+        """Drop cached results for the project, eg. because it was started or stopped."""
+        self._status_cache.pop(project_name, None)
+        self._forgotten[project_name] = time.monotonic()
+
+    async def _call(self, key: Hashable, fn: Callable[..., T], *args: Any) -> T:
+        future = self._running.get(key)
+        if future is None:
+            future = asyncio.wrap_future(self._executor.submit(fn, *args))
+            self._running[key] = future
+            future.add_done_callback(lambda done: self._running.pop(key) if self._running.get(key) is done else None)
+        # Shielded, so a waiter that is cancelled doesn't cancel the call for all others.
+        return await asyncio.shield(future)
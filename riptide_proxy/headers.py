@@ -0,0 +1,214 @@
+"""Filtering and rewriting of the headers of proxied requests and responses"""
+
+from __future__ import annotations
+
+import json
+import re
+
+from tornado.httputil import HTTPHeaders, HTTPServerRequest
+
+
+def normalize(name: str) -> str:
+    """A header name in the Http-Header-Case that HTTPHeaders uses for its keys."""
+    return "-".join([word.capitalize() for word in name.strip().split("-")])
+
+
+# Headers that only apply to one connection and are never forwarded (RFC 7230, section 6.1). Like all header sets
+# here in Http-Header-Case, so the names of HTTPHeaders can be looked up without converting them.
+HOP_BY_HOP = frozenset(
+    {
+        "Connection",
+        "Keep-Alive",
+        "Proxy-Authenticate",
+        "Proxy-Authorization",
+        "Proxy-Connection",
+        "Te",
+        "Trailer",
+        "Transfer-Encoding",
+        "Upgrade",
+    }
+)
+# Request headers not sent to the upstream server. The 100 Continue handshake is done by the HTTP client.
+SKIPPED_REQUEST_HEADERS = HOP_BY_HOP | {"Expect"}
+# Request headers not sent in the upstream WebSocket handshake, which the upstream connection does on its own.
+# Sec-WebSocket-Protocol is forwarded.
+SKIPPED_WEBSOCKET_HEADERS = HOP_BY_HOP | {
+    "Content-Length",
+    "Sec-Websocket-Key",
+    "Sec-Websocket-Version",
+    "Sec-Websocket-Extensions",
+    "Sec-Websocket-Accept",
+}
+# Response headers not sent to the client, because they are re-calculated for the response to the client
+SKIPPED_RESPONSE_HEADERS = HOP_BY_HOP | {"Content-Length"}
+# The same, when the upstream response is decompressed: The body is sent as it is then, without Content-Encoding.
+SKIPPED_DECOMPRESSED_RESPONSE_HEADERS = SKIPPED_RESPONSE_HEADERS | {"Content-Encoding"}
+
+# Values of Forwarded parameters that don't have to be quoted (RFC 7239, section 4)
+_TOKEN = re.compile(r"[!#$%&'*+.^_`|~0-9A-Za-z-]+")
+
+
+def connection_tokens(headers: HTTPHeaders) -> frozenset[str]:
+    """The headers listed in the Connection header, which are hop-by-hop headers as well (RFC 7230, section 6.1)."""
+    return frozenset(normalize(token) for value in headers.get_list("Connection") for token in value.split(","))
+
+
+def _forwarded_value(value: str) -> str:
+    return value if _TOKEN.fullmatch(value) else '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def peer_ip(request: HTTPServerRequest) -> str:
+    """
+    The address the request was received from. With xheaders, remote_ip is the client address from X-Real-Ip or
+    X-Forwarded-For, which any client can send, so access restrictions have to check this address instead.
+    """
+    context = getattr(request.connection, "context", None)
+    if context is None:
+        return request.remote_ip  # type: ignore
+    address = context.address
+    if isinstance(address, tuple) and address:
+        return address[0]
+    # Unix socket, like tornado does for remote_ip
+    return "0.0.0.0"
+
+
+class HeaderRules:
+    """
+    The compiled header rules of a project, for requests or for responses. They are applied in this order:
+
+    - ``{"remove": ["X-Powered-By"]}``: Remove headers.
+    - ``{"rewrite": [{"header": "Location", "pattern": "^http://", "replace": "https://"}]}``: Replace the matches of
+      a regular expression in all values of a header (see re.sub).
+    - ``{"set": {"X-Frame-Options": "DENY"}}``: Set headers, replacing existing values.
+    - ``{"add": {"Link": "</app.css>; rel=preload"}}``: Add a value to headers.
+    """
+
+    __slots__ = ("remove", "rewrite", "set", "add")
+
+    def __init__(self, rules: dict | None = None):
+        rules = rules or {}
+        self.remove = frozenset(normalize(name) for name in rules.get("remove", []))
+        self.rewrite = tuple(
+            (normalize(rule["header"]), re.compile(rule["pattern"]), rule["replace"])
+            for rule in rules.get("rewrite", [])
+        )
+        self.set = tuple((normalize(name), str(value)) for name, value in rules.get("set", {}).items())
+        self.add = tuple((normalize(name), str(value)) for name, value in rules.get("add", {}).items())
+
+    def __bool__(self):
+        return bool(self.remove or self.rewrite or self.set or self.add)
+
+    def __add__(self, other: HeaderRules) -> HeaderRules:
+        """The rules of both, the rules of other applied after these."""
+        combined = HeaderRules()
+        combined.remove = self.remove | other.remove
+        combined.rewrite = self.rewrite + other.rewrite
+        combined.set = self.set + other.set
+        combined.add = self.add + other.add
+        return combined
+
+    def apply(self, headers: HTTPHeaders):
+        for name in self.remove:
+            if name in headers:
+                del headers[name]
+        for name, pattern, replace in self.rewrite:
+            values = headers.get_list(name)
+            if values:
+                del headers[name]
+                for value in values:
+                    headers.add(name, pattern.sub(replace, value))
+        for name, value in self.set:
+            headers[name] = value
+        for name, value in self.add:
+            headers.add(name, value)
+
+
+class HeaderPipeline:
+    """
+    Builds the headers of upstream requests and of responses to clients from the headers received: Hop-by-hop headers
+    are removed, the proxy headers are added and the header rules of the project are applied.
+
+    The header rules are loaded from a JSON file that maps project names to ``{"request": rules, "response": rules}``
+    (see HeaderRules). The rules of the project name ``*`` apply to all projects, before their own rules. The rules of
+    each project are combined when they are loaded, so a request only looks up the rules of its project.
+    """
+
+    def __init__(self, rules: dict[str, dict[str, dict]] | None = None):
+        rules = rules or {}
+        default = rules.get("*", {})
+        self.default_request_rules = HeaderRules(default.get("request"))
+        self.default_response_rules = HeaderRules(default.get("response"))
+        # Project name => rules
+        self.request_rules: dict[str, HeaderRules] = {}
+        self.response_rules: dict[str, HeaderRules] = {}
+        for project_name, project_rules in rules.items():
+            if project_name != "*":
+                self.request_rules[project_name] = self.default_request_rules + HeaderRules(
+                    project_rules.get("request")
+                )
+                self.response_rules[project_name] = self.default_response_rules + HeaderRules(
+                    project_rules.get("response")
+                )
+
+    @classmethod
+    def from_file(cls, path: str) -> HeaderPipeline:
+        """
+        :raises OSError: if the file can't be read
+        :raises ValueError: if the file is not valid
+        """
+        with open(path) as f:
+            rules = json.load(f)
+        try:
+            return cls(rules)
+        except (KeyError, TypeError, AttributeError, re.error) as ex:
+            raise ValueError(f"Invalid header rules in {path}: {ex!r}") from ex
+
+    def request_headers(
+        self, request: HTTPServerRequest, project_name: str | None, skipped: frozenset[str] = SKIPPED_REQUEST_HEADERS
+    ) -> HTTPHeaders:
+        """
+        Headers for the upstream request: The request headers without the skipped headers and the headers listed in
+        Connection, plus the proxy headers (X-Real-Ip, X-Forwarded-For/-Host/-Proto, X-Scheme and Forwarded).
+        """
+        received = request.headers
+        if "Connection" in received:
+            skipped = skipped | connection_tokens(received)
+        headers = HTTPHeaders()
+        for name, value in received.get_all():
+            if name not in skipped:
+                headers.add(name, value)
+
+        peer = peer_ip(request)
+        forwarded_for = headers.get("X-Forwarded-For")
+        headers["X-Forwarded-For"] = f"{forwarded_for}, {peer}" if forwarded_for else peer
+        # IPv6 addresses are written in brackets
+        forwarded = f"for={_forwarded_value(f'[{peer}]' if ':' in peer else peer)};proto={request.protocol}"
+        if request.host:
+            forwarded += f";host={_forwarded_value(request.host)}"
+        headers["Forwarded"] = f"{headers['Forwarded']}, {forwarded}" if "Forwarded" in headers else forwarded
+        # Like X-Forwarded-Proto (see xheaders of HTTPServer), the host of a proxy in front of this one is kept.
+        if "X-Forwarded-Host" not in headers:
+            headers["X-Forwarded-Host"] = request.host
+        headers["X-Real-Ip"] = request.remote_ip  # type: ignore
+        headers["X-Forwarded-Proto"] = request.protocol
+        headers["X-Scheme"] = request.protocol
+
+        rules = self.request_rules.get(project_name, self.default_request_rules)  # type: ignore
+        if rules:
+            rules.apply(headers)
+        return headers
+
+    def response_headers(self, received: HTTPHeaders, project_name: str | None, use_compression: bool) -> HTTPHeaders:
+        """Headers for the response to the client: The upstream response headers without the re-calculated ones."""
+        skipped = SKIPPED_RESPONSE_HEADERS if use_compression else SKIPPED_DECOMPRESSED_RESPONSE_HEADERS
+        if "Connection" in received:
+            skipped = skipped | connection_tokens(received)
+        headers = HTTPHeaders()
+        for name, value in received.get_all():
+            if name not in skipped:
+                headers.add(name, value)
+
+        rules = self.response_rules.get(project_name, self.default_response_rules)  # type: ignore
+        if rules:
+            rules.apply(headers)
+        return headers
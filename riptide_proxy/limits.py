@@ -0,0 +1,184 @@
+"""Limits the number of concurrent upstream requests per project and per client, with fair queuing across projects"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import deque
+
+from riptide_proxy import LOGGER_NAME
+
+logger = logging.getLogger(LOGGER_NAME)
+
+# Names of the limits of ConcurrencyLimiter
+LIMITS = ("max_total", "max_per_project", "max_per_client", "queue_size", "queue_timeout", "retry_after")
+
+
+class LimitExceeded(Exception):
+    def __init__(self, reason: str, retry_after: int) -> None:
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def __str__(self):
+        return self.reason
+
+
+class ConcurrencyLimiter:
+    """
+    Hands out slots for upstream requests.
+
+    A request runs immediately if the total limit and the limit of its project are not reached. Otherwise it waits in
+    a bounded queue of its project. Whenever a slot is free, the queues of the projects are served round-robin,
+    so a project with a long queue can't starve the other projects. Requests of a client over its limit, requests that
+    don't fit into the queue and requests that waited too long are rejected with LimitExceeded.
+
+    Requests whose response is streamed (eg. Server-Sent Events) give their slot back once streaming starts.
+    """
+
+    def __init__(
+        self,
+        max_total: int,
+        max_per_project: int,
+        max_per_client: int,
+        queue_size: int,
+        queue_timeout: float,
+        retry_after: int,
+    ):
+        """
+        :param max_total:       Maximum number of concurrent upstream requests.
+        :param max_per_project: Maximum number of concurrent upstream requests per project.
+        :param max_per_client:  Maximum number of concurrent and queued requests per client IP.
+        :param queue_size:      Maximum number of waiting requests per project.
+        :param queue_timeout:   Maximum time in seconds a request waits for a slot.
+        :param retry_after:     Seconds rejected clients are told to wait (Retry-After header).
+        """
+        self.max_total = max_total
+        self.max_per_project = max_per_project
+        self.max_per_client = max_per_client
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.active = 0
+        self.active_per_project: dict[str, int] = {}
+        self.per_client: dict[str, int] = {}
+        self.rejected = 0
+        self._queues: dict[str, deque[asyncio.Future[None]]] = {}
+        # Projects with waiting requests, in the order they are served
+        self._waiting_projects: deque[str] = deque()
+
+    async def acquire(self, project_name: str, client: str):
+        """
+        Wait for a slot. Must be followed by exactly one call to release for the same project and client.
+
+        :raises LimitExceeded: if the request is rejected
+        """
+        if self.per_client.get(client, 0) >= self.max_per_client:
+            self._reject()
+            raise LimitExceeded(f"Too many requests from client {client}.", self.retry_after)
+
+        if (
+            self.active < self.max_total
+            and self.active_per_project.get(project_name, 0) < self.max_per_project
+            and project_name not in self._queues
+        ):
+            self._take(project_name)
+            self.per_client[client] = self.per_client.get(client, 0) + 1
+            return
+
+        queue = self._queues.get(project_name)
+        if queue is None:
+            queue = self._queues[project_name] = deque()
+            self._waiting_projects.append(project_name)
+        if len(queue) >= self.queue_size:
+            self._reject()
+            raise LimitExceeded(f"Too many requests for project {project_name}.", self.retry_after)
+
+        self.per_client[client] = self.per_client.get(client, 0) + 1
+        waiter: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        queue.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except BaseException as ex:
+            if waiter.done():
+                # The slot was handed out, but the request doesn't use it anymore.
+                self.release(project_name, client)
+            else:
+                waiter.cancel()
+                self._release_client(client)
+                self._dispatch()
+            if isinstance(ex, asyncio.TimeoutError):
+                self._reject()
+                raise LimitExceeded(f"Timed out waiting for project {project_name}.", self.retry_after) from ex
+            raise
+
+    def release(self, project_name: str, client: str):
+        """Free the slot of a request."""
+        self.active -= 1
+        remaining = self.active_per_project[project_name] - 1
+        if remaining:
+            self.active_per_project[project_name] = remaining
+        else:
+            del self.active_per_project[project_name]
+        self._release_client(client)
+        self._dispatch()
+
+    def reconfigure(self, **limits: float):
+        """
+        Change limits at runtime, by the names of the arguments of the constructor. Waiting requests get the slots
+        that became free, running requests over a lowered limit are not interrupted.
+        """
+        for name, value in limits.items():
+            if name not in LIMITS:
+                raise ValueError(f"Unknown limit {name}.")
+            setattr(self, name, value)
+        self._dispatch()
+
+    def limits(self) -> dict[str, float]:
+        """The current limits, by the names of the arguments of the constructor."""
+        return {name: getattr(self, name) for name in LIMITS}
+
+    def queued(self, project_name: str) -> int:
+        """Number of requests currently waiting for a slot of the project."""
+        queue = self._queues.get(project_name)
+        return sum(1 for waiter in queue if not waiter.done()) if queue else 0
+
+    def queued_per_project(self) -> dict[str, int]:
+        """Number of requests currently waiting for a slot, by project."""
+        return {project_name: self.queued(project_name) for project_name in self._queues}
+
+    def _take(self, project_name: str):
+        self.active += 1
+        self.active_per_project[project_name] = self.active_per_project.get(project_name, 0) + 1
+
+    def _release_client(self, client: str):
+        remaining = self.per_client[client] - 1
+        if remaining:
+            self.per_client[client] = remaining
+        else:
+            del self.per_client[client]
+
+    def _reject(self):
+        self.rejected += 1
+        if self.rejected % 100 == 1:
+            logger.warning(f"Concurrency limits reached, {self.rejected} requests rejected so far.")
+
+    def _dispatch(self):
+        """Hand out free slots to waiting requests, one project at a time."""
+        blocked = 0
+        while self.active < self.max_total and blocked < len(self._waiting_projects):
+            project_name = self._waiting_projects[0]
+            queue = self._queues[project_name]
+            while queue and queue[0].done():
+                # Cancelled while waiting
+                queue.popleft()
+            if not queue:
+                self._waiting_projects.popleft()
+                del self._queues[project_name]
+                continue
+            self._waiting_projects.rotate(-1)
+            if self.active_per_project.get(project_name, 0) >= self.max_per_project:
+                blocked += 1
+                continue
+            blocked = 0
+            self._take(project_name)
+            queue.popleft().set_result(None)
@@ -1,76 +1,327 @@
+import asyncio
 import gc
-from re import Pattern
+import html
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
 import tornado.httpclient
-import tornado.routing
+import tornado.ioloop
 import tornado.web
-from guppy import hpy
+from riptide_proxy.project_loader import RuntimeStorage
 from riptide_proxy.server.http import ProxyHttpHandler
+from riptide_proxy.server.routing import HostnameMatcher
 
-h = hpy()
+# All heavy profiling work runs here, one job at a time, so it doesn't block the IOLoop.
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="riptide_proxy_profiling")
 
+# Upper bound for the duration of time-bounded profiling requests, in seconds
+MAX_PROFILE_SECONDS = 120
+DEFAULT_PROFILE_SECONDS = 10
+# Interval of the CPU sampler, in seconds
+CPU_SAMPLE_INTERVAL = 0.005
+# Interval of the IOLoop lag probe, in seconds
+LOOP_PROBE_INTERVAL = 0.01
+# Callbacks running longer than this are reported as slow by the IOLoop report, in seconds
+SLOW_CALLBACK_DURATION = 0.05
 
-def get_profiling_route(hostname):
-    return [
-        (HostnameMatcher(r"/", hostname), ProfileHttpHandler, {}),
+# guppy session for heap snapshots, created on first use. guppy is optional, see get_profiling_route.
+_hpy = None
+
+
+def get_profiling_route(hostname, runtime_storage: RuntimeStorage, heap: bool):
+    """The profiling routes. The heap report and /heap/diff need guppy and are only available if heap is set."""
+    routes = [
+        (HostnameMatcher(r"/", hostname), ProfileHttpHandler, {"heap": heap}),
+        (HostnameMatcher(r"/cpu", hostname), CpuProfileHandler, {}),
+        (HostnameMatcher(r"/loop", hostname), LoopReportHandler, {}),
+        (HostnameMatcher(r"/stalls", hostname), StallReportHandler, {"runtime_storage": runtime_storage}),
     ]
+    if heap:
+        routes.append((HostnameMatcher(r"/heap/diff", hostname), HeapDiffHandler, {}))
+    return routes
+
+
+def current_heap():
+    """A guppy snapshot of the current heap."""
+    global _hpy
+    if _hpy is None:
+        from guppy import hpy
+
+        _hpy = hpy()
+    return _hpy.heap()
 
 
-class ProfileHttpHandler(tornado.web.RequestHandler):
+class BaseProfileHandler(tornado.web.RequestHandler):
     SUPPORTED_METHODS = ("GET",)
 
     def compute_etag(self):
         return None  # disable tornado Etag
 
+    def get_seconds(self) -> float:
+        """Duration requested with the ``seconds`` query argument, bounded by MAX_PROFILE_SECONDS."""
+        try:
+            seconds = float(self.get_query_argument("seconds", str(DEFAULT_PROFILE_SECONDS)))
+        except ValueError as ex:
+            raise tornado.web.HTTPError(400, "seconds must be a number") from ex
+        return min(max(seconds, 0.1), MAX_PROFILE_SECONDS)
+
+
+class ProfileHttpHandler(BaseProfileHandler):
+    def initialize(self, heap: bool):
+        self.heap = heap
+
     async def get(self):
         """
         Print the current heap usage
         :return:
         """
-        heap = h.heap()
         self.write("<code><pre>")
-        self.write("\n\n=== gc: INSTANCES OF ProxyHttpHandler ==\n")
-        self.write(f"{sum(1 for o in gc.get_referrers(ProxyHttpHandler))}\n")
-        self.write("\n\n=== gc: INSTANCES OF AsyncHTTPClient ==\n")
-        self.write(f"{sum(1 for o in gc.get_referrers(tornado.httpclient.AsyncHTTPClient))}\n")
+        self.write(
+            "Other endpoints:\n"
+            f"  /cpu?seconds={DEFAULT_PROFILE_SECONDS}[&amp;format=svg]  sampling CPU profile of the IOLoop thread\n"
+            f"  /loop?seconds={DEFAULT_PROFILE_SECONDS}                 IOLoop lag and slow callbacks\n"
+            "  /stalls                          IOLoop stalls detected by the watchdog\n"
+        )
+        if not self.heap:
+            self.write("\nInstall guppy3 for the heap report and /heap/diff.\n")
+            return
+        self.write(f"  /heap/diff?seconds={DEFAULT_PROFILE_SECONDS}            heap growth between two snapshots\n")
+        report = await tornado.ioloop.IOLoop.current().run_in_executor(executor, self.heap_report)
+        self.write(html.escape(report))
 
-        self.write("\n\n=== DEFAULT VIEW ==\n")
-        self.write(str(heap))
+    @staticmethod
+    def heap_report() -> str:
+        heap = current_heap()
+        out = []
+        out.append("\n\n=== gc: INSTANCES OF ProxyHttpHandler ==\n")
+        out.append(f"{sum(1 for o in gc.get_referrers(ProxyHttpHandler))}\n")
+        out.append("\n\n=== gc: INSTANCES OF AsyncHTTPClient ==\n")
+        out.append(f"{sum(1 for o in gc.get_referrers(tornado.httpclient.AsyncHTTPClient))}\n")
 
-        self.write("\n\n=== BYTYPE VIEW ==\n")
-        self.write(str(heap.bytype))
+        out.append("\n\n=== DEFAULT VIEW ==\n")
+        out.append(str(heap))
 
-        self.write("\n\n=== BYRCS VIEW ==\n")
-        self.write(str(heap.byrcs))
+        out.append("\n\n=== BYTYPE VIEW ==\n")
+        out.append(str(heap.bytype))
+
+        out.append("\n\n=== BYRCS VIEW ==\n")
+        out.append(str(heap.byrcs))
 
         for i in range(0, 5):
             if i <= len(heap.bytype):
-                self.write(f"\n\n=== BYRCRS[{i}].byclodo ==\n")
-                self.write(str(heap.byrcs[i].byclodo))
+                out.append(f"\n\n=== BYRCRS[{i}].byclodo ==\n")
+                out.append(str(heap.byrcs[i].byclodo))
 
         for i in range(0, 5):
             if i <= len(heap.bytype):
-                self.write(f"\n\n=== BYRCRS[{i}].byid ==\n")
-                self.write(str(heap.byrcs[i].byid))
+                out.append(f"\n\n=== BYRCRS[{i}].byid ==\n")
+                out.append(str(heap.byrcs[i].byid))
 
         for i in range(0, 5):
             if i <= len(heap.bytype):
-                self.write(f"\n\n=== BYRCRS[{i}].byvia ==\n")
-                self.write(str(heap.byrcs[i].byvia))
+                out.append(f"\n\n=== BYRCRS[{i}].byvia ==\n")
+                out.append(str(heap.byrcs[i].byvia))
 
         for i in range(0, 5):
             if i <= len(heap.bytype):
-                self.write(f"\n\n=== BYRCRS[{i}].referents ==\n")
-                self.write(str(heap.byrcs[i].referents))
+                out.append(f"\n\n=== BYRCRS[{i}].referents ==\n")
+                out.append(str(heap.byrcs[i].referents))
+        return "".join(out)
+
+
+class HeapDiffHandler(BaseProfileHandler):
+    async def get(self):
+        """
+        Take two heap snapshots ``seconds`` apart and print the growth per type.
+        Only the per-type statistics of the snapshots are kept, so no objects are kept alive in between.
+        """
+        seconds = self.get_seconds()
+        ioloop = tornado.ioloop.IOLoop.current()
+        before = await ioloop.run_in_executor(executor, heap_stats_by_type)
+        await asyncio.sleep(seconds)
+        after = await ioloop.run_in_executor(executor, heap_stats_by_type)
+
+        rows = []
+        for kind in before.keys() | after.keys():
+            count_before, size_before = before.get(kind, (0, 0))
+            count_after, size_after = after.get(kind, (0, 0))
+            if count_before != count_after or size_before != size_after:
+                rows.append((size_after - size_before, count_after - count_before, count_after, size_after, kind))
+        rows.sort(key=lambda row: row[0], reverse=True)
+
+        self.set_header("Content-Type", "text/plain; charset=UTF-8")
+        self.write(f"Heap diff over {seconds:.1f}s, sorted by size growth\n\n")
+        self.write(f"{'size diff':>12} {'count diff':>11} {'count':>9} {'size':>12}  type\n")
+        for size_diff, count_diff, count, size, kind in rows:
+            self.write(f"{size_diff:>+12} {count_diff:>+11} {count:>9} {size:>12}  {kind}\n")
+
+
+def heap_stats_by_type() -> dict[str, tuple[int, int]]:
+    """Returns a mapping of type name => (object count, total size) of the current heap."""
+    stat = current_heap().bytype.partition.get_stat()
+    return {row.name: (row.count, row.size) for row in stat.get_rows()}
+
+
+class CpuProfileHandler(BaseProfileHandler):
+    async def get(self):
+        """
+        Sample the stack of the IOLoop thread for ``seconds`` and return it as collapsed stacks
+        (``format=collapsed``, the default, compatible with flamegraph.pl and speedscope) or as an SVG flamegraph
+        (``format=svg``). The sampler runs in its own thread.
+        """
+        seconds = self.get_seconds()
+        output_format = self.get_query_argument("format", "collapsed")
+        if output_format not in ("collapsed", "svg"):
+            raise tornado.web.HTTPError(400, "format must be collapsed or svg")
+        stacks = await tornado.ioloop.IOLoop.current().run_in_executor(
+            executor, sample_stacks, threading.get_ident(), seconds, CPU_SAMPLE_INTERVAL
+        )
+        if output_format == "svg":
+            self.set_header("Content-Type", "image/svg+xml")
+            self.write(render_flamegraph(stacks))
+        else:
+            self.set_header("Content-Type", "text/plain; charset=UTF-8")
+            self.write("".join(f"{stack} {count}\n" for stack, count in stacks.most_common()))
+
+
+def sample_stacks(thread_id: int, seconds: float, interval: float) -> Counter[str]:
+    """Sample the stack of the given thread every interval seconds. Returns a counter of collapsed stacks."""
+    stacks: Counter[str] = Counter()
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        frame = sys._current_frames().get(thread_id)
+        if frame is not None:
+            parts = []
+            while frame is not None:
+                code = frame.f_code
+                parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stacks[";".join(reversed(parts))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+def render_flamegraph(stacks: Counter[str], width=1200, row_height=16) -> str:
+    """Render collapsed stacks as a minimal SVG flamegraph (root at the bottom)."""
+    # Build a tree of (children, count) from the collapsed stacks
+    root: dict = {}
+    total = sum(stacks.values())
+    for stack, count in stacks.items():
+        node = root
+        for name in stack.split(";"):
+            child = node.setdefault(name, [{}, 0])
+            child[1] += count
+            node = child[0]
+
+    rects = []
+    max_depth = 0
+
+    def layout(children: dict, x: float, depth: int):
+        nonlocal max_depth
+        max_depth = max(max_depth, depth)
+        for name, (grandchildren, count) in sorted(children.items()):
+            w = width * count / total
+            if w >= 0.5:
+                rects.append((x, depth, w, name, count))
+                layout(grandchildren, x, depth + 1)
+            x += w
+
+    if total:
+        layout(root, 0.0, 0)
+    height = (max_depth + 1) * row_height
+    out = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'font-family="monospace" font-size="11">'
+    ]
+    for x, depth, w, name, count in rects:
+        y = height - (depth + 1) * row_height
+        label = html.escape(name)
+        hue = 20 + (hash(name) % 40)
+        out.append(
+            f"<g><title>{label} ({count} samples, {100 * count / total:.1f}%)</title>"
+            f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{row_height - 1}" fill="hsl({hue},90%,60%)"/>'
+        )
+        if w > 40:
+            out.append(f'<text x="{x + 2:.1f}" y="{y + row_height - 4}">{label[: int(w / 7)]}</text>')
+        out.append("</g>")
+    out.append("</svg>")
+    return "".join(out)
+
+
+class LoopReportHandler(BaseProfileHandler):
+    # One measurement at a time, they replace asyncio.Handle._run
+    measuring = asyncio.Lock()
+
+    async def get(self):
+        """
+        Measure the IOLoop lag for ``seconds`` by scheduling a probe every LOOP_PROBE_INTERVAL and comparing the
+        time it actually ran to the time it was scheduled for. During the measurement, callbacks that run longer
+        than SLOW_CALLBACK_DURATION are reported. They are timed by a wrapper of asyncio.Handle._run, not by asyncio's
+        debug mode, which slows down every callback and would distort the lag. Concurrent requests wait for each other.
+        """
+        seconds = self.get_seconds()
+        loop = asyncio.get_running_loop()
+        slow_callbacks: list[str] = []
+        lags = []
+        async with self.measuring:
+            run = asyncio.Handle._run
+
+            def timed_run(handle: asyncio.Handle):
+                started = time.perf_counter()
+                run(handle)
+                duration = time.perf_counter() - started
+                if duration >= SLOW_CALLBACK_DURATION:
+                    # Steps of tasks are scheduled as task_wakeup of the task, name the task (with its coroutine)
+                    # instead.
+                    owner = getattr(handle._callback, "__self__", None)  # type: ignore
+                    described = owner if isinstance(owner, asyncio.Task) else handle
+                    slow_callbacks.append(f"Executing {described!r} took {duration:.3f} seconds")
+
+            asyncio.Handle._run = timed_run  # type: ignore
+            try:
+                end = loop.time() + seconds
+                while loop.time() < end:
+                    expected = loop.time() + LOOP_PROBE_INTERVAL
+                    await asyncio.sleep(LOOP_PROBE_INTERVAL)
+                    lags.append(max(loop.time() - expected, 0.0))
+            finally:
+                asyncio.Handle._run = run  # type: ignore
+
+        lags.sort()
+        self.set_header("Content-Type", "text/plain; charset=UTF-8")
+        self.write(
+            f"=== IOLoop lag over {seconds:.1f}s ({len(lags)} probes every {LOOP_PROBE_INTERVAL * 1000:.0f}ms) ==\n"
+        )
+        if lags:
+            self.write(f"mean: {1000 * sum(lags) / len(lags):.3f}ms\n")
+            for name, quantile in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99)):
+                self.write(f"{name}:  {1000 * lags[min(int(len(lags) * quantile), len(lags) - 1)]:.3f}ms\n")
+            self.write(f"max:  {1000 * lags[-1]:.3f}ms\n")
+        self.write(f"\n\n=== Callbacks slower than {SLOW_CALLBACK_DURATION * 1000:.0f}ms ==\n")
+        for message in slow_callbacks:
+            self.write(message + "\n")
 
 
-class HostnameMatcher(tornado.routing.PathMatches):
-    def __init__(self, path_pattern: str | Pattern, hostname: str) -> None:
-        self.hostname = hostname
-        super().__init__(path_pattern)
+class StallReportHandler(BaseProfileHandler):
+    def initialize(self, runtime_storage: RuntimeStorage):
+        self.runtime_storage = runtime_storage
 
-    def match(self, request):
-        """Match path and hostname"""
-        if request.host_name != self.hostname:
-            return None
-        return super().match(request)
+    def get(self):
+        """Print the IOLoop stall statistics and the most recent stalls recorded by the watchdog."""
+        watchdog = self.runtime_storage.watchdog
+        self.set_header("Content-Type", "text/plain; charset=UTF-8")
+        if watchdog is None:
+            self.write("The IOLoop watchdog is disabled.\n")
+            return
+        self.write(f"=== IOLoop stalls longer than {watchdog.threshold * 1000:.0f}ms ==\n")
+        self.write(f"count: {watchdog.stall_count}\n")
+        self.write(f"total: {watchdog.total_stall_time * 1000:.0f}ms\n")
+        self.write(f"max:   {watchdog.max_stall_time * 1000:.0f}ms\n")
+        for stall in reversed(watchdog.recent_stalls):
+            started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(stall.wall_started))
+            self.write(f"\n\n=== {started}: {stall.describe()} ==\n")
+            self.write("".join(stall.stack))
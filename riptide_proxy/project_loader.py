@@ -2,25 +2,63 @@
 
 from __future__ import annotations
 
+import asyncio
+import copy
+import json
 import logging
+import os
+import sys
 import time
 from enum import Enum
-from types import SimpleNamespace
-from typing import Any, Generic, TypeVar
+from typing import TYPE_CHECKING, Generic, TypeVar
 
 from riptide.config.document.project import Project
 from riptide.config.document.service import DOMAIN_PROJECT_SERVICE_SEP
-from riptide.config.loader import load_config, load_projects
+from riptide.config.files import riptide_projects_file
+from riptide.config.loader import LOCAL_PROJECT_FILENAME, load_config, load_projects
 from riptide.engine.abstract import AbstractEngine
-from riptide_proxy import CNT_ADRESS_CACHE_TIMEOUT, LOGGER_NAME, PROJECT_CACHE_TIMEOUT
+from riptide_proxy import (
+    CNT_ADRESS_CACHE_TIMEOUT,
+    ENDPOINT_REFRESH_INTERVAL,
+    LOGGER_NAME,
+    PROJECT_CACHE_TIMEOUT,
+    RESOLVE_CACHE_SIZE,
+    RESOLVE_CACHE_TIMEOUT,
+    UNKNOWN_PROJECT_CACHE_SIZE,
+    UNKNOWN_PROJECT_CACHE_TIMEOUT,
+)
+from riptide_proxy.autostart_restrict import AutostartRestriction
+from riptide_proxy.balancer import Endpoints, LoadBalancer
+from riptide_proxy.collapse import RequestCollapser
+from riptide_proxy.direct_routing import DirectRouting
+from riptide_proxy.docker_containers import docker_container_addresses, docker_running_services
+from riptide_proxy.engine_adapter import AsyncEngine
+from riptide_proxy.headers import HeaderPipeline
+from riptide_proxy.readiness import ReadinessCheck
+from riptide_proxy.static_files import StaticFiles
+from riptide_proxy.status import StatusBoard
+from riptide_proxy.tracing import span
+
+if TYPE_CHECKING:
+    from riptide_proxy.access_log import AccessLog
+    from riptide_proxy.limits import ConcurrencyLimiter
+    from riptide_proxy.server.connections import ClientConnections
+    from riptide_proxy.tracing import Trace, Tracer
+    from riptide_proxy.traffic import TrafficMeter
+    from riptide_proxy.watchdog import LoopWatchdog
 
 logger = logging.getLogger(LOGGER_NAME)
 T = TypeVar("T")
 
 
-class CacheEntry(SimpleNamespace, Generic[T]):
-    data: T
-    time: float
+class CacheEntry(Generic[T]):
+    """A cached value and the time (time.monotonic) it was cached or last used."""
+
+    __slots__ = ("data", "time")
+
+    def __init__(self, data: T, time: float):
+        self.data = data
+        self.time = time
 
 
 class RuntimeStorage:
@@ -28,17 +66,119 @@ class RuntimeStorage:
         self,
         projects_mapping: dict[str, str],
         project_cache: dict[str, CacheEntry[Project]],
-        ip_cache: dict[str, CacheEntry[str]],
+        ip_cache: dict[str, CacheEntry[Endpoints]],
         engine: AbstractEngine,
+        autostart_restriction: AutostartRestriction,
         use_compression=False,
+        access_log: AccessLog | None = None,
+        tracer: Tracer | None = None,
+        watchdog: LoopWatchdog | None = None,
+        limiter: ConcurrencyLimiter | None = None,
+        direct_routing=False,
+        balancer: LoadBalancer | None = None,
+        static_files: StaticFiles | None = None,
+        collapse_requests=False,
+        readiness: ReadinessCheck | None = None,
+        traffic: TrafficMeter | None = None,
+        client_connections: ClientConnections | None = None,
+        header_pipeline: HeaderPipeline | None = None,
     ):
         self.projects_mapping = projects_mapping
-        # A cache of projects. Contains a mapping (project file path) => [project object, age]
+        # Version of projects.json that projects_mapping was read from, see refresh_projects_mapping
+        self.projects_version: tuple[int, int] | None = None
+        # Names of projects that are not in projects_mapping => time they were requested last
+        self.unknown_projects: dict[str, float] = {}
+        # A cache of fully loaded projects. Contains a mapping (project file path) => [project object, age].
+        # Projects that were not used for PROJECT_CACHE_TIMEOUT are removed.
         self.project_cache = project_cache
-        # A cache of ip addresses for services. Contains a mapping (project_name + "__" + service_name) => [address, age]
+        # Routing descriptors of projects. Contains a mapping (project file path) => route, valid for the file version
+        # in the route
+        self.route_cache: dict[str, ProjectRoute] = {}
+        # A cache of ip addresses for services. Contains a mapping (project_name + "__" + service_name)
+        # => [endpoints, age]
         self.ip_cache = ip_cache
+        # Running background refreshes of endpoints, by ip cache key
+        self.endpoint_refreshes: dict[str, asyncio.Task] = {}
+        # A cache of successful resolve_project results. Contains a mapping (project name, requested service name)
+        # => [resolution, age], so all hostnames of a service share one entry.
+        self.resolve_cache: dict[tuple[str, str | None], CacheEntry[Resolution]] = {}
         self.engine = engine
+        # Async access to the engine, shares engine calls and caches status results.
+        self.async_engine = AsyncEngine(
+            engine,
+            container_addresses=docker_container_addresses(engine),
+            running_services=docker_running_services(engine),
+        )
         self.use_compression = use_compression
+        # Structured access log, if enabled.
+        self.access_log = access_log
+        # Request tracer, if enabled.
+        self.tracer = tracer
+        # IOLoop stall detector, if enabled.
+        self.watchdog = watchdog
+        # The compiled autostart_restrict setting.
+        self.autostart_restriction = autostart_restriction
+        # Limits for concurrent upstream requests, if enabled.
+        self.limiter = limiter
+        # Routing to container network addresses instead of published ports, if enabled.
+        self.direct_routing = DirectRouting(self.async_engine) if direct_routing else None
+        # Picks one of the endpoints of a service for each request.
+        self.balancer = balancer if balancer is not None else LoadBalancer()
+        # Static files served from the source directories of projects, if enabled.
+        self.static_files = static_files
+        # Shares upstream requests between identical concurrent GET requests, if enabled.
+        self.collapser = RequestCollapser() if collapse_requests else None
+        # Checks whether the services of autostarted projects accept requests.
+        self.readiness = readiness if readiness is not None else ReadinessCheck()
+        # Snapshot of the status of all projects, shared by the landing page and the status API.
+        self.status_board = StatusBoard()
+        # Throughput per project, if the control API is enabled.
+        self.traffic = traffic
+        # Limits and counts of client connections.
+        self.client_connections = client_connections
+        # Filters and rewrites the headers of upstream requests and responses, with the header rules of projects.
+        self.header_pipeline = header_pipeline if header_pipeline is not None else HeaderPipeline()
+
+    def reconfigure(self, proxy_config, keep_projects=True, keep_resolutions=True) -> RuntimeStorage:
+        """
+        Return a copy of this storage for a reloaded system config. The caches are shared with this storage,
+        unless they are not valid for the new config anymore.
+
+        :param proxy_config:        The proxy section of the new system config.
+        :param keep_projects:       Whether the cached projects (that contain the system config) are still valid.
+        :param keep_resolutions:    Whether cached hostname resolutions (that depend on the proxy URL) are still valid.
+        """
+        storage = copy.copy(self)
+        storage.autostart_restriction = AutostartRestriction.from_config(proxy_config)
+        storage.use_compression = True if "compression" in proxy_config and proxy_config["compression"] else False
+        if not keep_projects:
+            storage.project_cache = {}
+            storage.route_cache = {}
+        if not keep_resolutions:
+            storage.resolve_cache = {}
+        return storage
+
+
+class ProjectRoute:
+    """
+    The parts of a project that are needed to route requests to it. Much smaller than the project itself and
+    valid as long as the project file (and its riptide.local.yml) are not modified.
+    """
+
+    __slots__ = ("name", "file", "version", "src", "services", "main_service", "address_keys")
+
+    def __init__(self, project: Project, file: str, version: tuple[int, int]):
+        self.name: str = sys.intern(project["name"])
+        self.file = file
+        # Modification times of the project file and its riptide.local.yml
+        self.version = version
+        # Absolute path of the source directory
+        self.src: str | None = project.src_folder()
+        self.services = frozenset(sys.intern(service_name) for service_name in project["app"]["services"].keys())
+        main_service_obj = project["app"].get_service_by_role("main")
+        self.main_service: str | None = sys.intern(main_service_obj["$name"]) if main_service_obj else None
+        # Service name => key of the service in the ip cache
+        self.address_keys = {service_name: address_cache_key(self.name, service_name) for service_name in self.services}
 
 
 class ResolveStatus(Enum):
@@ -51,6 +191,45 @@ class ResolveStatus(Enum):
     PROJECT_NOT_FOUND = 6
 
 
+class Resolution:
+    """
+    Result of resolve_project. Which attributes are set depends on the status:
+
+    ``status``, ``project_name`` and ``service_name`` are always set. ``project_name`` is None for
+    ``ResolveStatus.NO_PROJECT``, ``service_name`` is the requested or resolved service name and may be None.
+    ``route`` and ``endpoints`` are only set for ``ResolveStatus.SUCCESS``.
+    ``project`` is only set for ``NO_MAIN_SERVICE``, ``SERVICE_NOT_FOUND``, ``NOT_STARTED`` and
+    ``NOT_STARTED_AUTOSTART``.
+    """
+
+    __slots__ = ("status", "project_name", "service_name", "route", "endpoints", "project")
+
+    route: ProjectRoute
+    endpoints: Endpoints
+    project: Project
+
+    def __init__(self, status: ResolveStatus, project_name: str | None = None, service_name: str | None = None):
+        self.status = status
+        self.project_name = project_name
+        self.service_name = service_name
+
+    @classmethod
+    def success(cls, route: ProjectRoute, service_name: str, endpoints: Endpoints) -> Resolution:
+        resolution = cls(ResolveStatus.SUCCESS, route.name, service_name)
+        resolution.route = route
+        resolution.endpoints = endpoints
+        return resolution
+
+    @classmethod
+    def with_project(cls, status: ResolveStatus, project: Project, service_name: str | None) -> Resolution:
+        resolution = cls(status, project["name"], service_name)
+        resolution.project = project
+        return resolution
+
+
+_NO_PROJECT = Resolution(ResolveStatus.NO_PROJECT)
+
+
 class ProjectLoadError(Exception):
     def __init__(self, project_name: str) -> None:
         self.project_name = project_name
@@ -59,9 +238,23 @@ class ProjectLoadError(Exception):
         return "Error loading project " + self.project_name
 
 
-def resolve_project(
-    hostname, base_url: str, runtime_storage: RuntimeStorage, autostart=True
-) -> tuple[ResolveStatus, Any]:
+def format_load_error(err: ProjectLoadError) -> list[str]:
+    """Formats ProjectLoadErrors for display: the message of the error and of each error that caused it."""
+    stack = [str(err)]
+    current_err: BaseException = err
+    previous_message = str(err)
+    while current_err.__context__ is not None:
+        current_err = current_err.__context__
+        # Filter duplicate exception messages. 'schema' used by configcrunch does that for example.
+        if previous_message != str(current_err):
+            stack.append(f">> Caused by {str(current_err)}")
+        previous_message = str(current_err)
+    return stack
+
+
+async def resolve_project(
+    hostname, base_url: str, runtime_storage: RuntimeStorage, autostart=True, trace: Trace | None = None
+) -> Resolution:
     """
     Resolve the project and service based on the the hostname, base url
     and available Riptide projects, as reported by riptide-cli
@@ -70,102 +263,197 @@ def resolve_project(
     :param hostname: Request hostname
     :param base_url: The configured proxy base url
     :param autostart: Whether or not autostart is enabled
+    :param trace: Trace to record spans in, if tracing is enabled
 
     :raises  ProjectLoadError: On project load error
-    :return: Depending on the result, this function may return various things.
-
-             The format is always a tuple of ``ResolveStatus`` and a data object:
+    :return: A ``Resolution``. Depending on its status, it contains:
 
-             ``ResolveStatus.SUCCESS``, (project, resolved_service_name, address):
-                Project was found and service also. data is project, resolved service and container address
+             ``ResolveStatus.SUCCESS``: route, service_name (resolved), endpoints
+                Project was found and service also. The full project is not loaded for this.
+                The address to use is picked from the endpoints by runtime_storage.balancer.
 
-             ``ResolveStatus.NO_PROJECT``, None:
+             ``ResolveStatus.NO_PROJECT``:
                 No project or service was specified in the URL.
 
-             ``ResolveStatus.NO_MAIN_SERVICE``, (Project, request_service_name):
+             ``ResolveStatus.NO_MAIN_SERVICE``: project, service_name (requested)
                 No service was specified, and the project has no main service.
-                data is tuple of project and the requested service name.
 
-             ``ResolveStatus.SERVICE_NOT_FOUND``, (Project, request_service_name):
-                Service was not found. data is tuple of project and the requested service name.
+             ``ResolveStatus.SERVICE_NOT_FOUND``: project, service_name (requested)
+                Service was not found.
 
-             ``ResolveStatus.NOT_STARTED``, (Project, resolved_service_name):
-                Service is not started, autostart is disabled. data is tuple of project and the service name.
+             ``ResolveStatus.NOT_STARTED``: project, service_name (resolved)
+                Service is not started, autostart is disabled.
 
-             ``ResolveStatus.NOT_STARTED_AUTOSTART``, (Project, resolved_service_name):
-                Service is not started, autostart is enabled. data is tuple of project and the service name.
+             ``ResolveStatus.NOT_STARTED_AUTOSTART``: project, service_name (resolved)
+                Service is not started, autostart is enabled.
 
-             ``ResolveStatus.PROJECT_NOT_FOUND``, project_name:
-                The project was not found. data is the name of the requested project.
+             ``ResolveStatus.PROJECT_NOT_FOUND``: project_name
+                The project was not found.
 
+             Successful results are reused for the same project and service for RESOLVE_CACHE_TIMEOUT seconds.
     """
     # Get the requested project and service names from the URL
-    project_name, request_service_name = _extract_names_from(hostname, base_url)
+    with span(trace, "resolve.extract_names"):
+        project_name, request_service_name = _extract_names_from(hostname, base_url)
     if project_name is None:
         # No project specified
-        return ResolveStatus.NO_PROJECT, None
+        return _NO_PROJECT
+
+    resolve_cache = runtime_storage.resolve_cache
+    cache_key = (project_name, request_service_name)
+    cached = resolve_cache.get(cache_key)
+    if cached is not None and time.monotonic() - cached.time <= RESOLVE_CACHE_TIMEOUT:
+        return cached.data
+
+    # Try to load the project's route
+    with span(trace, "resolve.load_project", project=project_name):
+        route = load_project_route(project_name, runtime_storage, trace)
+    if route is None:
+        return Resolution(ResolveStatus.PROJECT_NOT_FOUND, project_name)
+
+    resolved_service_name: str | None
+    if request_service_name in route.services:
+        resolved_service_name = request_service_name
+    elif not request_service_name:
+        # No service was specified. So instead: Load main service
+        resolved_service_name = route.main_service
+        if not resolved_service_name:
+            # Nope, main service could also not be loaded
+            return Resolution.with_project(
+                ResolveStatus.NO_MAIN_SERVICE, load_project(route, runtime_storage, trace), request_service_name
+            )
+    else:
+        # Service was not found :(
+        return Resolution.with_project(
+            ResolveStatus.SERVICE_NOT_FOUND, load_project(route, runtime_storage, trace), request_service_name
+        )
 
-    # Try to load a project
-    project, resolved_service_name = load_project_and_service(project_name, request_service_name, runtime_storage)
+    # Service and project are resolved
+    # Resolve container address and proxy the request
+    assert resolved_service_name is not None
+    with span(trace, "resolve.container_address", service=resolved_service_name):
+        endpoints = await _resolve_container_address(route, resolved_service_name, runtime_storage, trace)
 
-    if project:
-        # Project could be loaded
-        if not resolved_service_name:
-            # Service could not be loaded :(
-            if not request_service_name:
-                # ...but no service was specified. So instead: Load main service
-                resolved_service_name = None
-                main_service_obj = project["app"].get_service_by_role("main")
-                if main_service_obj:
-                    resolved_service_name = main_service_obj["$name"]
-                if not resolved_service_name:
-                    # Nope, main service could also not be loaded
-                    return ResolveStatus.NO_MAIN_SERVICE, (project, request_service_name)
-            else:
-                # Service was not found :(
-                return ResolveStatus.SERVICE_NOT_FOUND, (project, request_service_name)
-
-        # Service and project are resolved
-        # Resolve container address and proxy the request
-        assert resolved_service_name is not None
-        address = _resolve_container_address(project, resolved_service_name, runtime_storage)
-
-        if address is not None:
-            # PROXY
-            return ResolveStatus.SUCCESS, (project, resolved_service_name, address)
-        elif autostart:
-            return ResolveStatus.NOT_STARTED_AUTOSTART, (project, resolved_service_name)
-        else:
-            return ResolveStatus.NOT_STARTED, (project, resolved_service_name)
+    if endpoints is not None:
+        # PROXY
+        resolution = Resolution.success(route, resolved_service_name, endpoints)
+        if len(resolve_cache) >= RESOLVE_CACHE_SIZE:
+            resolve_cache.clear()
+        resolve_cache[cache_key] = CacheEntry(resolution, time.monotonic())
+        return resolution
+    status = ResolveStatus.NOT_STARTED_AUTOSTART if autostart else ResolveStatus.NOT_STARTED
+    return Resolution.with_project(status, load_project(route, runtime_storage, trace), resolved_service_name)
 
+
+def address_cache_key(project_name: str, service_name: str) -> str:
+    """The (interned) key of a service in the ip cache."""
+    return sys.intern(project_name + DOMAIN_PROJECT_SERVICE_SEP + service_name)
+
+
+def forget_resolution(project_name: str, service_name: str, runtime_storage: RuntimeStorage):
+    """Remove the cached resolutions of a service and its cached container address."""
+    _forget_resolutions(runtime_storage, project_name, service_name)
+    runtime_storage.ip_cache.pop(address_cache_key(project_name, service_name), None)
+
+
+def forget_projects(runtime_storage: RuntimeStorage, project_name: str | None = None) -> int:
+    """
+    Remove a project (all projects if project_name is None) from the project and route cache, together with its
+    cached resolutions. It is loaded again on the next request. Returns the number of removed projects.
+    """
+    files = [
+        file
+        for file, cached in runtime_storage.project_cache.items()
+        if project_name is None or cached.data["name"] == project_name
+    ]
+    for file in files:
+        del runtime_storage.project_cache[file]
+        runtime_storage.route_cache.pop(file, None)
+    _forget_resolutions(runtime_storage, project_name, None)
+    if project_name is not None:
+        runtime_storage.async_engine.forget(project_name)
+    return len(files)
+
+
+def forget_addresses(
+    runtime_storage: RuntimeStorage, project_name: str | None = None, service_name: str | None = None
+) -> int:
+    """
+    Remove the container addresses of a service (all services of a project if service_name is None, of all projects if
+    project_name is None) from the ip cache, together with the cached resolutions that use them. Returns the number of
+    removed services.
+    """
+    if project_name is None:
+        keys = list(runtime_storage.ip_cache)
+    elif service_name is None:
+        prefix = project_name + DOMAIN_PROJECT_SERVICE_SEP
+        keys = [key for key in runtime_storage.ip_cache if key.startswith(prefix)]
     else:
-        return ResolveStatus.PROJECT_NOT_FOUND, project_name
+        key = address_cache_key(project_name, service_name)
+        keys = [key] if key in runtime_storage.ip_cache else []
+    for key in keys:
+        del runtime_storage.ip_cache[key]
+    _forget_resolutions(runtime_storage, project_name, service_name)
+    return len(keys)
+
+
+def _forget_resolutions(runtime_storage: RuntimeStorage, project_name: str | None, service_name: str | None):
+    resolve_cache = runtime_storage.resolve_cache
+    for key in list(resolve_cache):
+        resolution = resolve_cache[key].data
+        if (project_name is None or resolution.project_name == project_name) and (
+            service_name is None or resolution.service_name == service_name
+        ):
+            del resolve_cache[key]
 
 
 def get_all_projects(runtime_storage: RuntimeStorage) -> tuple[list[Project], list[ProjectLoadError]]:
-    """Loads all projects that are found in the projects.json. Always reloads all projects."""
-    logger.debug("Project listing: Requested. Reloading all projects.")
-    runtime_storage.projects_mapping = load_projects(True)
-    current_time = time.time()
+    """
+    Loads all projects that are found in the projects.json. Project files that were modified are reloaded.
+    Projects that could not be loaded are only returned as errors, even if an older version is cached.
+    """
+    logger.debug("Project listing: Requested.")
+    refresh_projects_mapping(runtime_storage)
+    current_time = time.monotonic()
+    projects = []
     errors = []
     for project_name, project_file in runtime_storage.projects_mapping.items():
         logger.debug(f"Project listing: Processing {project_name} : {project_file}")
+        route = runtime_storage.route_cache.get(project_file)
+        cached = runtime_storage.project_cache.get(project_file)
+        if route is not None and cached is not None and route.version == _file_version(project_file):
+            cached.time = current_time
+            projects.append(cached.data)
+            continue
         try:
-            try:
-                project = _load_single_project(project_file, runtime_storage.engine)
-                runtime_storage.project_cache[project_file] = CacheEntry(data=project, time=current_time)
-            except FileNotFoundError as ex:
-                # Project not found
-                raise ProjectLoadError(project_name) from ex
-            except Exception as ex:
-                # Load error :(
-                logger.warning(f"Project listing: Could not load {project_name}. Reason: {str(ex)}")
-                # TODO: This is a bit ugly...
-                raise ProjectLoadError(project_name) from ex
+            project = _load_project_file(project_name, project_file, runtime_storage)
+            if project is None:
+                raise ProjectLoadError(project_name) from FileNotFoundError(f"Project file ({project_file}) not found.")
         except ProjectLoadError as load_error:
+            logger.warning(f"Project listing: Could not load {project_name}. Reason: {str(load_error.__cause__)}")
             errors.append(load_error)
+            continue
+        projects.append(project)
+
+    return sorted(projects, key=lambda p: p["name"]), errors
+
 
-    return sorted((tupl.data for tupl in runtime_storage.project_cache.values()), key=lambda p: p["name"]), errors
+def refresh_projects_mapping(runtime_storage: RuntimeStorage, force=False, trace: Trace | None = None):
+    """
+    Read projects.json again, if it was modified since it was read last (or if force is set).
+    This forgets the unknown project names.
+    """
+    try:
+        stat = os.stat(riptide_projects_file())
+        version = (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        version = None
+    if not force and version is not None and version == runtime_storage.projects_version:
+        return
+    with span(trace, "resolve.reload_projects"):
+        runtime_storage.projects_mapping = load_projects()
+    runtime_storage.projects_version = version
+    runtime_storage.unknown_projects.clear()
 
 
 def _load_single_project(project_file: str, engine: AbstractEngine) -> Project:
@@ -176,6 +464,64 @@ def _load_single_project(project_file: str, engine: AbstractEngine) -> Project:
     raise FileNotFoundError(f"Project file ({project_file}) not found.")
 
 
+def _file_version(project_file: str) -> tuple[int, int] | None:
+    """
+    Modification times of the project file and its riptide.local.yml (0 if there is none).
+    None if the file is gone.
+    """
+    try:
+        project_mtime = os.stat(project_file).st_mtime_ns
+    except OSError:
+        return None
+    try:
+        local_mtime = os.stat(os.path.join(os.path.dirname(project_file), LOCAL_PROJECT_FILENAME)).st_mtime_ns
+    except OSError:
+        local_mtime = 0
+    return project_mtime, local_mtime
+
+
+def _load_project_file(
+    project_name: str,
+    project_file: str,
+    runtime_storage: RuntimeStorage,
+    trace: Trace | None = None,
+    cache_project=True,
+) -> Project | None:
+    """
+    Fully load the project file and cache its route, and unless cache_project is False, the project.
+    Returns None if the file doesn't exist.
+
+    :raises ProjectLoadError: On project load error
+    """
+    version = _file_version(project_file)
+    if version is None:
+        return None
+    logger.debug(f"Loading project file for {project_name} at {project_file}")
+    try:
+        with span(trace, "resolve.load_project_file", file=project_file):
+            project = _load_single_project(project_file, runtime_storage.engine)
+    except FileNotFoundError:
+        # Project not found
+        return None
+    except Exception as ex:
+        # Load error :(
+        raise ProjectLoadError(project_name) from ex
+
+    current_time = time.monotonic()
+    _prune_project_cache(runtime_storage, current_time)
+    if cache_project:
+        runtime_storage.project_cache[project_file] = CacheEntry(project, current_time)
+    runtime_storage.route_cache[project_file] = ProjectRoute(project, project_file, version)
+    return project
+
+
+def _prune_project_cache(runtime_storage: RuntimeStorage, current_time: float):
+    """Remove the projects that were not used for PROJECT_CACHE_TIMEOUT from the project cache."""
+    project_cache = runtime_storage.project_cache
+    for cached_file in [f for f, entry in project_cache.items() if current_time - entry.time > PROJECT_CACHE_TIMEOUT]:
+        del project_cache[cached_file]
+
+
 def _extract_names_from(hostname: str, base_url: str) -> tuple[str | None, str | None]:
     """
     Remove ports and base url from request and return project and service name
@@ -202,8 +548,57 @@ def _extract_names_from(hostname: str, base_url: str) -> tuple[str | None, str |
     return project_name, request_service_name
 
 
+def load_project_route(
+    project_name: str, runtime_storage: RuntimeStorage, trace: Trace | None = None
+) -> ProjectRoute | None:
+    """
+    Returns the route of the project, None if the project could not be found.
+    The project file is only loaded if it was modified since its route was cached.
+
+    :raises ProjectLoadError: On project load error
+    """
+    # Get project file
+    if project_name not in runtime_storage.projects_mapping:
+        unknown_since = runtime_storage.unknown_projects.get(project_name)
+        if unknown_since is not None and time.monotonic() - unknown_since <= UNKNOWN_PROJECT_CACHE_TIMEOUT:
+            return None
+        # Try to reload. Maybe it was added?
+        refresh_projects_mapping(runtime_storage, trace=trace)
+        if project_name not in runtime_storage.projects_mapping:
+            logger.debug(f"Could not find project {project_name}")
+            # Project not found
+            if len(runtime_storage.unknown_projects) >= UNKNOWN_PROJECT_CACHE_SIZE:
+                runtime_storage.unknown_projects.clear()
+            runtime_storage.unknown_projects[project_name] = time.monotonic()
+            return None
+
+    project_file = runtime_storage.projects_mapping[project_name]
+    route = runtime_storage.route_cache.get(project_file)
+    if route is None or route.version != _file_version(project_file):
+        if _load_project_file(project_name, project_file, runtime_storage, trace) is None:
+            return None
+        route = runtime_storage.route_cache[project_file]
+    return route
+
+
+def load_project(route: ProjectRoute, runtime_storage: RuntimeStorage, trace: Trace | None = None) -> Project:
+    """
+    Returns the full project for a route. Loads the project file again, if the project was removed from the cache.
+
+    :raises ProjectLoadError: On project load error
+    """
+    cached = runtime_storage.project_cache.get(route.file)
+    if cached is not None:
+        cached.time = time.monotonic()
+        return cached.data
+    project = _load_project_file(route.name, route.file, runtime_storage, trace)
+    if project is None:
+        raise ProjectLoadError(route.name) from FileNotFoundError(f"Project file ({route.file}) not found.")
+    return project
+
+
 def load_project_and_service(
-    project_name: str, service_name: str | None, runtime_storage: RuntimeStorage
+    project_name: str, service_name: str | None, runtime_storage: RuntimeStorage, trace: Trace | None = None
 ) -> tuple[Project | None, str | None]:
     """
 
@@ -213,58 +608,136 @@ def load_project_and_service(
     :param project_name: Name of the requested project
     :param service_name: Name of the requested service
     :param runtime_storage: Runtime storage object
+    :param trace: Trace to record spans in, if tracing is enabled
     :return: Tuple of loaded project and resolved service name. Both may be empty if either of them could not be
              resolved.
     """
-
-    # Get project file
-    if project_name not in runtime_storage.projects_mapping:
-        # Try to reload. Maybe it was added?
-        runtime_storage.projects_mapping = load_projects()
-        if project_name not in runtime_storage.projects_mapping:
-            logger.debug(f"Could not find project {project_name}")
-            # Project not found
-            return None, None
-
-    # Load project from cache. Cache times out after some time.
-    current_time = time.time()
-    project_file = runtime_storage.projects_mapping[project_name]
-    project_cache = runtime_storage.project_cache
-    if project_file not in project_cache or current_time - project_cache[project_file].time > PROJECT_CACHE_TIMEOUT:
-        logger.debug(f"Loading project file for {project_name} at {project_file}")
-        try:
-            project = _load_single_project(project_file, runtime_storage.engine)
-            project_cache[project_file] = CacheEntry(data=project, time=current_time)
-        except FileNotFoundError:
-            # Project not found
-            return None, None
-        except Exception as ex:
-            # Load error :(
-            raise ProjectLoadError(project_name) from ex
-    else:
-        project = project_cache[project_file].data
-        project_cache[project_file].time = current_time
+    route = load_project_route(project_name, runtime_storage, trace)
+    if route is None:
+        return None, None
+    project = load_project(route, runtime_storage, trace)
 
     # Resolve service - simply return the service name again if found, otherwise just the project
-    if service_name in project["app"]["services"]:
+    if service_name in route.services:
         return project, service_name
     return project, None
 
 
-def _resolve_container_address(project: Project, service_name: str, runtime_storage: RuntimeStorage) -> str | None:
-    key = project["name"] + DOMAIN_PROJECT_SERVICE_SEP + service_name
-    current_time = time.time()
+async def _resolve_container_address(
+    route: ProjectRoute, service_name: str, runtime_storage: RuntimeStorage, trace: Trace | None = None
+) -> Endpoints | None:
+    key = route.address_keys[service_name]
+    current_time = time.monotonic()
     ip_cache = runtime_storage.ip_cache
-    if key not in ip_cache or current_time - ip_cache[key].time > CNT_ADRESS_CACHE_TIMEOUT:
-        address = runtime_storage.engine.address_for(project, service_name)
-        logger.debug(f"Got container address for {key}: {address}")
-        if address is not None:
-            addressstr = "http://" + address[0] + ":" + str(address[1])
-            # Only cache if we actually got something.
-            ip_cache[key] = CacheEntry(data=addressstr, time=current_time)
-        else:
+    cached = ip_cache.get(key)
+    if cached is None or current_time - cached.time > CNT_ADRESS_CACHE_TIMEOUT:
+        # Only now the full project is needed
+        project = load_project(route, runtime_storage, trace)
+        addresses = await _service_addresses(route, project, service_name, runtime_storage, trace)
+        if not addresses:
             return None
+        # Only cache if we actually got something.
+        endpoints = Endpoints(addresses, current_time)
+        ip_cache[key] = CacheEntry(endpoints, current_time)
     else:
-        addressstr = ip_cache[key].data
-        ip_cache[key].time = current_time
-    return addressstr
+        endpoints = cached.data
+        cached.time = current_time
+        if (
+            current_time - endpoints.refreshed_at > ENDPOINT_REFRESH_INTERVAL
+            and key not in runtime_storage.endpoint_refreshes
+        ):
+            # Containers may have been added or removed. Requests keep using the known endpoints in the meantime.
+            runtime_storage.endpoint_refreshes[key] = asyncio.create_task(
+                _refresh_endpoints(route, service_name, key, endpoints, runtime_storage)
+            )
+    return endpoints
+
+
+async def _service_addresses(
+    route: ProjectRoute,
+    project: Project,
+    service_name: str,
+    runtime_storage: RuntimeStorage,
+    trace: Trace | None = None,
+) -> list[str]:
+    addresses = None
+    if runtime_storage.direct_routing is not None:
+        with span(trace, "resolve.direct_address_for"):
+            addresses = await runtime_storage.direct_routing.addresses_for(project, service_name)
+    if not addresses:
+        with span(trace, "resolve.engine_address_for"):
+            addresses = await runtime_storage.async_engine.addresses_for(project, service_name)
+    logger.debug(f"Got container addresses for {route.address_keys[service_name]}: {addresses}")
+    return ["http://" + host + ":" + str(port) for host, port in addresses]
+
+
+def _project_for_refresh(route: ProjectRoute, runtime_storage: RuntimeStorage) -> Project | None:
+    """
+    The full project for refreshing the container addresses of a route, None if the project file is gone. Unlike
+    load_project, this is not a use of the cached project: A project that is not cached anymore is loaded without
+    caching it again, so the project cache only keeps the projects that requests need.
+
+    :raises ProjectLoadError: On project load error
+    """
+    _prune_project_cache(runtime_storage, time.monotonic())
+    cached = runtime_storage.project_cache.get(route.file)
+    if cached is not None:
+        return cached.data
+    return _load_project_file(route.name, route.file, runtime_storage, cache_project=False)
+
+
+async def _refresh_endpoints(
+    route: ProjectRoute, service_name: str, key: str, endpoints: Endpoints, runtime_storage: RuntimeStorage
+):
+    try:
+        project = _project_for_refresh(route, runtime_storage)
+        addresses = await _service_addresses(route, project, service_name, runtime_storage) if project else []
+        if addresses:
+            endpoints.update(addresses, time.monotonic())
+        else:
+            # Stopped, the next request resolves the service again.
+            cached = runtime_storage.ip_cache.get(key)
+            if cached is not None and cached.data is endpoints:
+                del runtime_storage.ip_cache[key]
+    except Exception as ex:
+        logger.warning(f"Could not refresh the container addresses of {key}: {ex}")
+    finally:
+        runtime_storage.endpoint_refreshes.pop(key, None)
+
+
+def save_address_cache(runtime_storage: RuntimeStorage, path: str):
+    """
+    Write the container address cache to a file, so the next proxy process can start with it.
+    The cache times are monotonic, so they are written as wall clock times.
+    """
+    offset = time.time() - time.monotonic()
+    data = {key: [entry.data.addresses, entry.time + offset] for key, entry in runtime_storage.ip_cache.items()}
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            json.dump(data, f)
+        os.replace(path + ".tmp", path)
+    except OSError as ex:
+        logger.warning(f"Could not save the container address cache to {path}: {ex}")
+
+
+def load_address_cache(path: str) -> dict[str, CacheEntry[Endpoints]]:
+    """Read a container address cache written by save_address_cache. Expired entries are skipped."""
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as ex:
+        logger.warning(f"Could not load the container address cache from {path}: {ex}")
+        return {}
+    current_time = time.time()
+    offset = current_time - time.monotonic()
+    # Files of older versions contain a single address per service
+    return {
+        sys.intern(key): CacheEntry(
+            Endpoints([addresses] if isinstance(addresses, str) else addresses, cached_at - offset), cached_at - offset
+        )
+        for key, (addresses, cached_at) in data.items()
+        if current_time - cached_at <= CNT_ADRESS_CACHE_TIMEOUT
+    }
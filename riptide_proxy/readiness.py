@@ -0,0 +1,131 @@
+"""Waits for the services of an autostarted project to accept requests, before the browser is sent to them"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections.abc import Callable
+
+import tornado.httpclient
+from riptide.config.document.project import Project
+from riptide_proxy import (
+    AUTOSTART_PROBE_INTERVAL,
+    AUTOSTART_PROBE_TIMEOUT,
+    AUTOSTART_READY_TIMEOUT,
+    AUTOSTART_WARMUP_TIMEOUT,
+    LOGGER_NAME,
+)
+from riptide_proxy.engine_adapter import AsyncEngine
+
+logger = logging.getLogger(LOGGER_NAME)
+
+# Status codes of HTTP probes that mean the service is not ready yet: no response at all (599), or an error of a
+# server in front of the application (eg. nginx before PHP-FPM).
+_NOT_READY_CODES = frozenset((502, 503, 504, 599))
+
+
+class ReadinessCheck:
+    """
+    Checks whether the containers of a started service accept requests. Without a path, a service is ready once a TCP
+    connection to it stays open: published ports (eg. docker-proxy) accept connections before the service in the
+    container listens, but close them immediately. With a path, the service must answer an HTTP GET for it with a
+    status other than 502, 503 or 504.
+
+    Once ready, the warm-up path (if set) is requested once, so the first page view doesn't pay for eg. filling
+    caches or compiling assets.
+    """
+
+    def __init__(self, path: str | None = None, warmup_path: str | None = None):
+        """
+        :param path:        Path requested from each container to check whether it is ready, TCP connections
+                            are used if None.
+        :param warmup_path: Path requested from each container once it is ready, if set.
+        """
+        self.path = path
+        self.warmup_path = warmup_path
+
+    async def wait(
+        self,
+        async_engine: AsyncEngine,
+        project: Project,
+        service_name: str,
+        host: str,
+        on_wait: Callable[[str], None],
+    ) -> bool:
+        """
+        Wait until all containers of the service are ready and warm them up. False if the service was not ready
+        within AUTOSTART_READY_TIMEOUT seconds.
+
+        :param host:    Host header of HTTP probes and warm-up requests.
+        :param on_wait: Called with a status text whenever the check has to wait.
+        """
+        deadline = time.monotonic() + AUTOSTART_READY_TIMEOUT
+        waiting = False
+        while True:
+            addresses = await async_engine.addresses_for(project, service_name)
+            if addresses:
+                ready = await asyncio.gather(*(self._probe(address, host) for address in addresses))
+                if all(ready):
+                    break
+            if time.monotonic() >= deadline:
+                logger.warning(
+                    f"Service {project['name']}/{service_name} was not ready after {AUTOSTART_READY_TIMEOUT} seconds."
+                )
+                return False
+            if not waiting:
+                waiting = True
+                on_wait("Waiting for the service to accept connections...")
+            await asyncio.sleep(AUTOSTART_PROBE_INTERVAL)
+            # The containers may have been recreated in the meantime.
+            async_engine.forget(project["name"])
+        if self.warmup_path is not None:
+            on_wait("Warming up...")
+            await asyncio.gather(*(self._warm_up(address, host) for address in addresses))
+        return True
+
+    async def _probe(self, address: tuple[str, int], host: str) -> bool:
+        if self.path is not None:
+            code = await _fetch(address, self.path, host, AUTOSTART_PROBE_TIMEOUT)
+            return code not in _NOT_READY_CODES
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(*address), AUTOSTART_PROBE_TIMEOUT)
+        except (OSError, asyncio.TimeoutError):
+            return False
+        try:
+            # A connection that is closed right away was only accepted by a port forwarder. Services that talk
+            # first (eg. databases) are ready, too.
+            return bool(await asyncio.wait_for(reader.read(1), AUTOSTART_PROBE_INTERVAL))
+        except asyncio.TimeoutError:
+            return True
+        except OSError:
+            return False
+        finally:
+            writer.close()
+
+    async def _warm_up(self, address: tuple[str, int], host: str):
+        assert self.warmup_path is not None
+        try:
+            code = await _fetch(address, self.warmup_path, host, AUTOSTART_WARMUP_TIMEOUT)
+        except Exception as ex:
+            # The service is ready, a failed warm-up only makes the first page view slower.
+            logger.warning(f"Warm-up request to {address[0]}:{address[1]}{self.warmup_path} failed: {ex!r}")
+            return
+        logger.debug(f"Warm-up request to {address[0]}:{address[1]}{self.warmup_path}: {code}")
+
+
+async def _fetch(address: tuple[str, int], path: str, host: str, timeout: float) -> int:
+    """Status code of a GET request to the container, 599 if there was no response."""
+    try:
+        response = await tornado.httpclient.AsyncHTTPClient().fetch(
+            f"http://{address[0]}:{address[1]}{path}",
+            headers={"Host": host, "User-Agent": "riptide-proxy"},
+            follow_redirects=False,
+            connect_timeout=timeout,
+            request_timeout=timeout,
+            raise_error=False,
+        )
+    except (OSError, tornado.httpclient.HTTPClientError):
+        # raise_error only applies to error status codes, not to connection errors and timeouts.
+        return 599
+    return response.code
@@ -0,0 +1,202 @@
+"""Request bodies streamed to upstream servers and upstream response bodies buffered in memory or on disk"""
+
+from __future__ import annotations
+
+import asyncio
+import mmap
+import tempfile
+from collections.abc import Awaitable, Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO
+
+from tornado.iostream import StreamClosedError
+
+# Writes spilled response bodies to their temporary files, so disk I/O doesn't block the IOLoop
+_file_writer = ThreadPoolExecutor(max_workers=4, thread_name_prefix="riptide_proxy_body")
+
+
+class ResponseAborted(Exception):
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+
+    def __str__(self):
+        return (
+            "The service closed the connection before the response was complete, "
+            f"or the response was larger than the maximum of {self.max_size} bytes."
+        )
+
+
+class BodyWriteError(Exception):
+    """Writing a body buffered on disk to its temporary file failed (eg. the disk is full)."""
+
+    def __str__(self):
+        return f"The response could not be buffered on disk: {self.__cause__}"
+
+
+class BodyBuffer:
+    """
+    Collects the body of an upstream response from the chunks passed to append (the streaming_callback of the
+    upstream request).
+
+    The first memory_limit bytes are kept in memory. If the body gets larger, it is moved into an anonymous temporary
+    file, which is memory-mapped when the body is sent. The chunks are written to the file in a thread pool, call
+    written before sending a spilled body. If more than max_pending bytes wait to be written, append returns an
+    awaitable, the upstream response is not read further until it resolves. The maximum size of the body is enforced
+    by the caller, which aborts the upstream request if it is exceeded (see ProxyHttpHandler._on_upstream_chunk).
+    """
+
+    def __init__(self, memory_limit: int, max_pending: int):
+        """
+        :param memory_limit:    Maximum number of bytes kept in memory.
+        :param max_pending:     Maximum number of bytes of a spilled body that wait to be written before append
+                                asks the caller to wait.
+        """
+        self.memory_limit = memory_limit
+        self.max_pending = max_pending
+        self.size = 0
+        self._chunks: list[bytes] = []
+        # Number of bytes in _chunks that wait to be written, once spilled
+        self._pending = 0
+        self._file: IO[bytes] | None = None
+        # Writes the chunks to the file while the body is spilled, until all are written
+        self._writing: asyncio.Task | None = None
+        self._write_error: OSError | None = None
+
+    @property
+    def spilled(self) -> bool:
+        """Whether the body is kept in a temporary file."""
+        return self._file is not None
+
+    def append(self, chunk: bytes) -> Awaitable[None] | None:
+        """
+        Add the next chunk of the body. Returns an awaitable if too many bytes wait to be written to the temporary
+        file, no more chunks should be added until it resolves.
+        """
+        self.size += len(chunk)
+        if self._file is None:
+            if self.size <= self.memory_limit:
+                self._chunks.append(chunk)
+                return None
+            self._file = tempfile.TemporaryFile(prefix="riptide_proxy_body_")
+            self._pending = self.size - len(chunk)
+        elif self._write_error is not None:
+            # The body can't be sent anymore, written raises the error.
+            return None
+        # Once spilled, _chunks are the chunks that were not written to the file yet.
+        self._chunks.append(chunk)
+        self._pending += len(chunk)
+        if self._writing is None:
+            self._writing = asyncio.ensure_future(self._write_chunks(self._file))
+        if self._pending > self.max_pending:
+            return asyncio.shield(self._writing)
+        return None
+
+    async def written(self):
+        """
+        Wait until all chunks of a spilled body are in the temporary file.
+
+        :raises BodyWriteError: if writing the file failed
+        """
+        if self._writing is not None:
+            await asyncio.shield(self._writing)
+        if self._write_error is not None:
+            raise BodyWriteError() from self._write_error
+
+    async def _write_chunks(self, file: IO[bytes]):
+        loop = asyncio.get_running_loop()
+        try:
+            while self._chunks and self._file is file:
+                chunks, self._chunks = self._chunks, []
+                await loop.run_in_executor(_file_writer, _write, file, chunks)
+                self._pending -= sum(len(chunk) for chunk in chunks)
+        except OSError as ex:
+            self._write_error = ex
+            self._chunks = []
+            self._pending = 0
+        finally:
+            self._writing = None
+            if self._file is not file:
+                # Closed while writing
+                file.close()
+
+    def getvalue(self) -> bytes:
+        """The whole body. Only for bodies kept in memory."""
+        assert self._file is None
+        return b"".join(self._chunks)
+
+    def iter_chunks(self, chunk_size: int) -> Iterator[bytes]:
+        """
+        The body in chunks of chunk_size bytes, read from the memory-mapped temporary file if it was spilled.
+        For spilled bodies, wait for written first.
+        """
+        if self._file is None:
+            if self.size:
+                yield self.getvalue()
+            return
+        assert self._writing is None and not self._chunks
+        with mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for offset in range(0, self.size, chunk_size):
+                yield mapped[offset : offset + chunk_size]
+
+    def close(self):
+        """Free the memory and the temporary file of the body."""
+        self._chunks = []
+        if self._file is not None:
+            if self._writing is None:
+                self._file.close()
+            # Otherwise the running write closes it.
+            self._file = None
+
+
+def _write(file: IO[bytes], chunks: list[bytes]):
+    file.writelines(chunks)
+    file.flush()
+
+
+class BodyStream:
+    """
+    Passes the body of a client request to an upstream request while it is read from the client.
+
+    produce is the body_producer of the upstream request. The upstream request calls it once the upstream server
+    accepts the body (100 Continue), which sets started. Chunks passed to write are then sent to the upstream server,
+    until finish (or abort) is called.
+    """
+
+    def __init__(self):
+        self.started: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        # Whether the upstream server closed the connection, the rest of the body is discarded then
+        self.closed = False
+        self._write: Callable[[bytes], Awaitable[None]] | None = None
+        self._finished: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+
+    async def produce(self, write: Callable[[bytes], Awaitable[None]]):
+        self._write = write
+        self.started.set_result(None)
+        await self._finished
+
+    async def write(self, chunk: bytes):
+        """Send a chunk of the body. Resolves once the chunk was sent, so the client is not read faster than that."""
+        assert self._write is not None
+        if self.closed:
+            return
+        try:
+            await self._write(chunk)
+        except StreamClosedError:
+            self.closed = True
+
+    def finish(self):
+        """The whole body was sent."""
+        if not self._finished.done():
+            self._finished.set_result(None)
+
+    def abort(self):
+        """
+        The body can't be sent completely (the client closed the connection), abort the upstream request.
+        Tornado logs the error this raises in the upstream request, like for other aborted upstream requests.
+        """
+        if self._finished.done():
+            return
+        if self.started.done():
+            self._finished.set_exception(StreamClosedError())
+        else:
+            self._finished.cancel()
@@ -0,0 +1,177 @@
+"""HTTP server with limits for client connections"""
+
+from __future__ import annotations
+
+import logging
+from collections.abc import Awaitable
+
+import tornado.httpserver
+import tornado.httputil
+import tornado.ioloop
+from riptide_proxy import CLIENT_MAX_CONNECTIONS, CLIENT_REJECT_TIMEOUT, LOGGER_NAME
+from tornado.http1connection import HTTP1Connection
+from tornado.iostream import IOStream
+
+logger = logging.getLogger(LOGGER_NAME)
+
+# Answer to clients that connect while CLIENT_MAX_CONNECTIONS are open
+_REJECTED_RESPONSE = (
+    b"HTTP/1.1 503 Service Unavailable\r\n"
+    b"Connection: close\r\n"
+    b"Retry-After: 1\r\n"
+    b"Content-Type: text/plain\r\n"
+    b"Content-Length: 32\r\n"
+    b"\r\n"
+    b"Too many connections to proxy.\r\n"
+)
+
+
+def default_max_connections() -> int:
+    """
+    CLIENT_MAX_CONNECTIONS, but at most a third of the open file limit of the process: each proxied request needs
+    a descriptor for the client and for the upstream connection, and some are needed for everything else.
+    """
+    try:
+        import resource
+
+        soft_limit, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    except (ImportError, OSError):
+        # Windows
+        return CLIENT_MAX_CONNECTIONS
+    if soft_limit == resource.RLIM_INFINITY:
+        return CLIENT_MAX_CONNECTIONS
+    return max(1, min(CLIENT_MAX_CONNECTIONS, soft_limit // 3))
+
+
+class ClientConnections:
+    """The limits of client connections shared by all listeners, and the counts of connections and requests."""
+
+    def __init__(self, max_connections: int, max_requests_per_connection: int):
+        """
+        :param max_connections:             Maximum number of open HTTP client connections. Clients that connect
+                                            beyond are answered with 503 and disconnected.
+        :param max_requests_per_connection: Number of requests after which a keep-alive connection is closed.
+        """
+        self.max_connections = max_connections
+        self.max_requests_per_connection = max_requests_per_connection
+        # Listener name => open connections
+        self.open: dict[str, int] = {}
+        self.total = 0
+        self.rejected = 0
+        # Rejected connections that are still being answered
+        self.rejecting = 0
+        # Connections closed because they reached max_requests_per_connection
+        self.exhausted = 0
+
+    def counts(self) -> dict[str, object]:
+        return {
+            "open": sum(self.open.values()),
+            "open_per_listener": self.open,
+            "total": self.total,
+            "rejected": self.rejected,
+            "rejecting": self.rejecting,
+            "closed_after_max_requests": self.exhausted,
+            "max_connections": self.max_connections,
+            "max_requests_per_connection": self.max_requests_per_connection,
+        }
+
+
+class LimitedHTTPServer(tornado.httpserver.HTTPServer):
+    """
+    HTTPServer that rejects connections beyond ClientConnections.max_connections and closes keep-alive connections
+    after ClientConnections.max_requests_per_connection requests (with Connection: close on the last response).
+
+    Connections upgraded to WebSockets are handed over to the WebSocket handler and not counted anymore.
+    """
+
+    def initialize(self, request_callback, name: str, connections: ClientConnections, **kwargs):  # type: ignore
+        """
+        :param name:        Name of the listener, eg. "http".
+        :param connections: Limits and counts, shared by all listeners.
+        :param kwargs:      Arguments of HTTPServer, eg. idle_connection_timeout.
+        """
+        super().initialize(request_callback, **kwargs)
+        self.name = name
+        self.connections = connections
+        connections.open[name] = 0
+        # Server connection => number of requests started on it
+        self._requests: dict[object, int] = {}
+
+    def handle_stream(self, stream: IOStream, address: tuple):
+        connections = self.connections
+        if sum(connections.open.values()) >= connections.max_connections:
+            connections.rejected += 1
+            if connections.rejected % 100 == 1:
+                logger.warning(
+                    f"{connections.max_connections} client connections open, {connections.rejected} connections "
+                    f"rejected so far."
+                )
+            self._reject(stream)
+            return
+        connections.open[self.name] += 1
+        connections.total += 1
+        super().handle_stream(stream, address)
+
+    def _reject(self, stream: IOStream):
+        """Answer with 503 and close the connection, after CLIENT_REJECT_TIMEOUT at the latest."""
+        connections = self.connections
+        connections.rejecting += 1
+        io_loop = tornado.ioloop.IOLoop.current()
+        timeout = io_loop.call_later(CLIENT_REJECT_TIMEOUT, stream.close)
+
+        def closed(written):
+            # Fails with StreamClosedError if the client went away or the timeout closed the stream.
+            written.exception()
+            io_loop.remove_timeout(timeout)
+            stream.close()
+            connections.rejecting -= 1
+
+        stream.write(_REJECTED_RESPONSE).add_done_callback(closed)
+
+    def start_request(
+        self, server_conn: object, request_conn: tornado.httputil.HTTPConnection
+    ) -> tornado.httputil.HTTPMessageDelegate:
+        delegate = super().start_request(server_conn, request_conn)
+        requests = self._requests.get(server_conn, 0) + 1
+        self._requests[server_conn] = requests
+        if requests >= self.connections.max_requests_per_connection and isinstance(request_conn, HTTP1Connection):
+            return _LastRequestDelegate(delegate, request_conn, self.connections)
+        return delegate
+
+    def on_close(self, server_conn: object):
+        super().on_close(server_conn)
+        self._requests.pop(server_conn, None)
+        self.connections.open[self.name] -= 1
+
+
+class _LastRequestDelegate(tornado.httputil.HTTPMessageDelegate):
+    """Closes the connection after the request, like for a client that sent Connection: close."""
+
+    def __init__(
+        self,
+        delegate: tornado.httputil.HTTPMessageDelegate,
+        request_conn: HTTP1Connection,
+        connections: ClientConnections,
+    ):
+        self.delegate = delegate
+        self.request_conn = request_conn
+        self.connections = connections
+
+    def headers_received(
+        self,
+        start_line: tornado.httputil.RequestStartLine | tornado.httputil.ResponseStartLine,
+        headers: tornado.httputil.HTTPHeaders,
+    ) -> Awaitable[None] | None:
+        # Set from the request headers just before, there is no public API to override it.
+        self.request_conn._disconnect_on_finish = True
+        self.connections.exhausted += 1
+        return self.delegate.headers_received(start_line, headers)
+
+    def data_received(self, chunk: bytes) -> Awaitable[None] | None:
+        return self.delegate.data_received(chunk)
+
+    def finish(self):
+        self.delegate.finish()
+
+    def on_connection_close(self):
+        self.delegate.on_connection_close()
@@ -0,0 +1,240 @@
+"""JSON admin API of the proxy ("mission control"), to inspect and adjust the running proxy without restarting it"""
+
+from __future__ import annotations
+
+import json
+import logging
+import time
+
+import tornado.web
+from riptide_proxy import LOGGER_NAME
+from riptide_proxy.autostart_restrict import AutostartRestriction
+from riptide_proxy.headers import peer_ip
+from riptide_proxy.limits import LIMITS
+from riptide_proxy.project_loader import RuntimeStorage, forget_addresses, forget_projects
+from riptide_proxy.server.http import ProxyHttpHandler
+from riptide_proxy.server.routing import HostnameMatcher
+from riptide_proxy.server.websocket.others import ProxyWebsocketHandler
+
+logger = logging.getLogger(LOGGER_NAME)
+
+
+def get_control_routes(hostname: str, runtime_storage: RuntimeStorage, restriction: AutostartRestriction):
+    args = {"runtime_storage": runtime_storage, "restriction": restriction}
+    return [
+        (HostnameMatcher(r"/", hostname), IndexHandler, args),
+        (HostnameMatcher(r"/caches", hostname), CachesHandler, args),
+        (HostnameMatcher(r"/caches/projects(?:/([^/]+))?", hostname), ProjectCacheHandler, args),
+        (HostnameMatcher(r"/caches/addresses(?:/([^/]+)(?:/([^/]+))?)?", hostname), AddressCacheHandler, args),
+        (HostnameMatcher(r"/requests", hostname), RequestsHandler, args),
+        (HostnameMatcher(r"/connections", hostname), ConnectionsHandler, args),
+        (HostnameMatcher(r"/throughput", hostname), ThroughputHandler, args),
+        (HostnameMatcher(r"/limits", hostname), LimitsHandler, args),
+    ]
+
+
+class BaseControlHandler(tornado.web.RequestHandler):
+    def initialize(self, runtime_storage: RuntimeStorage, restriction: AutostartRestriction):
+        self.runtime_storage = runtime_storage
+        self.restriction = restriction
+
+    def prepare(self):
+        # Not remote_ip, which is taken from the X-Real-Ip and X-Forwarded-For headers of the client (xheaders)
+        if not self.restriction.allows(peer_ip(self.request)):
+            raise tornado.web.HTTPError(403, reason="Client not allowed.")
+
+    def compute_etag(self):
+        return None  # disable tornado Etag
+
+    def set_default_headers(self):
+        self.set_header("Content-Type", "application/json")
+        self.set_header("Cache-Control", "no-store")
+
+    def write_error(self, status_code: int, **_kwargs):
+        self.finish({"error": self._reason, "status": status_code})
+
+
+class IndexHandler(BaseControlHandler):
+    SUPPORTED_METHODS = ("GET",)
+
+    def get(self):
+        """Overview of the proxy and of the endpoints of the API."""
+        storage = self.runtime_storage
+        self.write(
+            {
+                "http_requests": len(ProxyHttpHandler.running),
+                "websockets": len(ProxyWebsocketHandler.connections),
+                "cached_projects": len(storage.project_cache),
+                "cached_addresses": len(storage.ip_cache),
+                "cached_resolutions": len(storage.resolve_cache),
+                "endpoints": {
+                    "GET /caches": "Cached projects, container addresses and resolutions",
+                    "DELETE /caches/projects[/<project>]": "Load projects again on the next request",
+                    "DELETE /caches/addresses[/<project>[/<service>]]": "Ask the engine for addresses again",
+                    "GET /requests": "Running HTTP requests and open WebSocket connections",
+                    "GET /connections": "Numbers of client connections",
+                    "GET /throughput": "Requests and bytes per second per project",
+                    "GET, PATCH /limits": "Concurrency limits",
+                },
+            }
+        )
+
+
+class CachesHandler(BaseControlHandler):
+    SUPPORTED_METHODS = ("GET",)
+
+    def get(self):
+        """The cached projects, container addresses and resolutions, with the seconds since their last use."""
+        storage = self.runtime_storage
+        now = time.monotonic()
+        self.write(
+            {
+                "projects": [
+                    {"name": cached.data["name"], "file": file, "idle": now - cached.time}
+                    for file, cached in storage.project_cache.items()
+                ],
+                "addresses": [
+                    {
+                        "service": key,
+                        "addresses": cached.data.addresses,
+                        "ejected": [address for address, until in cached.data.ejected_until.items() if until > now],
+                        "outstanding": cached.data.outstanding,
+                        "age": now - cached.data.refreshed_at,
+                        "idle": now - cached.time,
+                    }
+                    for key, cached in storage.ip_cache.items()
+                ],
+                "resolutions": [
+                    {
+                        "project": cached.data.project_name,
+                        "requested_service": requested_service_name,
+                        "service": cached.data.service_name,
+                        "age": now - cached.time,
+                    }
+                    for (_, requested_service_name), cached in storage.resolve_cache.items()
+                ],
+            }
+        )
+
+
+class ProjectCacheHandler(BaseControlHandler):
+    SUPPORTED_METHODS = ("DELETE",)
+
+    def delete(self, project_name: str | None = None):
+        """Remove a project (or all) from the cache."""
+        removed = forget_projects(self.runtime_storage, project_name)
+        logger.info(f"Control API: Removed {removed} projects from the cache.")
+        self.write({"removed": removed})
+
+
+class AddressCacheHandler(BaseControlHandler):
+    SUPPORTED_METHODS = ("DELETE",)
+
+    def delete(self, project_name: str | None = None, service_name: str | None = None):
+        """Remove the container addresses of a service, a project or of all projects from the cache."""
+        removed = forget_addresses(self.runtime_storage, project_name, service_name)
+        logger.info(f"Control API: Removed the addresses of {removed} services from the cache.")
+        self.write({"removed": removed})
+
+
+class RequestsHandler(BaseControlHandler):
+    SUPPORTED_METHODS = ("GET",)
+
+    def get(self):
+        """The running HTTP requests and open WebSocket connections, oldest first, with their age in seconds."""
+        now = time.monotonic()
+        http = [
+            {
+                "id": handler.request_id,
+                "client": handler.request.remote_ip,
+                "method": handler.request.method,
+                "host": handler.request.host,
+                "uri": handler.request.uri,
+                "project": handler.resolved_project_name,
+                "service": handler.resolved_service_name,
+                "upstream": handler.upstream_address,
+                "streaming": handler.streaming,
+                "age": handler.request.request_time(),
+                "bytes_in": handler.body_size,
+                "bytes_out": handler.bytes_out,
+            }
+            for handler in ProxyHttpHandler.running
+        ]
+        websockets = [
+            {
+                "client": handler.request.remote_ip,
+                "host": handler.request.host,
+                "uri": handler.request.uri,
+                "project": handler.project.name if handler.project is not None else None,
+                "age": now - handler.opened_at,
+                "bytes_in": handler.bytes_in,
+                "bytes_out": handler.bytes_out,
+            }
+            for handler in ProxyWebsocketHandler.connections
+        ]
+        self.write(
+            {
+                "http": sorted(http, key=lambda request: -request["age"]),
+                "websockets": sorted(websockets, key=lambda connection: -connection["age"]),
+            }
+        )
+
+
+class ConnectionsHandler(BaseControlHandler):
+    SUPPORTED_METHODS = ("GET",)
+
+    def get(self):
+        """The numbers of open and rejected client connections, see LimitedHTTPServer."""
+        client_connections = self.runtime_storage.client_connections
+        if client_connections is None:
+            raise tornado.web.HTTPError(404, reason="Client connections are not counted.")
+        self.write({**client_connections.counts(), "websockets": len(ProxyWebsocketHandler.connections)})
+
+
+class ThroughputHandler(BaseControlHandler):
+    SUPPORTED_METHODS = ("GET",)
+
+    def get(self):
+        """Requests and bytes per second of each project, see TrafficMeter."""
+        assert self.runtime_storage.traffic is not None
+        self.write(self.runtime_storage.traffic.rates())
+
+
+class LimitsHandler(BaseControlHandler):
+    SUPPORTED_METHODS = ("GET", "PATCH")
+
+    def get(self):
+        """The concurrency limits and how much of them is in use."""
+        limiter = self.runtime_storage.limiter
+        if limiter is None:
+            raise tornado.web.HTTPError(404, reason="Concurrency limits are disabled.")
+        self.write(
+            {
+                "limits": limiter.limits(),
+                "active": limiter.active,
+                "active_per_project": limiter.active_per_project,
+                "queued_per_project": limiter.queued_per_project(),
+                "rejected": limiter.rejected,
+            }
+        )
+
+    def patch(self):
+        """Change concurrency limits, the body is a JSON object with the limits to change (see GET)."""
+        limiter = self.runtime_storage.limiter
+        if limiter is None:
+            raise tornado.web.HTTPError(404, reason="Concurrency limits are disabled.")
+        try:
+            limits = json.loads(self.request.body)
+        except ValueError as ex:
+            raise tornado.web.HTTPError(400, reason="The body must be a JSON object.") from ex
+        if not isinstance(limits, dict):
+            raise tornado.web.HTTPError(400, reason="The body must be a JSON object.")
+        for name, value in limits.items():
+            if name not in LIMITS:
+                raise tornado.web.HTTPError(400, reason=f"Unknown limit {name}.")
+            number_types = (int, float) if name == "queue_timeout" else (int,)
+            if isinstance(value, bool) or not isinstance(value, number_types) or value <= 0:
+                raise tornado.web.HTTPError(400, reason=f"{name} must be a positive number.")
+        limiter.reconfigure(**limits)
+        logger.info(f"Control API: Changed concurrency limits: {limits}")
+        self.get()
@@ -26,37 +26,67 @@ from __future__ import annotations
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
+import asyncio
+import email.utils
+import itertools
 import logging
+import sys
+import time
 import traceback
 from asyncio import CancelledError, Future
+from collections.abc import Awaitable, Callable, Hashable
+from datetime import datetime, timezone
+from typing import ClassVar
 
 import tornado.httpclient
 import tornado.httputil
+import tornado.ioloop
 import tornado.web
 from riptide.config.document.config import Config
 from riptide.config.document.project import Project
-from riptide.config.loader import load_projects
 from riptide.engine.abstract import AbstractEngine
 from riptide_proxy import (
     LOGGER_NAME,
+    STREAM_HEARTBEAT_INTERVAL,
+    STREAM_IDLE_TIMEOUT,
+    STREAM_MAX_PENDING,
+    UPLOAD_MAX_SIZE,
+    UPSTREAM_BODY_CHUNK_SIZE,
+    UPSTREAM_BODY_MAX_PENDING_WRITES,
+    UPSTREAM_BODY_MAX_SIZE,
+    UPSTREAM_BODY_MEMORY_LIMIT,
     UPSTREAM_CONNECT_TIMEOUT,
     UPSTREAM_REQUEST_TIMEOUT,
 )
-from riptide_proxy.autostart_restrict import check_permission
+from riptide_proxy.balancer import Endpoints
+from riptide_proxy.collapse import RequestCollapser, SharedResponse
+from riptide_proxy.limits import LimitExceeded
 from riptide_proxy.project_loader import (
     ProjectLoadError,
+    ProjectRoute,
+    Resolution,
     ResolveStatus,
     RuntimeStorage,
-    get_all_projects,
+    format_load_error,
+    refresh_projects_mapping,
     resolve_project,
 )
+from riptide_proxy.server.body import BodyBuffer, BodyStream, BodyWriteError, ResponseAborted
+from riptide_proxy.server.upstream import abortable_http_client
+from riptide_proxy.tracing import TRACEPARENT_HEADER, Span, event, span
+from tornado.simple_httpclient import HTTPStreamClosedError
 
 logger = logging.getLogger(LOGGER_NAME)
+_request_ids = itertools.count(1)
 
 
+@tornado.web.stream_request_body
 class ProxyHttpHandler(tornado.web.RequestHandler):
     SUPPORTED_METHODS = ("GET", "HEAD", "POST", "DELETE", "PATCH", "PUT", "OPTIONS")
 
+    # Requests that are currently being processed, for draining them on shutdown
+    running: ClassVar[set[ProxyHttpHandler]] = set()
+
     def __init__(
         self, application, request, config: Config, engine: AbstractEngine, runtime_storage: RuntimeStorage, **kwargs
     ):
@@ -71,17 +101,57 @@ class ProxyHttpHandler(tornado.web.RequestHandler):
         self.config: Config = config
         self.engine: AbstractEngine = engine
         self.runtime_storage = runtime_storage
+        self.__class__.running.add(self)
 
-        self.http_client = tornado.httpclient.AsyncHTTPClient(force_instance=True)
+        # Buffered response bodies are limited to UPSTREAM_BODY_MAX_SIZE in _on_upstream_chunk, streamed ones are not.
+        self.http_client, self.upstream_connection = abortable_http_client(max_body_size=sys.maxsize)
         self.running_upstream_request_future: Future | None = None
+        # Body of the running upstream response
+        self.response_body: BodyBuffer | None = None
+        # Header lines of the running upstream response, until they are complete
+        self.upstream_header_lines: list[str] = []
+        # Timeout of the running upstream request (UPSTREAM_REQUEST_TIMEOUT), or the idle check of a streamed response
+        self.upstream_timeout: object | None = None
+        self.stream_check: tornado.ioloop.PeriodicCallback | None = None
+        self.upstream_timed_out = False
+        self.client_closed = False
+
+        # Streaming of responses without a known length, see _on_upstream_headers_complete
+        self.streaming = False
+        self.stream_is_sse = False
+        self.stream_last_data = 0.0
+        self.stream_last_write = 0.0
+        self.stream_at_event_boundary = True
+        self.stream_pending = 0
+
+        # Request body. Collected by data_received, unless it is streamed to the upstream server (body_stream).
+        self.body_chunks: list[bytes] = []
+        self.body_size = 0
+        self.body_stream: BodyStream | None = None
+        # Resolution of a request whose upstream request was started before the body was read, see prepare
+        self.continued: Resolution | None = None
+        # Project the request holds a concurrency limiter slot for
+        self.limit_slot: str | None = None
+        # Endpoints of the resolved service and the one the running upstream request was sent to
+        self.endpoints: Endpoints | None = None
+        self.upstream_address: str | None = None
+        # Key of the identical requests that wait for this one, see RequestCollapser
+        self.collapse_key: Hashable | None = None
 
         # Request id, only for debugging
-        self.request_id = 0
-        if logger.getEffectiveLevel() <= logging.DEBUG:
-            import random
-            import sys
+        self.request_id = next(_request_ids)
+
+        # Resolution result, for the access log, traces and the IOLoop watchdog
+        self.resolve_status: ResolveStatus | None = None
+        self.resolved_project_name: str | None = None
+        self.resolved_service_name: str | None = None
+        self.upstream_start_time = 0.0
+        self.upstream_ttfb: float | None = None
+        self.bytes_out = 0
 
-            self.request_id = random.randint(0, sys.maxsize * 2 + 1)
+        # Request trace, if tracing is enabled
+        tracer = runtime_storage.tracer
+        self.trace = tracer.start_trace("http", request.headers.get(TRACEPARENT_HEADER)) if tracer is not None else None
 
     def compute_etag(self):
         return None  # disable tornado Etag
@@ -89,49 +159,137 @@ class ProxyHttpHandler(tornado.web.RequestHandler):
     def initialize(self):
         self.request.__riptide_retried = False  # type: ignore
 
+    async def prepare(self):
+        """
+        Uploads that expect a 100 Continue are sent to the upstream server before their body is read from the
+        client. Only if the upstream server accepts the body (or doesn't answer within UPSTREAM_EXPECT_TIMEOUT), the
+        client is told to continue and the body is streamed to the upstream server. If it answers right away instead
+        (eg. 401 or 413), that answer is sent to the client without reading the body. All other request bodies are
+        read completely before they are sent.
+        """
+        if self.request.version != "HTTP/1.1" or self.request.headers.get("Expect", "").lower() != "100-continue":
+            return
+        try:
+            with span(self.trace, "resolve"):
+                resolution = await resolve_project(
+                    self.request.host, self.config["url"], self.runtime_storage, self.config["autostart"], self.trace
+                )
+        except ProjectLoadError:
+            # get shows the error
+            return
+        if resolution.status != ResolveStatus.SUCCESS:
+            return
+        route, resolved_service_name = resolution.route, resolution.service_name
+        assert resolved_service_name is not None
+        # Before the upstream request, its response may be streamed while the body is read.
+        self._remember_resolution(resolution)
+        if not await self._acquire_slot(route):
+            return
+
+        address = self._pick_address(resolution)
+        self.body_stream = BodyStream()
+        with span(self.trace, "upstream.continue", address=address) as upstream_span:
+            upstream_future = self._start_upstream_request(
+                address, route.name, upstream_span, body_producer=self.body_stream.produce
+            )
+            await asyncio.wait([self.body_stream.started, upstream_future], return_when=asyncio.FIRST_COMPLETED)
+        if self.body_stream.started.done():
+            # Read the body
+            self.continued = resolution
+            self.request.connection.set_max_body_size(UPLOAD_MAX_SIZE)  # type: ignore
+            return
+
+        if not upstream_future.cancelled() and isinstance(upstream_future.exception(), OSError):
+            # The upstream server could not be reached, maybe the cached address is outdated. Read the body and let
+            # get retry.
+            self.runtime_storage.balancer.eject(resolution.endpoints, address)
+            self._finish_endpoint()
+            self._release_slot()
+            self.body_stream = None
+            self.response_body.close()  # type: ignore
+            return
+        # Answered without reading the body
+        try:
+            await self.reverse_proxy(route, resolved_service_name, address)
+        finally:
+            self._release_slot()
+        if not self._finished:
+            self.finish()
+
+    def data_received(self, chunk: bytes):
+        self.body_size += len(chunk)
+        if self.body_stream is not None:
+            return self.body_stream.write(chunk)
+        self.body_chunks.append(chunk)
+
     async def get(self):
         """
         Route a reuqest to a service container or display status pages
         :return:
         """
 
+        if self.body_stream is not None:
+            self.body_stream.finish()
+        else:
+            self.request.body = b"".join(self.body_chunks)
+
         try:
-            rc, data = resolve_project(
-                self.request.host, self.config["url"], self.runtime_storage, self.config["autostart"]
-            )
+            if self.continued is not None:
+                resolution = self.continued
+            else:
+                with span(self.trace, "resolve"):
+                    resolution = await resolve_project(
+                        self.request.host,
+                        self.config["url"],
+                        self.runtime_storage,
+                        self.config["autostart"],
+                        self.trace,
+                    )
+            self._remember_resolution(resolution)
+            rc = resolution.status
 
             if rc == ResolveStatus.SUCCESS:
-                project, resolved_service_name, address = data
-                await self.reverse_proxy(project, resolved_service_name, address)
+                route, resolved_service_name = resolution.route, resolution.service_name
+                assert resolved_service_name is not None
+                if self.runtime_storage.static_files is not None and await self._serve_static_file(
+                    route, resolved_service_name
+                ):
+                    return
+                if not await self._acquire_slot(route):
+                    return
+                if self.continued is not None:
+                    # The upstream request was started by prepare
+                    assert self.upstream_address is not None
+                    address = self.upstream_address
+                else:
+                    address = self._pick_address(resolution)
+                try:
+                    await self.reverse_proxy(route, resolved_service_name, address)
+                finally:
+                    self._release_slot()
                 return
 
             elif rc == ResolveStatus.NO_MAIN_SERVICE:
-                project, request_service_name = data
-                return self.pp_no_main_service(project)
+                return await self.pp_no_main_service(resolution.project)
 
             elif rc == ResolveStatus.SERVICE_NOT_FOUND:
-                project, request_service_name = data
-                return self.pp_service_not_found(project, request_service_name)
+                return await self.pp_service_not_found(resolution.project, resolution.service_name)
 
             elif rc == ResolveStatus.NOT_STARTED:
-                project, resolved_service_name = data
-                return self.pp_project_not_started(project, resolved_service_name)
+                return await self.pp_project_not_started(resolution.project, resolution.service_name)
 
             elif rc == ResolveStatus.NOT_STARTED_AUTOSTART:
-                project, resolved_service_name = data
-
                 # Check if the user is actually allowed to auto-start, otherwise display not started page.
-                if not check_permission(self.request.remote_ip, self.config):
-                    return self.pp_project_not_started(project, resolved_service_name)
+                if not self.runtime_storage.autostart_restriction.allows(self.request.remote_ip):
+                    return await self.pp_project_not_started(resolution.project, resolution.service_name)
 
-                return self.pp_start_project(project, resolved_service_name)
+                return await self.pp_start_project(resolution.project, resolution.service_name)
 
             elif rc == ResolveStatus.PROJECT_NOT_FOUND:
-                project_name = data
-                return self.pp_project_not_found(project_name)
+                return self.pp_project_not_found(resolution.project_name)
 
             else:  # rc == ResolveStatus.NO_PROJECT
-                return self.pp_landing_page()
+                return await self.pp_landing_page()
 
         except ProjectLoadError as err:
             # Project could not be loaded
@@ -161,14 +319,62 @@ class ProxyHttpHandler(tornado.web.RequestHandler):
     async def options(self):
         return await self.get()
 
+    def flush(self, include_footers: bool = False) -> Future[None]:
+        if self.runtime_storage.access_log is not None or self.runtime_storage.traffic is not None:
+            self.bytes_out += sum(len(chunk) for chunk in self._write_buffer)
+        event(self.trace, "client.flush")
+        return super().flush(include_footers)
+
+    def on_finish(self):
+        """Write the access log entry and finish the trace for this request."""
+        self.__class__.running.discard(self)
+        self._release_slot()
+        self._finish_endpoint()
+        if self.trace is not None:
+            self.trace.finish(
+                method=self.request.method,
+                host=self.request.host,
+                project=self.resolved_project_name,
+                service=self.resolved_service_name,
+                resolve_status=self.resolve_status.name if self.resolve_status is not None else None,
+                status=self.get_status(),
+            )
+        traffic = self.runtime_storage.traffic
+        if traffic is not None and self.resolved_project_name is not None:
+            traffic.record(self.resolved_project_name, 1, self.body_size, self.bytes_out)
+        access_log = self.runtime_storage.access_log
+        if access_log is not None:
+            access_log.log(
+                self.request.remote_ip,
+                self.request.method,
+                self.request.host,
+                self.request.uri,
+                self.resolved_project_name,
+                self.resolved_service_name,
+                self.resolve_status.name if self.resolve_status is not None else None,
+                self.get_status(),
+                self.body_size,
+                self.bytes_out,
+                self.upstream_ttfb,
+                self.request.request_time(),
+            )
+
     def on_connection_close(self):
         """
         The connection was closed, before we finished processing. Close any running http clients (we don't
         need to wait for requests to finish if we don't have a user listening to the response.
         """
         logger.debug("[R %d] connection was closed by client. Aborting.", self.request_id)
+        self.__class__.running.discard(self)
+        self.client_closed = True
+        self._release_slot()
+        if self.body_stream is not None:
+            self.body_stream.abort()
         try:
-            if self.running_upstream_request_future is not None:
+            if self.running_upstream_request_future is not None and self.upstream_connection.abort():
+                # Closing the connection ends the upstream request, also if it is a stream that never ends on its own.
+                logger.debug("[R %d] successfully aborted upstream request.", self.request_id)
+            elif self.running_upstream_request_future is not None:
                 # XXX:
                 # Cancelling leads to logged errors if the request is currently running and
                 # an exception (such as a non-200 status code) is thrown. Example:
@@ -182,11 +388,11 @@ class ProxyHttpHandler(tornado.web.RequestHandler):
         except RuntimeError as ex:
             logger.debug("[R %d] upstream connection was already closed (%s).", self.request_id, str(ex))
 
-    async def reverse_proxy(self, project: Project, service_name: str, address: str):
+    async def reverse_proxy(self, route: ProjectRoute, service_name: str, address: str):
         """
         Reverse-proxy the to a given address
 
-        :param project:         Project that the address belongs to
+        :param route:           Route of the project that the address belongs to
         :param service_name:    Service (name) in that project that the address belongs to
         :param address:         The address to the container, incl. port
         :return:
@@ -195,54 +401,70 @@ class ProxyHttpHandler(tornado.web.RequestHandler):
             "[R %d] Handle %s request to %s:%s (%s)",
             self.request_id,
             self.request.method,
-            project["name"],
+            route.name,
             self.request.path,
             address,
         )
 
-        body: bytes | None = self.request.body
-        headers = self.request.headers.copy()
-
-        # Proxy Headers
-        headers.add("X-Real-Ip", self.request.remote_ip)  # type: ignore
-        headers.add("X-Forwarded-For", self.request.remote_ip)  # type: ignore
-        headers.add("X-Forwarded-Proto", self.request.protocol)
-        headers.add("X-Scheme", self.request.protocol)
-
-        if not body:
-            body = None
+        collapser = self.runtime_storage.collapser
+        self.collapse_key = None
+        if collapser is not None and self.body_stream is None:
+            self.collapse_key = collapser.key(address, self.request)
+            leader = collapser.leader(self.collapse_key) if self.collapse_key is not None else None
+            if leader is not None:
+                # An identical request is running, use its response
+                with span(self.trace, "upstream.collapsed", address=address):
+                    shared = await asyncio.shield(leader)
+                if shared is not None:
+                    collapser.collapsed += 1
+                    self._write_shared_response(shared)
+                    return
+                # Its response can't be shared, send the request on its own.
+                self.collapse_key = None
+        shared_response = None
 
         try:
-            # Send request
-            req = tornado.httpclient.HTTPRequest(
-                address + self.request.uri,  # type: ignore
-                method=self.request.method,  # type: ignore
-                body=body,
-                headers=headers,
-                follow_redirects=False,
-                connect_timeout=UPSTREAM_CONNECT_TIMEOUT,
-                request_timeout=UPSTREAM_REQUEST_TIMEOUT,
-                allow_nonstandard_methods=True,
-                decompress_response=not self.runtime_storage.use_compression,
-            )
-            logger.debug("[R %d] http_client for connection: %s", self.request_id, id(self.http_client))
-            self.running_upstream_request_future = self.http_client.fetch(req)
-            response = await self.running_upstream_request_future
+            with span(self.trace, "upstream.fetch", address=address) as upstream_span:
+                if self.body_stream is None:
+                    self._start_upstream_request(address, route.name, upstream_span, body=self.request.body or None)
+                response = await self.running_upstream_request_future  # type: ignore
             # Close the connection. There seems to be an issue, where sometimes connections are not properly closed?
             self.http_client.close()
             logger.debug("[R %d] done.", self.request_id)
-            # Handle the response
-            self.proxy_handle_response(response)
+            # Handle the response, unless it was streamed already
+            if not self.streaming:
+                if self.collapse_key is not None:
+                    shared_response = self._share_response(response)
+                with span(self.trace, "proxy_handle_response"):
+                    await self.proxy_handle_response(response, self.response_body)  # type: ignore
 
         except tornado.httpclient.HTTPClientError as e:
-            if e.code == 599:
+            if self.streaming:
+                # The streamed response is complete, but has an error status, or it was cut off (599).
+                logger.debug("[R %d] streamed response ended (%s).", self.request_id, str(e))
+                if e.code == 599:
+                    # Close the connection without ending the response, so the client can tell it is incomplete.
+                    self.request.connection.close()  # type: ignore
+            elif self.client_closed:
+                # The upstream request was aborted, because the client closed the connection.
+                self.set_status(499, "Client Closed Request")
+            elif (
+                isinstance(e, HTTPStreamClosedError) and self.upstream_ttfb is not None and not self.upstream_timed_out
+            ):
+                # The response was too large (the client closes the connection then) or the service closed it.
+                logger.debug("[R %d] error response aborted.", self.request_id)
+                self.pp_502(ResponseAborted(UPSTREAM_BODY_MAX_SIZE))
+            elif e.code == 599:
                 logger.debug("[R %d] error timeout.", self.request_id)
                 # Gateway Timeout
-                self.pp_gateway_timeout(project, service_name, address)
+                self.pp_gateway_timeout(route, service_name, address)
             elif hasattr(e, "response") and e.response:
                 logger.debug("[R %d] error generic.", self.request_id)
                 # Generic HTTP error/redirect. Just forward
-                self.proxy_handle_response(e.response)
+                if self.collapse_key is not None:
+                    shared_response = self._share_response(e.response)
+                with span(self.trace, "proxy_handle_response"):
+                    await self.proxy_handle_response(e.response, self.response_body)  # type: ignore
             else:
                 logger.debug("[R %d] error bad gateway.", self.request_id)
                 # Unknown error
@@ -251,7 +473,13 @@ class ProxyHttpHandler(tornado.web.RequestHandler):
 
         except OSError as err:
             # No route to host / Name or service not known - Cache is probably too old
-            return await self.retry_after_address_not_found_with_flushed_cache(project, service_name, err)
+            if self.endpoints is not None:
+                self.runtime_storage.balancer.eject(self.endpoints, address)
+            if self.collapse_key is not None:
+                # The retry may collapse with other requests again
+                collapser.finish(self.collapse_key, None)  # type: ignore
+                self.collapse_key = None
+            return await self.retry_after_address_not_found_with_flushed_cache(route, service_name, err)
 
         except CancelledError:
             # The upstream request was canceled. This should only happen if the user has closed the connection,
@@ -268,56 +496,348 @@ class ProxyHttpHandler(tornado.web.RequestHandler):
             else:
                 raise
 
-    def proxy_handle_response(self, response: tornado.httpclient.HTTPResponse):
+        finally:
+            if self.collapse_key is not None:
+                collapser.finish(self.collapse_key, shared_response)  # type: ignore
+            self._stop_upstream_timeout()
+            self._finish_endpoint()
+            if self.response_body is not None:
+                self.response_body.close()
+
+    def _start_upstream_request(
+        self,
+        address: str,
+        project_name: str,
+        upstream_span: Span | None,
+        body: bytes | None = None,
+        body_producer: Callable[..., Awaitable[None]] | None = None,
+    ) -> Future:
+        """
+        Send the request to the upstream server of project_name, with either the complete body or a body_producer that
+        streams it. With a body_producer, the upstream server is asked whether it accepts the body first
+        (Expect: 100-continue).
+        """
+        headers = self.runtime_storage.header_pipeline.request_headers(self.request, project_name)
+        if upstream_span is not None and upstream_span.trace.tracer.propagate:
+            headers[TRACEPARENT_HEADER] = upstream_span.traceparent()
+
+        self.response_body = BodyBuffer(UPSTREAM_BODY_MEMORY_LIMIT, UPSTREAM_BODY_MAX_PENDING_WRITES)
+        # Send request
+        req = tornado.httpclient.HTTPRequest(
+            address + self.request.uri,  # type: ignore
+            method=self.request.method,  # type: ignore
+            body=body,
+            body_producer=body_producer,  # type: ignore
+            expect_100_continue=body_producer is not None,
+            headers=headers,
+            follow_redirects=False,
+            connect_timeout=UPSTREAM_CONNECT_TIMEOUT,
+            # The timeouts are handled by the handler, streamed responses only time out when they are idle.
+            request_timeout=0,
+            allow_nonstandard_methods=True,
+            decompress_response=not self.runtime_storage.use_compression,
+            streaming_callback=self._on_upstream_chunk,  # type: ignore
+            header_callback=self._on_upstream_header,
+        )
+        logger.debug("[R %d] http_client for connection: %s", self.request_id, id(self.http_client))
+        self._finish_endpoint()
+        if self.endpoints is not None:
+            self.endpoints.started(address)
+            self.upstream_address = address
+        self.upstream_start_time = time.monotonic()
+        self.upstream_header_lines = []
+        self.upstream_timeout = tornado.ioloop.IOLoop.current().call_later(
+            UPSTREAM_REQUEST_TIMEOUT, self._on_upstream_timeout
+        )
+        self.running_upstream_request_future = self.http_client.fetch(req)
+        return self.running_upstream_request_future
+
+    def _on_upstream_timeout(self):
+        logger.debug("[R %d] upstream request timed out.", self.request_id)
+        self.upstream_timeout = None
+        self.upstream_timed_out = True
+        if not self.upstream_connection.abort() and self.running_upstream_request_future is not None:
+            self.running_upstream_request_future.cancel()
+
+    def _stop_upstream_timeout(self):
+        if self.upstream_timeout is not None:
+            tornado.ioloop.IOLoop.current().remove_timeout(self.upstream_timeout)
+            self.upstream_timeout = None
+        if self.stream_check is not None:
+            self.stream_check.stop()
+            self.stream_check = None
+
+    async def _acquire_slot(self, route: ProjectRoute) -> bool:
+        """
+        Wait for a concurrency limiter slot for the request, if it doesn't hold one already (or streams its response).
+        Returns False if the request was rejected, the rejection was sent then.
+        """
+        limiter = self.runtime_storage.limiter
+        if limiter is None or self.limit_slot is not None or self.streaming:
+            return True
+        try:
+            with span(self.trace, "limits.acquire"):
+                await limiter.acquire(route.name, self.request.remote_ip)  # type: ignore
+        except LimitExceeded as err:
+            self.pp_overloaded(route, err)
+            return False
+        self.limit_slot = route.name
+        return True
+
+    def _release_slot(self):
+        if self.limit_slot is not None:
+            self.runtime_storage.limiter.release(self.limit_slot, self.request.remote_ip)  # type: ignore
+            self.limit_slot = None
+
+    def _pick_address(self, resolution: Resolution) -> str:
+        """Pick the endpoint of the resolved service to send the request to."""
+        self.endpoints = resolution.endpoints
+        return self.runtime_storage.balancer.pick(resolution.endpoints, self.request)
+
+    def _finish_endpoint(self):
+        """The upstream request to upstream_address is not running anymore."""
+        if self.upstream_address is not None and self.endpoints is not None:
+            self.endpoints.finished(self.upstream_address)
+            self.upstream_address = None
+
+    def _on_upstream_header(self, line: str):
+        """
+        Header callback for upstream requests, remembers the time to the first byte of the response. This also tells
+        whether the upstream server started to respond.
+        """
+        if self.upstream_ttfb is None:
+            self.upstream_ttfb = time.monotonic() - self.upstream_start_time
+            event(self.trace, "upstream.first_byte")
+        if line != "\r\n":
+            self.upstream_header_lines.append(line)
+        else:
+            self._on_upstream_headers_complete()
+
+    def _on_upstream_headers_complete(self):
+        """
+        Responses without a known length (chunked) and Server-Sent Events are streamed: Their status and headers are
+        sent right away and each chunk of their body is sent as soon as it arrives. They don't have a total timeout,
+        but are closed if the upstream server doesn't send anything for STREAM_IDLE_TIMEOUT.
+        """
+        raw_headers = "".join(self.upstream_header_lines)
+        self.upstream_header_lines = []
+        lowered = raw_headers.lower()
+        if ("event-stream" not in lowered and "chunked" not in lowered) or self.request.method == "HEAD":
+            return
+        start_line, _, header_lines = raw_headers.partition("\r\n")
+        headers = tornado.httputil.HTTPHeaders.parse(header_lines)
+        content_type = headers.get("Content-Type", "").partition(";")[0].strip().lower()
+        self.stream_is_sse = content_type == "text/event-stream"
+        chunked = "chunked" in headers.get("Transfer-Encoding", "").lower() and "Content-Length" not in headers
+        if not self.stream_is_sse and not chunked:
+            return
+
+        logger.debug("[R %d] streaming response.", self.request_id)
+        response_start_line = tornado.httputil.parse_response_start_line(start_line)
+        self.streaming = True
+        # Streams may stay open for a long time, they don't count towards the concurrency limits of the project.
+        self._release_slot()
+        if self.collapse_key is not None:
+            # Streams are not shared, requests waiting for this one are sent on their own.
+            self.runtime_storage.collapser.finish(self.collapse_key, None)  # type: ignore
+            self.collapse_key = None
+        self._set_upstream_headers(response_start_line.code, response_start_line.reason, headers)
+        self.set_header("X-Forwarded-By", "riptide proxy")
+        self.stream_last_data = self.stream_last_write = time.monotonic()
+        self._stream_flush()
+
+        self._stop_upstream_timeout()
+        self.stream_check = tornado.ioloop.PeriodicCallback(self._check_stream, STREAM_HEARTBEAT_INTERVAL * 1000)
+        self.stream_check.start()
+
+    def _on_upstream_chunk(self, chunk: bytes) -> Awaitable[None] | None:
+        """
+        Streaming callback for upstream requests. The upstream response is not read further until the returned
+        awaitable resolves (see _UpstreamConnection).
+        """
+        if not self.streaming:
+            if self.response_body.size + len(chunk) > UPSTREAM_BODY_MAX_SIZE:  # type: ignore
+                # Fails the upstream request with HTTPStreamClosedError.
+                self.upstream_connection.abort()
+                return None
+            return self.response_body.append(chunk)  # type: ignore
+        self.stream_last_data = time.monotonic()
+        if self.stream_pending > STREAM_MAX_PENDING:
+            # Nothing can be sent anymore once data was lost, so end the stream.
+            logger.warning(f"[R {self.request_id}] Client does not keep up with the streamed response, closing it.")
+            self.upstream_connection.abort()
+            return None
+        self.write(chunk)
+        self.stream_at_event_boundary = chunk.endswith((b"\n\n", b"\r\n\r\n", b"\r\r"))
+        self._stream_flush()
+        return None
+
+    def _check_stream(self):
+        """Close idle streamed responses and send heartbeats to idle Server-Sent Events streams."""
+        now = time.monotonic()
+        if now - self.stream_last_data >= STREAM_IDLE_TIMEOUT:
+            logger.debug("[R %d] streamed response is idle, closing it.", self.request_id)
+            self.upstream_connection.abort()
+        elif (
+            self.stream_is_sse
+            and self.stream_at_event_boundary
+            and now - self.stream_last_write >= STREAM_HEARTBEAT_INTERVAL
+        ):
+            # An SSE comment, ignored by clients. Writing it detects clients that closed the connection.
+            self.write(b":\n\n")
+            self._stream_flush()
+
+    def _stream_flush(self):
+        self.stream_last_write = time.monotonic()
+        pending = sum(len(chunk) for chunk in self._write_buffer)
+        self.stream_pending += pending
+        self.flush().add_done_callback(lambda _: self._stream_sent(pending))
+
+    def _stream_sent(self, size: int):
+        self.stream_pending -= size
+
+    async def proxy_handle_response(self, response: tornado.httpclient.HTTPResponse, body: BodyBuffer):
         """
         Handle a response from an upstream server (display it).
 
         :param response: The upstream response
+        :param body:     The body of the upstream response
         """
 
-        self._headers = tornado.httputil.HTTPHeaders()  # clear tornado default header
-        self.set_status(response.code, response.reason)
+        if body.spilled:
+            try:
+                await body.written()
+            except BodyWriteError as err:
+                # A local error, not one of the upstream server, so it is not retried.
+                self.pp_500(err, traceback.format_exc())
+                return
 
-        for header, v in response.headers.get_all():
-            # Some headers are not useful to send or have to be re-calculated.
-            headers_to_recalculate = ["Content-Length", "Transfer-Encoding", "Connection"]
-            if not self.runtime_storage.use_compression:
-                # make sure to only pass Content-Encoding then, otherwise it's better when we recalculate!
-                headers_to_recalculate.append("Content-Encoding")
-            if header not in headers_to_recalculate:
-                self.add_header(header, v)
+        self._set_upstream_headers(response.code, response.reason, response.headers)
 
-        if response.body:
-            self.set_header("Content-Length", len(response.body))
+        if body.size:
+            self.set_header("Content-Length", body.size)
             self.set_header("X-Forwarded-By", "riptide proxy")
-            self.write(response.body)
+            for chunk in body.iter_chunks(UPSTREAM_BODY_CHUNK_SIZE):
+                self.write(chunk)
+                if body.spilled:
+                    # Send each chunk before reading the next one from the file
+                    await self.flush()
+
+    def _share_response(self, response: tornado.httpclient.HTTPResponse) -> SharedResponse | None:
+        """The response for identical requests that waited for this one, None if it can't be shared."""
+        body = self.response_body
+        if body is None or body.spilled or not RequestCollapser.shareable(response.headers):
+            return None
+        return SharedResponse(response.code, response.reason, response.headers, body.getvalue())
+
+    def _write_shared_response(self, shared: SharedResponse):
+        """Send the response of an identical request, like proxy_handle_response. The body is not copied."""
+        self._set_upstream_headers(shared.code, shared.reason, shared.headers)
+        if shared.body:
+            self.set_header("Content-Length", len(shared.body))
+            self.set_header("X-Forwarded-By", "riptide proxy")
+            self.write(shared.body)
 
-    async def retry_after_address_not_found_with_flushed_cache(self, project, service_name, err):
-        """Retry the request again (once!) with cleared caches."""
-        if self.request.__riptide_retried:  # type: ignore
+    async def _serve_static_file(self, route: ProjectRoute, service_name: str) -> bool:
+        """
+        Serve the request from the source directory of the project, if it matches a static file rule and the file
+        exists. Returns False if the request has to be sent to the service. Range requests are always sent to it.
+        """
+        if self.request.method not in ("GET", "HEAD") or route.src is None or "Range" in self.request.headers:
+            return False
+        static_file = self.runtime_storage.static_files.lookup(  # type: ignore
+            route.name, service_name, route.src, self.request.path
+        )
+        if static_file is None:
+            return False
+
+        with span(self.trace, "static_file"):
+            self.set_header("Content-Type", static_file.content_type)
+            self.set_header("Etag", static_file.etag)
+            self.set_header("Last-Modified", datetime.fromtimestamp(static_file.mtime, timezone.utc))
+            # Always revalidated, the files are edited during development
+            self.set_header("Cache-Control", "no-cache")
+            if self.check_etag_header() or self._not_modified_since(static_file.mtime):
+                self.set_status(304)
+                return True
+            self.set_header("Content-Length", static_file.size)
+            if self.request.method == "HEAD":
+                return True
+
+            static_file.acquire()
+            try:
+                offset = 0
+                while offset < static_file.size:
+                    chunk = static_file.read(offset, UPSTREAM_BODY_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    offset += len(chunk)
+                    self.write(chunk)
+                    if offset < static_file.size:
+                        await self.flush()
+            finally:
+                static_file.release()
+        return True
+
+    def _not_modified_since(self, mtime: float) -> bool:
+        if "If-None-Match" in self.request.headers:
+            # The ETag takes precedence
+            return False
+        try:
+            since = email.utils.parsedate_to_datetime(self.request.headers["If-Modified-Since"])
+        except (KeyError, TypeError, ValueError):
+            return False
+        return int(mtime) <= since.timestamp()
+
+    def _set_upstream_headers(self, code: int, reason: str | None, headers: tornado.httputil.HTTPHeaders):
+        """Use the status and headers of an upstream response for the response."""
+        # Replaces the tornado default headers
+        self._headers = self.runtime_storage.header_pipeline.response_headers(
+            headers, self.resolved_project_name, self.runtime_storage.use_compression
+        )
+        self.set_status(code, reason)
+
+    async def retry_after_address_not_found_with_flushed_cache(self, route, service_name, err):
+        """
+        Retry the request again (once!) with cleared caches. Not possible for bodies that were streamed already.
+        If the service has other endpoints that work, the request is retried with one of them instead.
+        """
+        if self.request.__riptide_retried or self.body_stream is not None:  # type: ignore
             self.pp_500(err, traceback.format_exc())
             return
         self.request.__riptide_retried = True  # type: ignore
+        if self.endpoints is not None and self.endpoints.available(time.monotonic()) != self.endpoints.addresses:
+            return await self.get()
 
-        self.runtime_storage.projects_mapping = load_projects()
+        refresh_projects_mapping(self.runtime_storage, force=True)
         self.runtime_storage.project_cache = {}
+        self.runtime_storage.route_cache = {}
         self.runtime_storage.ip_cache = {}
+        self.runtime_storage.resolve_cache = {}
 
         return await self.get()
 
-    def pp_landing_page(self):
-        """Display the landing page"""
+    def _remember_resolution(self, resolution: Resolution):
+        """Remember the result of resolve_project for the access log, traces and the IOLoop watchdog."""
+        self.resolve_status = resolution.status
+        self.resolved_project_name = resolution.project_name
+        self.resolved_service_name = resolution.service_name
+
+    async def pp_landing_page(self):
+        """Display the landing page. It is rendered from the status board and updated live by the status API."""
         self.set_status(200)
-        all_projects, load_errors = get_all_projects(self.runtime_storage)
+        board = self.runtime_storage.status_board
+        await board.refresh(self.runtime_storage)
         self.render(
             "pp_landing_page.html",
             title="Riptide Proxy",
             base_url=self.config["url"],
-            all_projects=all_projects,
-            load_errors=[self.format_load_error(error) for error in load_errors],
+            all_projects=board.projects,
+            load_errors=board.load_errors,
             # letter_list=[chr(x) for x in range(0x40, 0x60)],
-            letter_list=sorted({project["name"][0].upper() for project in all_projects}),
-            all_service_statuses=self._get_multiple_service_statuses(all_projects),
+            letter_list=sorted({project["name"][0].upper() for project in board.projects}),
+            all_service_statuses=board.service_statuses,
+            status_version=board.token,
         )
 
     def pp_500(self, err, trace, log_exception=True):
@@ -350,7 +870,19 @@ class ProxyHttpHandler(tornado.web.RequestHandler):
         self.set_status(502)
         self.render("pp_502.html", title="Riptide Proxy - 502 Bad Gateway", err=err, base_url=self.config["url"])
 
-    def pp_no_main_service(self, project: Project):
+    def pp_overloaded(self, route: ProjectRoute, err: LimitExceeded):
+        """Reject a request that exceeds the concurrency limits, clients should retry later."""
+        self.set_status(503)
+        self.set_header("Retry-After", str(err.retry_after))
+        self.render(
+            "pp_overloaded.html",
+            title="Riptide Proxy - Service Unavailable",
+            route=route,
+            err=err,
+            base_url=self.config["url"],
+        )
+
+    async def pp_no_main_service(self, project: Project):
         """Inform the user that the project has no main service, and list available services."""
         self.set_status(503)
         self.render(
@@ -358,10 +890,10 @@ class ProxyHttpHandler(tornado.web.RequestHandler):
             title="Riptide Proxy - No Main Service",
             project=project,
             base_url=self.config["url"],
-            service_statuses=self._get_service_statuses(project),
+            service_statuses=await self._get_service_statuses(project),
         )
 
-    def pp_service_not_found(self, project: Project, request_service_name):
+    async def pp_service_not_found(self, project: Project, request_service_name):
         """Inform the user that a service was not found for the project, and list available services."""
         self.set_status(400)
         self.render(
@@ -370,10 +902,10 @@ class ProxyHttpHandler(tornado.web.RequestHandler):
             project=project,
             base_url=self.config["url"],
             service_name=request_service_name,
-            service_statuses=self._get_service_statuses(project),
+            service_statuses=await self._get_service_statuses(project),
         )
 
-    def pp_start_project(self, project: Project, resolved_service_name):
+    async def pp_start_project(self, project: Project, resolved_service_name):
         """Start the auto start procedure for a project"""
         self.set_status(200)
         # Either start all or the defined default services
@@ -384,7 +916,7 @@ class ProxyHttpHandler(tornado.web.RequestHandler):
         # If the resolved service name is not in the list of services to start, show the start error page instead,
         # TODO: Extend autostart for this
         if resolved_service_name not in services_to_start:
-            return self.pp_project_not_started(project, resolved_service_name)
+            return await self.pp_project_not_started(project, resolved_service_name)
         self.render(
             "pp_start_project.html",
             title="Riptide Proxy - Starting...",
@@ -394,7 +926,7 @@ class ProxyHttpHandler(tornado.web.RequestHandler):
             base_url=self.config["url"],
         )
 
-    def pp_project_not_started(self, project: Project, resolved_service_name):
+    async def pp_project_not_started(self, project: Project, resolved_service_name):
         """Inform the user, that the requested service is not started."""
         self.set_status(503)
         self.render(
@@ -403,7 +935,7 @@ class ProxyHttpHandler(tornado.web.RequestHandler):
             project=project,
             base_url=self.config["url"],
             service_name=resolved_service_name,
-            service_statuses=self._get_service_statuses(project),
+            service_statuses=await self._get_service_statuses(project),
         )
 
     def pp_project_not_found(self, project_name):
@@ -416,34 +948,25 @@ class ProxyHttpHandler(tornado.web.RequestHandler):
             base_url=self.config["url"],
         )
 
-    def pp_gateway_timeout(self, project, service_name, address):
+    def pp_gateway_timeout(self, route, service_name, address):
         """Inform the user of a Gateway Timeout and possible reasons for this."""
         self.set_status(504)
         self.render(
             "pp_gateway_timeout.html",
             title="Riptide Proxy - Gateway Timeout",
-            project=project,
+            route=route,
             service_name=service_name,
             base_url=self.config["url"],
         )
 
     def format_load_error(self, err: ProjectLoadError):
         """Formats ProjectLoadErrors for display"""
-        stack = [str(err)]
-        current_err: BaseException = err
-        previous_message = str(err)
-        while current_err.__context__ is not None:
-            current_err = current_err.__context__
-            # Filter duplicate exception messages. 'schema' used by configcrunch does that for example.
-            if previous_message != str(current_err):
-                stack.append(f">> Caused by {str(current_err)}")
-            previous_message = str(current_err)
-        return stack
-
-    def _get_service_statuses(self, project: Project):
+        return format_load_error(err)
+
+    async def _get_service_statuses(self, project: Project):
         """Returns the engine container status for all services in project"""
-        return self.engine.status(project)
+        return await self.runtime_storage.async_engine.status(project)
 
-    def _get_multiple_service_statuses(self, all_projects: list[Project]):
+    async def _get_multiple_service_statuses(self, all_projects: list[Project]):
         """Returns all the engine container statuses for all services in all projects specified"""
-        return {p["name"]: self._get_service_statuses(p) for p in all_projects}
+        return await self.runtime_storage.async_engine.statuses(all_projects)
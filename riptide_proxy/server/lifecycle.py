@@ -0,0 +1,192 @@
+"""Graceful shutdown of the proxy and restarts that hand the listening sockets over to a new process"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import time
+from collections.abc import Callable
+
+import tornado.httpserver
+import tornado.ioloop
+import tornado.netutil
+from riptide_proxy import LOGGER_NAME, RESTART_READY_TIMEOUT, SHUTDOWN_DRAIN_TIMEOUT
+from riptide_proxy.project_loader import RuntimeStorage, save_address_cache
+from riptide_proxy.server.http import ProxyHttpHandler
+from riptide_proxy.server.websocket.autostart import AutostartHandler
+from riptide_proxy.server.websocket.others import ProxyWebsocketHandler
+from riptide_proxy.ssl_key import get_config_dir
+
+logger = logging.getLogger(LOGGER_NAME)
+
+# Set for a process started by a restart: JSON mapping of server name => file descriptors of its listening sockets
+LISTEN_FDS_ENV = "RIPTIDE_PROXY_LISTEN_FDS"
+# Set for a process started by a restart: File descriptor to report to the old process that it is serving
+READY_FD_ENV = "RIPTIDE_PROXY_READY_FD"
+ADDRESS_CACHE_NAME = "address_cache.json"
+# WebSocket close code "Going Away"
+WS_GOING_AWAY = 1001
+
+_inherited_fds: dict[str, list[int]] | None = None
+
+
+def get_address_cache_path():
+    """Returns the path of the file the container address cache is kept in between proxy processes"""
+    return os.path.join(get_config_dir(), ADDRESS_CACHE_NAME)
+
+
+def listening_sockets(name: str, port: int) -> list[socket.socket]:
+    """
+    Returns the listening sockets for a server ("http" or "https"). If this process was started by a restart,
+    these are the sockets of the previous process, otherwise new sockets bound to the port.
+    """
+    global _inherited_fds
+    if _inherited_fds is None:
+        _inherited_fds = json.loads(os.environ.pop(LISTEN_FDS_ENV, "{}"))
+    if name in _inherited_fds:
+        sockets = [socket.socket(fileno=fd) for fd in _inherited_fds.pop(name)]
+        for sock in sockets:
+            sock.setblocking(False)
+        return sockets
+    return tornado.netutil.bind_sockets(port)
+
+
+def notify_ready():
+    """If this process was started by a restart, tell the previous process that it can stop now."""
+    ready_fd = os.environ.pop(READY_FD_ENV, None)
+    if ready_fd is not None:
+        os.write(int(ready_fd), b"1")
+        os.close(int(ready_fd))
+
+
+class Lifecycle:
+    """
+    Stops the proxy gracefully on SIGTERM and SIGINT and restarts it on SIGUSR2.
+
+    When stopping, the servers stop accepting connections, WebSocket connections are closed with a close frame and
+    running HTTP requests may finish until SHUTDOWN_DRAIN_TIMEOUT has passed. The container address cache is saved
+    for the next process. A second signal stops the proxy immediately.
+
+    When restarting, a new proxy process is started with the same arguments that inherits the listening sockets.
+    Once it is serving, this process stops gracefully. Connections are never refused in between.
+    """
+
+    def __init__(
+        self,
+        servers: list[tornado.httpserver.HTTPServer],
+        sockets: dict[str, list[socket.socket]],
+        get_runtime_storage: Callable[[], RuntimeStorage],
+        on_stop: list[Callable[[], None]],
+    ):
+        """
+        :param sockets:             Server name => listening sockets, see listening_sockets.
+        :param get_runtime_storage: Returns the current runtime storage (it is replaced when the config is reloaded).
+        :param on_stop:             Called once no more requests are processed, before the IOLoop stops.
+        """
+        self.servers = servers
+        self.sockets = sockets
+        self.get_runtime_storage = get_runtime_storage
+        self.on_stop = on_stop
+        self.stopping = False
+        self._restarting = False
+
+    def start(self):
+        """Install the signal handlers. Must be called on the IOLoop thread."""
+        loop = tornado.ioloop.IOLoop.current().asyncio_loop  # type: ignore
+        try:
+            loop.add_signal_handler(signal.SIGTERM, self._on_stop_signal)
+            loop.add_signal_handler(signal.SIGINT, self._on_stop_signal)
+        except NotImplementedError:
+            # Windows, Ctrl+C stops the proxy immediately.
+            return
+        loop.add_signal_handler(signal.SIGUSR2, self._on_restart_signal)
+
+    def _on_stop_signal(self):
+        if self.stopping:
+            logger.warning("Stopping immediately.")
+            tornado.ioloop.IOLoop.current().stop()
+            return
+        tornado.ioloop.IOLoop.current().add_callback(self.stop)
+
+    def _on_restart_signal(self):
+        tornado.ioloop.IOLoop.current().add_callback(self.restart)
+
+    async def stop(self):
+        """Stop the proxy gracefully and stop the IOLoop."""
+        if self.stopping:
+            return
+        self.stopping = True
+        logger.info("Stopping Riptide Proxy...")
+        for server in self.servers:
+            server.stop()
+
+        for handler in list(ProxyWebsocketHandler.connections):
+            handler.close(WS_GOING_AWAY, "Proxy is shutting down")
+        for clients in AutostartHandler.clients.values():
+            for client in clients:
+                client.close(WS_GOING_AWAY, "Proxy is shutting down")
+
+        deadline = time.monotonic() + SHUTDOWN_DRAIN_TIMEOUT
+        while (ProxyHttpHandler.running or ProxyWebsocketHandler.connections) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if ProxyHttpHandler.running or ProxyWebsocketHandler.connections:
+            logger.warning(
+                f"Stopping with {len(ProxyHttpHandler.running)} requests and "
+                f"{len(ProxyWebsocketHandler.connections)} WebSocket connections still open."
+            )
+        for server in self.servers:
+            await server.close_all_connections()
+
+        save_address_cache(self.get_runtime_storage(), get_address_cache_path())
+        for callback in self.on_stop:
+            callback()
+        logger.info("Riptide Proxy stopped.")
+        tornado.ioloop.IOLoop.current().stop()
+
+    async def restart(self):
+        """Start a new proxy process with the listening sockets of this one, then stop this one gracefully."""
+        if self.stopping or self._restarting:
+            return
+        self._restarting = True
+        try:
+            logger.info("Restarting Riptide Proxy...")
+            save_address_cache(self.get_runtime_storage(), get_address_cache_path())
+            fds = {name: [sock.fileno() for sock in sockets] for name, sockets in self.sockets.items()}
+            ready_read, ready_write = os.pipe()
+            try:
+                process = subprocess.Popen(
+                    [sys.executable, "-m", "riptide_proxy", *sys.argv[1:]],
+                    pass_fds=[fd for server_fds in fds.values() for fd in server_fds] + [ready_write],
+                    env=dict(os.environ, **{LISTEN_FDS_ENV: json.dumps(fds), READY_FD_ENV: str(ready_write)}),
+                )
+            except OSError as ex:
+                os.close(ready_read)
+                logger.error(f"Could not start the new proxy process: {ex}")
+                return
+            finally:
+                os.close(ready_write)
+
+            ready = await tornado.ioloop.IOLoop.current().run_in_executor(None, _wait_ready, ready_read)
+            if not ready:
+                logger.error("The new proxy process did not start serving, this process keeps serving.")
+                process.terminate()
+                return
+            logger.info(f"The new proxy process {process.pid} is serving.")
+        finally:
+            self._restarting = False
+        await self.stop()
+
+
+def _wait_ready(ready_read: int) -> bool:
+    try:
+        readable, _, _ = select.select([ready_read], [], [], RESTART_READY_TIMEOUT)
+        return bool(readable) and os.read(ready_read, 1) == b"1"
+    finally:
+        os.close(ready_read)
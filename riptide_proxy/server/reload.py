@@ -0,0 +1,165 @@
+"""Reloads the system config and the routes of the running proxy"""
+
+from __future__ import annotations
+
+import logging
+import os
+import signal
+from collections.abc import Callable
+
+import tornado.httpserver
+import tornado.ioloop
+import tornado.web
+from riptide.config.document.config import Config
+from riptide.engine.abstract import AbstractEngine
+from riptide_proxy import CONFIG_WATCH_INTERVAL, LOGGER_NAME
+from riptide_proxy.project_loader import RuntimeStorage
+
+logger = logging.getLogger(LOGGER_NAME)
+
+
+def read_system_config(config_path: str) -> Config:
+    """
+    Read, validate and freeze the system config.
+
+    :raises: FileNotFoundError if the system config was not found
+    :raises: schema.SchemaError on validation errors
+    """
+    system_config = Config.from_yaml(config_path)
+    # Remove the hooks from the base configuration, since there are (currently)
+    # no proxy hooks anyway, and this way we don't have to process them.
+    if system_config.internal_contains("hooks"):
+        system_config.internal_delete("hooks")
+    system_config.validate()
+    system_config.freeze()
+    return system_config
+
+
+class ConfigReloader:
+    """
+    Reloads the system config on SIGHUP and, if enabled, whenever the config file changes.
+
+    The new config is read and validated in a thread. If it is valid, a new application is built with it and swapped
+    into all HTTP servers at once. Requests and WebSocket connections that are already running keep the old config.
+    The caches of the RuntimeStorage are carried over, unless the new config invalidates them.
+    Changes of the ports and the engine can't be applied to a running proxy and require a restart.
+    """
+
+    def __init__(
+        self,
+        config_path: str,
+        system_config: Config,
+        engine: AbstractEngine,
+        runtime_storage: RuntimeStorage,
+        servers: list[tornado.httpserver.HTTPServer],
+        build_application: Callable[[Config, RuntimeStorage], tornado.web.Application],
+    ):
+        """
+        :param build_application: Builds the application for a system config and runtime storage.
+        """
+        self.config_path = config_path
+        self.system_config = system_config
+        self.engine = engine
+        self.runtime_storage = runtime_storage
+        self.servers = servers
+        self.build_application = build_application
+        self._file_version = self._stat()
+        self._reloading = False
+        self._pending = False
+        self._watch: tornado.ioloop.PeriodicCallback | None = None
+
+    def start(self, watch=False):
+        """Reload on SIGHUP (not on Windows), and if watch is set, when the config file changes."""
+        if hasattr(signal, "SIGHUP"):
+            tornado.ioloop.IOLoop.current().asyncio_loop.add_signal_handler(signal.SIGHUP, self.trigger)  # type: ignore
+        if watch:
+            self._watch = tornado.ioloop.PeriodicCallback(self._check_file, CONFIG_WATCH_INTERVAL * 1000)
+            self._watch.start()
+
+    def stop(self):
+        if hasattr(signal, "SIGHUP"):
+            tornado.ioloop.IOLoop.current().asyncio_loop.remove_signal_handler(signal.SIGHUP)  # type: ignore
+        if self._watch is not None:
+            self._watch.stop()
+            self._watch = None
+
+    def trigger(self):
+        """Schedule a reload. If a reload is already running, another one is done after it."""
+        tornado.ioloop.IOLoop.current().add_callback(self.reload)
+
+    async def reload(self):
+        if self._reloading:
+            self._pending = True
+            return
+        self._reloading = True
+        try:
+            self._pending = True
+            while self._pending:
+                self._pending = False
+                await self._reload()
+        finally:
+            self._reloading = False
+
+    async def _reload(self):
+        logger.info(f"Reloading system config {self.config_path}.")
+        self._file_version = self._stat()
+        try:
+            new_config = await tornado.ioloop.IOLoop.current().run_in_executor(None, self._read)
+        except Exception as ex:
+            logger.error(f"Error reading configuration, keeping the old one: {ex}")
+            return
+
+        old = self.system_config.to_dict()
+        new = new_config.to_dict()
+        if old == new:
+            logger.info("System config unchanged.")
+            return
+        if old["engine"] != new["engine"]:
+            logger.warning("The engine configuration changed. Restart the proxy to apply it.")
+        if old["proxy"]["ports"] != new["proxy"]["ports"]:
+            logger.warning("The proxy ports changed. Restart the proxy to apply them.")
+        url_changed = old["proxy"]["url"] != new["proxy"]["url"]
+        if url_changed and new["proxy"]["ports"]["https"]:
+            logger.warning(
+                "The proxy URL changed. HTTPS uses the certificate for the old URL until the proxy restarts."
+            )
+
+        # Loaded projects contain the system config, hostname resolutions depend on the proxy URL.
+        runtime_storage = self.runtime_storage.reconfigure(
+            new_config["proxy"],
+            keep_projects=_without_proxy(old) == _without_proxy(new),
+            keep_resolutions=not url_changed,
+        )
+        try:
+            app = self.build_application(new_config, runtime_storage)
+        except Exception as ex:
+            logger.error(f"Error loading routes, keeping the old configuration: {ex}")
+            return
+
+        for server in self.servers:
+            server.request_callback = app
+        self.system_config = new_config
+        self.runtime_storage = runtime_storage
+        logger.info("System config reloaded.")
+
+    def _read(self) -> Config:
+        system_config = read_system_config(self.config_path)
+        system_config.load_performance_options(self.engine)
+        return system_config
+
+    def _stat(self) -> tuple[float, int] | None:
+        try:
+            stat = os.stat(self.config_path)
+        except OSError:
+            return None
+        return stat.st_mtime, stat.st_size
+
+    def _check_file(self):
+        file_version = self._stat()
+        if file_version is not None and file_version != self._file_version:
+            self._file_version = file_version
+            self.trigger()
+
+
+def _without_proxy(config: dict) -> dict:
+    return {key: value for key, value in config.items() if key != "proxy"}
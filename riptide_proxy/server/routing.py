@@ -0,0 +1,19 @@
+"""Route matchers for the handlers of the proxy itself"""
+
+from __future__ import annotations
+
+from re import Pattern
+
+import tornado.routing
+
+
+class HostnameMatcher(tornado.routing.PathMatches):
+    def __init__(self, path_pattern: str | Pattern, hostname: str) -> None:
+        self.hostname = hostname
+        super().__init__(path_pattern)
+
+    def match(self, request):
+        """Match path and hostname"""
+        if request.host_name != self.hostname:
+            return None
+        return super().match(request)
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import atexit
 import logging
 from importlib.util import find_spec
 
@@ -11,17 +12,48 @@ from riptide.config.document.config import Config
 from riptide.config.loader import load_projects
 from riptide.engine.abstract import AbstractEngine
 from riptide.plugin.loader import load_plugins
-from riptide_proxy import LOGGER_NAME
+from riptide_proxy import (
+    CLIENT_BODY_TIMEOUT,
+    CLIENT_IDLE_TIMEOUT,
+    CLIENT_MAX_HEADER_SIZE,
+    CLIENT_MAX_REQUESTS_PER_CONNECTION,
+    LOGGER_NAME,
+    MAX_CONCURRENT_REQUESTS,
+    MAX_CONCURRENT_REQUESTS_PER_CLIENT,
+    MAX_CONCURRENT_REQUESTS_PER_PROJECT,
+    REQUEST_QUEUE_SIZE,
+    REQUEST_QUEUE_TIMEOUT,
+    REQUEST_RETRY_AFTER,
+    WATCHDOG_STALL_THRESHOLD,
+)
 from riptide_proxy.abstract_plugin import ProxyServerPlugin
-from riptide_proxy.project_loader import RuntimeStorage
+from riptide_proxy.access_log import AccessLog
+from riptide_proxy.autostart_restrict import AutostartRestriction
+from riptide_proxy.balancer import ROUND_ROBIN, LoadBalancer
+from riptide_proxy.headers import HeaderPipeline
+from riptide_proxy.limits import ConcurrencyLimiter
+from riptide_proxy.profiling import get_profiling_route
+from riptide_proxy.project_loader import RuntimeStorage, load_address_cache
+from riptide_proxy.readiness import ReadinessCheck
 from riptide_proxy.resources import get_resources
+from riptide_proxy.server.connections import ClientConnections, LimitedHTTPServer, default_max_connections
+from riptide_proxy.server.control import get_control_routes
 from riptide_proxy.server.http import ProxyHttpHandler
+from riptide_proxy.server.lifecycle import Lifecycle, get_address_cache_path, listening_sockets, notify_ready
+from riptide_proxy.server.reload import ConfigReloader
+from riptide_proxy.server.status import get_status_routes
 from riptide_proxy.server.websocket.autostart import AutostartHandler
 from riptide_proxy.server.websocket.others import ProxyWebsocketHandler
+from riptide_proxy.static_files import StaticFiles
+from riptide_proxy.tracing import FileTraceExporter, Tracer
+from riptide_proxy.traffic import TrafficMeter
+from riptide_proxy.watchdog import LoopWatchdog
 
 logger = logging.getLogger(LOGGER_NAME)
 RIPTIDE_MISSION_CONTROL_SUBDOMAIN = "control"
 RIPTIDE_PROFILING_SUBDOMAIN = "sys--dbg--profile"
+# Networks that may use the control API, if not configured
+CONTROL_RESTRICT_DEFAULT = ("127.0.0.0/8", "::1/128")
 
 
 def load_plugin_routes(system_config: Config, engine: AbstractEngine, https_port, storage: RuntimeStorage):
@@ -32,28 +64,79 @@ def load_plugin_routes(system_config: Config, engine: AbstractEngine, https_port
         if isinstance(plugin, ProxyServerPlugin):
             routes += plugin.get_routes(system_config, storage)
 
-    # Profiling
-    guppy_spec = find_spec("guppy")
-    if guppy_spec is not None:
-        from riptide_proxy.profiling import get_profiling_route
-
-        start_https_msg = ""
-        if https_port:
-            start_https_msg = f"\n    https://{RIPTIDE_PROFILING_SUBDOMAIN}.{system_config['proxy']['url']}:{system_config['proxy']['ports']['https']:d}"
+    # Profiling, the heap endpoints need guppy
+    heap = find_spec("guppy") is not None
+    start_https_msg = ""
+    if https_port:
+        start_https_msg = f"\n    https://{RIPTIDE_PROFILING_SUBDOMAIN}.{system_config['proxy']['url']}:{system_config['proxy']['ports']['https']:d}"
 
-        logger.info(
-            f"Profiling extension guppy installed. Available at:\n"
-            f"    http://{RIPTIDE_PROFILING_SUBDOMAIN}.{system_config['proxy']['url']}:{system_config['proxy']['ports']['http']:d}{start_https_msg}"
-        )
+    logger.info(
+        f"Profiling {'with' if heap else 'without'} heap endpoints (guppy {'installed' if heap else 'not installed'}). "
+        f"Available at:\n"
+        f"    http://{RIPTIDE_PROFILING_SUBDOMAIN}.{system_config['proxy']['url']}:{system_config['proxy']['ports']['http']:d}{start_https_msg}"
+    )
 
-        routes += get_profiling_route(f"{RIPTIDE_PROFILING_SUBDOMAIN}.{system_config['proxy']['url']}")
+    routes += get_profiling_route(f"{RIPTIDE_PROFILING_SUBDOMAIN}.{system_config['proxy']['url']}", storage, heap)
     return routes
 
 
-def run_proxy(system_config: Config, engine: AbstractEngine, http_port, https_port, ssl_options, start_ioloop=True):
+def run_proxy(
+    system_config: Config,
+    engine: AbstractEngine,
+    http_port,
+    https_port,
+    ssl_options,
+    start_ioloop=True,
+    access_log: str | None = None,
+    trace_file: str | None = None,
+    trace_propagate=False,
+    stall_threshold: float = WATCHDOG_STALL_THRESHOLD,
+    config_path: str | None = None,
+    watch_config=False,
+    direct_routing=False,
+    load_balancing=ROUND_ROBIN,
+    affinity_cookie: str | None = None,
+    static_files: str | None = None,
+    collapse_requests=False,
+    readiness_path: str | None = None,
+    warmup_path: str | None = None,
+    control_api=False,
+    control_restrict: list[str] | None = None,
+    client_idle_timeout: float = CLIENT_IDLE_TIMEOUT,
+    client_body_timeout: float | None = CLIENT_BODY_TIMEOUT,
+    client_max_header_size: int = CLIENT_MAX_HEADER_SIZE,
+    client_max_connections: int | None = None,
+    client_max_requests: int = CLIENT_MAX_REQUESTS_PER_CONNECTION,
+    header_rules: str | None = None,
+):
     """
     Run proxy on the specified port. If start_ioloop is True (default),
     the tornado IOLoop will be started immediately.
+
+    If access_log is set, an access log is written to this path ("-" for stdout).
+    If trace_file is set, request traces are written to this path ("-" for stdout). If trace_propagate is also set,
+    a W3C traceparent header is sent to the upstream containers.
+    IOLoop stalls longer than stall_threshold seconds are logged, 0 disables the IOLoop watchdog.
+    If config_path is set, the system config is reloaded from it on SIGHUP, and if watch_config is also set,
+    whenever the file changes.
+    If direct_routing is set, requests are sent to the addresses of the containers in their container network
+    instead of their published ports, if these are reachable.
+    Requests for services with multiple containers are spread across them with the load_balancing strategy
+    (see LoadBalancer), affinity_cookie is the cookie used by the cookie-hash strategy.
+    If static_files is set, requests that match the static file rules in this file are served from the source
+    directories of the projects (see StaticFiles).
+    If collapse_requests is set, identical concurrent GET requests share one upstream request (see RequestCollapser).
+    Autostart reports success once the started services accept TCP connections, or if readiness_path is set, answer
+    a GET request for it. If warmup_path is set, it is requested from the started services before (see ReadinessCheck).
+    If control_api is set, the admin API is served on the mission control subdomain, to clients in the networks of
+    control_restrict (CIDR strings, default: only localhost).
+    Client connections of both listeners are limited by client_idle_timeout (also the time for receiving the request
+    headers), client_body_timeout (None: no limit), client_max_header_size, client_max_connections (default: see
+    default_max_connections) and client_max_requests per keep-alive connection (see LimitedHTTPServer).
+    If header_rules is set, the headers of requests and responses of projects are changed with the header rules in
+    this file (see HeaderPipeline).
+    If the IOLoop is started, SIGTERM and SIGINT stop the proxy gracefully and SIGUSR2 restarts it without
+    closing the listening sockets. run_proxy returns once the proxy is stopped.
     """
 
     start_https_msg = ""
@@ -69,45 +152,153 @@ def run_proxy(system_config: Config, engine: AbstractEngine, http_port, https_po
     # Load projects initially
     projects = load_projects()
 
+    # Access log
+    access_log_writer = None
+    if access_log is not None:
+        access_log_writer = AccessLog(access_log)
+        access_log_writer.start()
+        atexit.register(access_log_writer.close)
+
+    # Tracing
+    tracer = None
+    if trace_file is not None:
+        trace_exporter = FileTraceExporter(trace_file)
+        trace_exporter.start()
+        atexit.register(trace_exporter.close)
+        tracer = Tracer(trace_exporter, propagate=trace_propagate)
+
+    # IOLoop watchdog
+    watchdog = None
+    if stall_threshold > 0:
+        watchdog = LoopWatchdog(stall_threshold)
+        watchdog.start()
+
+    # Client connections
+    client_connections = ClientConnections(
+        client_max_connections if client_max_connections is not None else default_max_connections(),
+        client_max_requests,
+    )
+
     # Configure global storage
     use_compression = (
         True if "compression" in system_config["proxy"] and system_config["proxy"]["compression"] else False
     )
-    storage = {
-        "config": system_config["proxy"],
-        "engine": engine,
-        "runtime_storage": RuntimeStorage(
-            projects_mapping=projects, project_cache={}, ip_cache={}, engine=engine, use_compression=use_compression
+    runtime_storage = RuntimeStorage(
+        projects_mapping=projects,
+        project_cache={},
+        ip_cache=load_address_cache(get_address_cache_path()),
+        engine=engine,
+        use_compression=use_compression,
+        access_log=access_log_writer,
+        tracer=tracer,
+        watchdog=watchdog,
+        limiter=ConcurrencyLimiter(
+            MAX_CONCURRENT_REQUESTS,
+            MAX_CONCURRENT_REQUESTS_PER_PROJECT,
+            MAX_CONCURRENT_REQUESTS_PER_CLIENT,
+            REQUEST_QUEUE_SIZE,
+            REQUEST_QUEUE_TIMEOUT,
+            REQUEST_RETRY_AFTER,
         ),
-    }
-
-    # Configure Routes
-    app = tornado.web.Application(
-        load_plugin_routes(system_config, engine, https_port, storage["runtime_storage"])
-        + [
-            # http
-            (RiptideNoWebSocketMatcher(r"^(?!/___riptide_proxy_ws).*$"), ProxyHttpHandler, storage),
-            # Any non-autostart websockets
-            (r"^(?!/___riptide_proxy_ws).*$", ProxyWebsocketHandler, storage),
-            # autostart websockets
-            (r"/___riptide_proxy_ws", AutostartHandler, storage),
-        ],
-        static_url_prefix="/___riptide/",
-        static_path=get_resources("assets"),
-        template_path=get_resources("tpl"),
+        direct_routing=direct_routing,
+        balancer=LoadBalancer(load_balancing, affinity_cookie),
+        static_files=StaticFiles.from_file(static_files) if static_files is not None else None,
+        collapse_requests=collapse_requests,
+        readiness=ReadinessCheck(readiness_path, warmup_path),
+        traffic=TrafficMeter() if control_api else None,
+        client_connections=client_connections,
+        header_pipeline=HeaderPipeline.from_file(header_rules) if header_rules is not None else None,
+        autostart_restriction=AutostartRestriction.from_config(system_config["proxy"]),
     )
 
+    # Mission control
+    control_restriction = AutostartRestriction(control_restrict or list(CONTROL_RESTRICT_DEFAULT))
+    if control_api:
+        logger.info(
+            f"Control API available at:\n"
+            f"    http://{RIPTIDE_MISSION_CONTROL_SUBDOMAIN}.{system_config['proxy']['url']}:"
+            f"{system_config['proxy']['ports']['http']:d}"
+        )
+
+    def build_application(system_config: Config, runtime_storage: RuntimeStorage) -> tornado.web.Application:
+        storage = {
+            "config": system_config["proxy"],
+            "engine": engine,
+            "runtime_storage": runtime_storage,
+        }
+
+        # Configure Routes
+        return tornado.web.Application(
+            load_plugin_routes(system_config, engine, https_port, runtime_storage)
+            + get_status_routes(system_config["proxy"]["url"], runtime_storage)
+            + (
+                get_control_routes(
+                    f"{RIPTIDE_MISSION_CONTROL_SUBDOMAIN}.{system_config['proxy']['url']}",
+                    runtime_storage,
+                    control_restriction,
+                )
+                if control_api
+                else []
+            )
+            + [
+                # http
+                (RiptideNoWebSocketMatcher(r"^(?!/___riptide_proxy_ws).*$"), ProxyHttpHandler, storage),
+                # Any non-autostart websockets
+                (r"^(?!/___riptide_proxy_ws).*$", ProxyWebsocketHandler, storage),
+                # autostart websockets
+                (r"/___riptide_proxy_ws", AutostartHandler, storage),
+            ],
+            static_url_prefix="/___riptide/",
+            static_path=get_resources("assets"),
+            template_path=get_resources("tpl"),
+        )
+
+    app = build_application(system_config, runtime_storage)
+
     # xheaders enables parsing of X-Forwarded-Ip etc. headers
-    app.listen(http_port, xheaders=True)
+    server_options = {
+        "connections": client_connections,
+        "xheaders": True,
+        "idle_connection_timeout": client_idle_timeout,
+        "body_timeout": client_body_timeout,
+        "max_header_size": client_max_header_size,
+    }
+    sockets = {"http": listening_sockets("http", http_port)}
+    http_server = LimitedHTTPServer(app, name="http", **server_options)
+    http_server.add_sockets(sockets["http"])
+    servers: list[tornado.httpserver.HTTPServer] = [http_server]
 
     # Prepare HTTPS
     if https_port:
-        https_app = tornado.httpserver.HTTPServer(app, ssl_options=ssl_options, xheaders=True)
-        https_app.listen(https_port)
+        sockets["https"] = listening_sockets("https", https_port)
+        https_app = LimitedHTTPServer(app, name="https", ssl_options=ssl_options, **server_options)
+        https_app.add_sockets(sockets["https"])
+        servers.append(https_app)
+
+    # Config reload
+    reloader = None
+    if config_path is not None:
+        reloader = ConfigReloader(config_path, system_config, engine, runtime_storage, servers, build_application)
+        reloader.start(watch=watch_config)
+
+    # Graceful shutdown and restarts
+    on_stop = []
+    if watchdog is not None:
+        on_stop.append(watchdog.stop)
+    if reloader is not None:
+        on_stop.append(reloader.stop)
+    lifecycle = Lifecycle(
+        servers,
+        sockets,
+        lambda: reloader.runtime_storage if reloader is not None else runtime_storage,
+        on_stop,
+    )
+    notify_ready()
 
     # Start!
     ioloop = tornado.ioloop.IOLoop.current()
     if start_ioloop:
+        lifecycle.start()
         ioloop.start()
 
 
@@ -0,0 +1,100 @@
+"""JSON API for the status of projects, on the base URL of the proxy"""
+
+from __future__ import annotations
+
+import json
+
+import tornado.iostream
+import tornado.web
+from riptide_proxy import STATUS_LONG_POLL_TIMEOUT
+from riptide_proxy.project_loader import RuntimeStorage
+from riptide_proxy.server.routing import HostnameMatcher
+
+STATUS_API_PATH = "/___riptide_proxy_api"
+
+
+def get_status_routes(hostname: str, runtime_storage: RuntimeStorage):
+    args = {"runtime_storage": runtime_storage}
+    return [
+        (HostnameMatcher(STATUS_API_PATH + r"/status", hostname), StatusHandler, args),
+        (HostnameMatcher(STATUS_API_PATH + r"/status/([^/]+)", hostname), StatusHandler, args),
+        (HostnameMatcher(STATUS_API_PATH + r"/changes", hostname), ChangesHandler, args),
+    ]
+
+
+class BaseStatusHandler(tornado.web.RequestHandler):
+    SUPPORTED_METHODS = ("GET",)
+
+    def initialize(self, runtime_storage: RuntimeStorage):
+        self.runtime_storage = runtime_storage
+
+    def compute_etag(self):
+        return None  # the status board has its own
+
+    def set_default_headers(self):
+        self.set_header("Content-Type", "application/json")
+        self.set_header("Cache-Control", "no-cache")
+
+    def write_error(self, status_code: int, **_kwargs):
+        self.finish({"error": self._reason, "status": status_code})
+
+
+class StatusHandler(BaseStatusHandler):
+    async def get(self, project_name: str | None = None):
+        """
+        The status of all projects (``/status``) or of one (``/status/<name>``). Answers 304 if the status has the
+        ETag sent in If-None-Match.
+        """
+        board = self.runtime_storage.status_board
+        await board.refresh(self.runtime_storage)
+        etag, body = board.etag(project_name), board.encoded(project_name)
+        if etag is None or body is None:
+            raise tornado.web.HTTPError(404, reason="Project not found.")
+        self.set_header("Etag", etag)
+        if self.check_etag_header():
+            self.set_status(304)
+            return
+        self.write(body)
+
+
+class ChangesHandler(BaseStatusHandler):
+    async def get(self):
+        """
+        The projects that changed since a version (token of ``version``, as ``since`` query argument or
+        Last-Event-ID header). All projects without one, or if it is from another process of the proxy.
+        As long-poll, the answer is sent once anything changed, or after ``timeout`` seconds (at most
+        STATUS_LONG_POLL_TIMEOUT) with no projects. With Accept: text/event-stream, every change is sent as a
+        Server-Sent Event with the version as its id, until the client disconnects.
+        """
+        board = self.runtime_storage.status_board
+        since = self.request.headers.get("Last-Event-ID") or self.get_query_argument("since", None)
+        try:
+            timeout = min(
+                float(self.get_query_argument("timeout", str(STATUS_LONG_POLL_TIMEOUT))), STATUS_LONG_POLL_TIMEOUT
+            )
+        except ValueError as ex:
+            raise tornado.web.HTTPError(400, reason="timeout must be a number.") from ex
+        if "text/event-stream" not in self.request.headers.get("Accept", ""):
+            if since is not None:
+                await board.wait(self.runtime_storage, since, timeout)
+            else:
+                await board.refresh(self.runtime_storage)
+            self.write(board.changes(since))
+            return
+
+        self.set_header("Content-Type", "text/event-stream")
+        if since is None:
+            await board.refresh(self.runtime_storage)
+        try:
+            while True:
+                if board.token != since:
+                    changes = board.changes(since)
+                    since = changes["version"]
+                    self.write(f"id: {since}\ndata: {json.dumps(changes)}\n\n")
+                else:
+                    # Heartbeat, to notice closed connections
+                    self.write(":\n\n")
+                await self.flush()
+                await board.wait(self.runtime_storage, since, STATUS_LONG_POLL_TIMEOUT)
+        except tornado.iostream.StreamClosedError:
+            pass
@@ -0,0 +1,111 @@
+"""HTTP clients for upstream requests that can be aborted"""
+
+from __future__ import annotations
+
+import sys
+from collections.abc import Awaitable
+from typing import Any
+
+import tornado.httpclient
+import tornado.httputil
+from riptide_proxy import UPSTREAM_EXPECT_TIMEOUT
+from tornado.http1connection import HTTP1Connection
+from tornado.iostream import IOStream
+from tornado.simple_httpclient import SimpleAsyncHTTPClient, _HTTPConnection
+from tornado.tcpclient import TCPClient
+
+
+class AbortableTCPClient(TCPClient):
+    """TCP client that remembers the stream of its last connection, so the request that uses it can be aborted."""
+
+    def __init__(self, resolver=None):
+        super().__init__(resolver)
+        self.stream: IOStream | None = None
+
+    async def connect(self, *args: Any, **kwargs: Any) -> IOStream:
+        self.stream = await super().connect(*args, **kwargs)
+        return self.stream
+
+    def abort(self) -> bool:
+        """
+        Close the connection of the running request, which then fails with HTTPStreamClosedError.
+        Unlike cancelling the future of the request, this also frees the upstream server.
+        Returns False if there is no connection (yet).
+        """
+        if self.stream is None:
+            return False
+        self.stream.close()
+        return True
+
+
+class _UpstreamConnection(_HTTPConnection):
+    """
+    Connection of upstream requests.
+
+    Requests with Expect: 100-continue send the body after UPSTREAM_EXPECT_TIMEOUT, if the upstream server didn't
+    answer until then. Servers may ignore Expect and wait for the body (RFC 9110, section 10.1.1), like curl, the
+    upload would be stuck otherwise.
+
+    If the streaming_callback returns an awaitable, the response is not read further until it resolves.
+    """
+
+    _body_started = False
+    _expect_timeout: object | None = None
+
+    def _create_connection(self, stream: IOStream) -> HTTP1Connection:
+        connection = super()._create_connection(stream)
+        if self.request.expect_100_continue:
+            # The request headers are sent right after this.
+            self._expect_timeout = self.io_loop.call_later(UPSTREAM_EXPECT_TIMEOUT, self._on_expect_timeout)
+        return connection
+
+    def _on_expect_timeout(self):
+        self._expect_timeout = None
+        if self._body_started or self.code is not None or self.final_callback is None:
+            return
+        self._body_started = True
+        self.io_loop.add_callback(self._write_body_without_continue)
+
+    async def _write_body_without_continue(self):
+        try:
+            await self._write_body(False)
+        except Exception:
+            if not self._handle_exception(*sys.exc_info()):
+                raise
+
+    async def headers_received(
+        self,
+        first_line: tornado.httputil.ResponseStartLine | tornado.httputil.RequestStartLine,
+        headers: tornado.httputil.HTTPHeaders,
+    ) -> None:
+        if self._expect_timeout is not None:
+            self.io_loop.remove_timeout(self._expect_timeout)
+            self._expect_timeout = None
+        if self.request.expect_100_continue and first_line.code == 100:  # type: ignore
+            if self._body_started:
+                # Late 100 Continue, the body is sent already
+                return
+            self._body_started = True
+        await super().headers_received(first_line, headers)
+
+    def data_received(self, chunk: bytes) -> Awaitable[None] | None:  # type: ignore[override]
+        if self.request.streaming_callback is not None and not self._should_follow_redirect():
+            return self.request.streaming_callback(chunk)
+        return super().data_received(chunk)  # type: ignore[func-returns-value]
+
+
+class _UpstreamHTTPClient(SimpleAsyncHTTPClient):
+    def _connection_class(self) -> type:
+        return _UpstreamConnection
+
+
+def abortable_http_client(**kwargs: Any) -> tuple[tornado.httpclient.AsyncHTTPClient, AbortableTCPClient]:
+    """
+    Create a new HTTP client (for the requests of one proxy request) and the TCP client it connects with.
+
+    :param kwargs: Arguments for the HTTP client, eg. max_body_size.
+    """
+    http_client = _UpstreamHTTPClient(force_instance=True, **kwargs)
+    tcp_client = AbortableTCPClient(http_client.resolver)  # type: ignore
+    http_client.tcp_client = tcp_client  # type: ignore
+    return http_client, tcp_client
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import asyncio
 import json
 import logging
 from collections.abc import Awaitable
@@ -12,7 +13,6 @@ if TYPE_CHECKING:
     from riptide.config.document.project import Project
     from riptide.engine.abstract import AbstractEngine
 from riptide_proxy import LOGGER_NAME
-from riptide_proxy.autostart_restrict import check_permission
 from riptide_proxy.project_loader import RuntimeStorage, load_project_and_service
 from riptide_proxy.server.websocket import ERR_BAD_GATEWAY
 
@@ -93,7 +93,7 @@ class AutostartHandler(websocket.WebSocketHandler):
 
             # Check if client has permission for auto-start
             addr: str = self.request.remote_ip  # type: ignore
-            if not check_permission(addr, self.config):
+            if not self.runtime_storage.autostart_restriction.allows(addr):
                 self.close(ERR_BAD_GATEWAY, "Client not allowed.")
                 return
 
@@ -123,11 +123,16 @@ class AutostartHandler(websocket.WebSocketHandler):
                         services = self.project["default_services"]
                     else:
                         services = self.project["app"]["services"].keys()
+                    started = []
                     async for service_name, status, finished in self.engine.start_project(self.project, services):
                         for client in self.__class__.clients[p_name]:
                             try_write(client, json.dumps(build_status_answer(service_name, status, finished)))
                         if status and finished:
                             had_an_error = True
+                        elif finished:
+                            started.append(service_name)
+                    if not had_an_error:
+                        await self._wait_until_ready(started)
                 except Exception as err:
                     logger.warning("Autostart WS: Project %s start ERROR: %s", (p_name, str(err)))
                     for client in self.__class__.clients[p_name]:
@@ -143,3 +148,34 @@ class AutostartHandler(websocket.WebSocketHandler):
                         for client in self.__class__.clients[p_name]:
                             try_write(client, json.dumps({"status": "failed"}))
                 self.__class__.running = False
+                self.runtime_storage.async_engine.forget(p_name)
+
+    async def _wait_until_ready(self, service_names: list[str]):
+        """Wait until the started services that are reachable via the proxy accept requests."""
+        project = self.project
+        assert project
+        p_name = project["name"]
+        services = project["app"]["services"]
+        # The addresses of the services changed.
+        self.runtime_storage.async_engine.forget(p_name)
+
+        async def wait(service_name: str):
+            def on_wait(text: str):
+                update = {"service": service_name, "status": {"steps": 1, "current_step": 1, "text": text}}
+                for client in self.__class__.clients[p_name]:
+                    try_write(client, json.dumps({"status": "update", "update": update}))
+
+            ready = await self.runtime_storage.readiness.wait(
+                self.runtime_storage.async_engine,
+                project,
+                service_name,
+                self.request.host,
+                on_wait,
+            )
+            # Not ready services are left to the proxy, which shows its error pages for them.
+            for client in self.__class__.clients[p_name]:
+                try_write(client, json.dumps(build_status_answer(service_name, None, True)))
+            if not ready:
+                logger.debug("Autostart WS: Service %s/%s NOT READY", p_name, service_name)
+
+        await asyncio.gather(*(wait(name) for name in service_names if name in services and "port" in services[name]))
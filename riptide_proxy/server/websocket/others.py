@@ -1,17 +1,28 @@
 from __future__ import annotations
 
 import logging
-from typing import TYPE_CHECKING
+import time
+from typing import TYPE_CHECKING, ClassVar
 
 if TYPE_CHECKING:
     from riptide.config.document.config import Config
-    from riptide.config.document.project import Project
     from riptide.engine.abstract import AbstractEngine
+    from riptide_proxy.tracing import Trace
 from riptide_proxy import LOGGER_NAME
-from riptide_proxy.project_loader import ResolveStatus, RuntimeStorage, resolve_project
+from riptide_proxy.balancer import Endpoints
+from riptide_proxy.headers import SKIPPED_WEBSOCKET_HEADERS
+from riptide_proxy.project_loader import (
+    ProjectRoute,
+    ResolveStatus,
+    RuntimeStorage,
+    forget_resolution,
+    resolve_project,
+)
 from riptide_proxy.server.websocket import ERR_BAD_GATEWAY
-from tornado import httpclient, ioloop, websocket
-from tornado.websocket import WebSocketClientConnection, websocket_connect
+from riptide_proxy.server.websocket.upstream import UpstreamUnavailable, WebsocketUpstreams
+from riptide_proxy.tracing import TRACEPARENT_HEADER, span
+from tornado import httpclient, httputil, ioloop, websocket
+from tornado.websocket import WebSocketClientConnection
 
 logger = logging.getLogger(LOGGER_NAME)
 
@@ -19,6 +30,10 @@ logger = logging.getLogger(LOGGER_NAME)
 class ProxyWebsocketHandler(websocket.WebSocketHandler):
     """Implementation of the Proxy for Websockets"""
 
+    upstreams: ClassVar[WebsocketUpstreams] = WebsocketUpstreams()
+    # Open proxy connections, for closing them on shutdown
+    connections: ClassVar[set[ProxyWebsocketHandler]] = set()
+
     def __init__(
         self, application, request, config: Config, engine: AbstractEngine, runtime_storage: RuntimeStorage, **kwargs
     ):
@@ -31,7 +46,15 @@ class ProxyWebsocketHandler(websocket.WebSocketHandler):
         self.engine: AbstractEngine = engine
         self.runtime_storage: RuntimeStorage = runtime_storage
         self.conn: WebSocketClientConnection | None = None
-        self.project: Project | None = None
+        self.project: ProjectRoute | None = None
+        # Endpoints of the service and the address of the open upstream connection, counted as outstanding while it
+        # is open (see Endpoints.started)
+        self.endpoints: Endpoints | None = None
+        self.upstream_address: str | None = None
+        # For the control API. Text messages are counted in characters.
+        self.opened_at = time.monotonic()
+        self.bytes_in = 0
+        self.bytes_out = 0
 
     async def open(self, *args, **kwargs):
         """
@@ -39,37 +62,50 @@ class ProxyWebsocketHandler(websocket.WebSocketHandler):
 
         Source: https://github.com/tornadoweb/tornado/issues/2538
         """
+        self.__class__.connections.add(self)
+        tracer = self.runtime_storage.tracer
+        if tracer is None:
+            return await self._open_proxy(None)
+
+        trace = tracer.start_trace("websocket", self.request.headers.get(TRACEPARENT_HEADER))
+        try:
+            await self._open_proxy(trace)
+        finally:
+            trace.finish(host=self.request.host, project=self.project.name if self.project else None)
 
+    async def _open_proxy(self, trace: Trace | None):
         try:
             logger.debug(f"Incoming WebSocket Proxy request for {self.request.host}")
 
-            rc, data = resolve_project(
-                self.request.host, self.config["url"], self.runtime_storage, self.config["autostart"]
-            )
+            with span(trace, "resolve"):
+                resolution = await resolve_project(
+                    self.request.host, self.config["url"], self.runtime_storage, self.config["autostart"], trace
+                )
+            rc = resolution.status
 
             if rc == ResolveStatus.NO_MAIN_SERVICE:
-                project, request_service_name = data
-                logger.warning(f"WebSocket Proxy: No main service for {project['name']}, {request_service_name}")
+                logger.warning(
+                    f"WebSocket Proxy: No main service for {resolution.project_name}, {resolution.service_name}"
+                )
                 self.close(ERR_BAD_GATEWAY)
                 return
 
             elif rc == ResolveStatus.SERVICE_NOT_FOUND:
-                project, request_service_name = data
-                logger.warning(f"WebSocket Proxy: Service not found for {project['name']}, {request_service_name}")
+                logger.warning(
+                    f"WebSocket Proxy: Service not found for {resolution.project_name}, {resolution.service_name}"
+                )
                 self.close(ERR_BAD_GATEWAY)
                 return
 
             elif rc == ResolveStatus.NOT_STARTED or rc == ResolveStatus.NOT_STARTED_AUTOSTART:
-                project, resolved_service_name = data
                 logger.warning(
-                    f"WebSocket Proxy: Had no ip for {project['name']}, {resolved_service_name}. Not started?"
+                    f"WebSocket Proxy: Had no ip for {resolution.project_name}, {resolution.service_name}. Not started?"
                 )
                 self.close(ERR_BAD_GATEWAY)
                 return
 
             elif rc == ResolveStatus.PROJECT_NOT_FOUND:
-                project_name = data
-                logger.warning(f"WebSocket Proxy: Project not found for {project_name}")
+                logger.warning(f"WebSocket Proxy: Project not found for {resolution.project_name}")
                 self.close(ERR_BAD_GATEWAY)
                 return
 
@@ -87,32 +123,68 @@ class ProxyWebsocketHandler(websocket.WebSocketHandler):
             self.close(ERR_BAD_GATEWAY)
             return
 
-        project, resolved_service_name, address = data
+        route, resolved_service_name = resolution.route, resolution.service_name
+        assert resolved_service_name is not None
+        address = self.runtime_storage.balancer.pick(resolution.endpoints, self.request)
 
-        self.project = project
+        self.project = route
 
         # Establish reverse proxy connection with upstream server
-        backend_request = httpclient.HTTPRequest(
-            url=address.replace("http://", "ws://") + self.request.uri,
-            headers=self.request.headers,
-            method=self.request.method or "GET",
-        )
-        self.conn = await websocket_connect(backend_request)
+        with span(trace, "upstream.connect", address=address) as upstream_span:
+            headers = self.upstream_headers()
+            if upstream_span is not None and upstream_span.trace.tracer.propagate:
+                headers[TRACEPARENT_HEADER] = upstream_span.traceparent()
+            backend_request = httpclient.HTTPRequest(
+                url=address.replace("http://", "ws://") + self.request.uri,  # type: ignore
+                headers=headers,
+                method=self.request.method or "GET",
+            )
+            try:
+                self.conn = await self.__class__.upstreams.connect(address, backend_request)
+            except UpstreamUnavailable as err:
+                logger.debug(f"WebSocket Proxy ({route.name}): {err}")
+                self.close(ERR_BAD_GATEWAY)
+                return
+            except Exception as err:
+                logger.debug(f"WebSocket Proxy ({route.name}): Could not connect to {address}: {err}")
+                # The container may have been restarted with a different address.
+                self.runtime_storage.balancer.eject(resolution.endpoints, address)
+                if resolution.endpoints.available(time.monotonic()) == resolution.endpoints.addresses:
+                    forget_resolution(route.name, resolved_service_name, self.runtime_storage)
+                self.close(ERR_BAD_GATEWAY)
+                return
+        if self.ws_connection is None:
+            # The client closed the connection while connecting, on_close was called already.
+            self.conn.close()
+            return
+        self.endpoints = resolution.endpoints
+        self.upstream_address = address
+        self.endpoints.started(address)
 
         async def proxy_loop():
             assert self.conn is not None
             assert self.project is not None
             while True:
                 msg = await self.conn.read_message()
-                logger.debug(f"WebSocket Proxy ({self.project['name']}): received msg (server)")
+                logger.debug(f"WebSocket Proxy ({self.project.name}): received msg (server)")
                 if msg is None:
                     break
+                self._count(0, len(msg))
                 await self.write_message(msg, binary=isinstance(msg, bytes))
-                logger.debug(f"WebSocket Proxy ({self.project['name']}): write msg (client)")
+                logger.debug(f"WebSocket Proxy ({self.project.name}): write msg (client)")
+            # The upstream closed the connection
+            self.close(self.conn.close_code, self.conn.close_reason)
 
         # Start backend read/write loop
         ioloop.IOLoop.current().spawn_callback(proxy_loop)
-        logger.debug(f"WebSocket Proxy ({self.project['name']}): reverse proxy established")
+        logger.debug(f"WebSocket Proxy ({self.project.name}): reverse proxy established")
+
+    def upstream_headers(self) -> httputil.HTTPHeaders:
+        """Headers for the upstream handshake: The request headers without the handshake headers plus proxy headers."""
+        assert self.project is not None
+        return self.runtime_storage.header_pipeline.request_headers(
+            self.request, self.project.name, SKIPPED_WEBSOCKET_HEADERS
+        )
 
     def select_subprotocol(self, subprotocols):
         if len(subprotocols) == 0:
@@ -121,16 +193,30 @@ class ProxyWebsocketHandler(websocket.WebSocketHandler):
 
     def on_message(self, message):
         # Send message to backend
-        assert self.conn is not None
+        if self.conn is None:
+            # Connecting to the upstream failed, the connection is being closed.
+            return
         assert self.project is not None
-        logger.debug(f"WebSocket Proxy ({self.project['name']}): received msg (client)")
+        logger.debug(f"WebSocket Proxy ({self.project.name}): received msg (client)")
+        self._count(len(message), 0)
         self.conn.write_message(message, binary=isinstance(message, bytes))
-        logger.debug(f"WebSocket Proxy ({self.project['name']}): write msg (server)")
+        logger.debug(f"WebSocket Proxy ({self.project.name}): write msg (server)")
+
+    def _count(self, bytes_in: int, bytes_out: int):
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+        if self.runtime_storage.traffic is not None and self.project is not None:
+            self.runtime_storage.traffic.record(self.project.name, 0, bytes_in, bytes_out)
 
     def on_close(self, code=None, reason=None):
         # Close backend connection
+        self.__class__.connections.discard(self)
+        if self.upstream_address is not None:
+            self.endpoints.finished(self.upstream_address)  # type: ignore
+            self.upstream_address = None
+        if self.conn is None:
+            return
         assert self.project is not None
-        logger.debug(f"WebSocket Proxy ({self.project['name']}): closed (client)")
-        if self.conn is not None:
-            self.conn.close(code, reason)
-        logger.debug(f"WebSocket Proxy ({self.project['name']}): closed (server)")
+        logger.debug(f"WebSocket Proxy ({self.project.name}): closed (client)")
+        self.conn.close(code, reason)
+        logger.debug(f"WebSocket Proxy ({self.project.name}): closed (server)")
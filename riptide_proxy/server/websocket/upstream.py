@@ -0,0 +1,126 @@
+"""Connects WebSocket proxy connections to their upstream, with timeouts and backoff during upstream outages"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+
+from tornado import httpclient
+from tornado.websocket import WebSocketClientConnection, websocket_connect
+
+from riptide_proxy import (
+    LOGGER_NAME,
+    WS_UPSTREAM_BACKOFF_BASE,
+    WS_UPSTREAM_BACKOFF_MAX,
+    WS_UPSTREAM_CONNECT_TIMEOUT,
+    WS_UPSTREAM_HANDSHAKE_TIMEOUT,
+)
+
+logger = logging.getLogger(LOGGER_NAME)
+
+
+class UpstreamUnavailable(Exception):
+    def __init__(self, address: str, retry_in: float) -> None:
+        self.address = address
+        self.retry_in = retry_in
+
+    def __str__(self):
+        return f"Upstream {self.address} is unavailable, retrying in {self.retry_in:.1f}s"
+
+
+class _UpstreamState:
+    """Failure state of an upstream. Only exists while an upstream is failing."""
+
+    __slots__ = ("failures", "retry_at", "probe")
+
+    def __init__(self):
+        self.failures = 0
+        self.retry_at = 0.0
+        # Set while one connection attempt checks whether the upstream is back. Result is True if it is.
+        self.probe: asyncio.Future[bool] | None = None
+
+
+class WebsocketUpstreams:
+    """
+    Opens upstream WebSocket connections.
+
+    Each connection attempt is bounded by a connect and handshake timeout. After an upstream failed, further attempts
+    fail immediately until an exponentially growing backoff has passed. After that, only one attempt (the probe)
+    connects, concurrent attempts wait for its outcome. This way a storm of reconnecting clients
+    (eg. HMR clients while a dev server restarts) results in at most one upstream connect at a time per upstream.
+    """
+
+    def __init__(self):
+        self._states: dict[str, _UpstreamState] = {}
+
+    async def connect(self, address: str, request: httpclient.HTTPRequest) -> WebSocketClientConnection:
+        """
+        Connect to the upstream.
+
+        :param address: The upstream address (scheme, host and port), used as key for the failure state
+        :param request: The upstream request. Its connect and request timeouts are set by this method.
+        :raises UpstreamUnavailable: If the upstream is in backoff or the probe for it failed
+        :raises: Any exception of websocket_connect if connecting failed
+        """
+        # The probe, if this attempt is the one that checks whether the upstream is back
+        probe = None
+        state = self._states.get(address)
+        if state is not None:
+            now = time.monotonic()
+            if now < state.retry_at:
+                raise UpstreamUnavailable(address, state.retry_at - now)
+            if state.probe is not None:
+                # The probe is bounded by the handshake timeout as well, this only guards against a probe that is
+                # never resolved.
+                try:
+                    available = await asyncio.wait_for(asyncio.shield(state.probe), WS_UPSTREAM_HANDSHAKE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    available = False
+                if not available:
+                    raise UpstreamUnavailable(address, max(state.retry_at - time.monotonic(), 0.0))
+            else:
+                probe = state.probe = asyncio.get_running_loop().create_future()
+
+        request.connect_timeout = WS_UPSTREAM_CONNECT_TIMEOUT
+        request.request_timeout = WS_UPSTREAM_HANDSHAKE_TIMEOUT
+        try:
+            conn = await websocket_connect(request)
+        except Exception as err:
+            self._failed(address, err)
+            raise
+        except BaseException:
+            # Cancelled (eg. the client went away): The waiting attempts give up, the next one probes again.
+            self._abandoned(address, probe)
+            raise
+        self._succeeded(address)
+        return conn
+
+    def _failed(self, address: str, err: Exception):
+        state = self._states.get(address)
+        if state is None:
+            state = self._states[address] = _UpstreamState()
+            logger.warning(f"WebSocket Proxy: Could not connect to {address}: {err}. Backing off.")
+        elif state.probe is None and time.monotonic() < state.retry_at:
+            # Another attempt that was already running when the upstream failed, doesn't extend the backoff.
+            return
+        state.failures += 1
+        backoff = min(WS_UPSTREAM_BACKOFF_BASE * 2 ** (state.failures - 1), WS_UPSTREAM_BACKOFF_MAX)
+        state.retry_at = time.monotonic() + backoff
+        logger.debug(f"WebSocket Proxy: upstream {address} failed {state.failures} time(s), backoff {backoff:.1f}s")
+        if state.probe is not None:
+            state.probe.set_result(False)
+            state.probe = None
+
+    def _abandoned(self, address: str, probe: asyncio.Future[bool] | None):
+        if probe is None or probe.done():
+            return
+        probe.set_result(False)
+        state = self._states.get(address)
+        if state is not None and state.probe is probe:
+            state.probe = None
+
+    def _succeeded(self, address: str):
+        state = self._states.pop(address, None)
+        if state is not None and state.probe is not None:
+            state.probe.set_result(True)
@@ -0,0 +1,161 @@
+"""Serves static files of projects from their source directory, without asking the service container"""
+
+from __future__ import annotations
+
+import fnmatch
+import json
+import logging
+import mimetypes
+import os
+import re
+from collections import OrderedDict
+from stat import S_ISREG
+from urllib.parse import unquote
+
+from riptide_proxy import LOGGER_NAME, STATIC_FILE_HANDLE_CACHE_SIZE
+
+logger = logging.getLogger(LOGGER_NAME)
+
+
+class StaticRules:
+    """
+    The compiled rules of one service. Each rule maps the request paths that start with a prefix or match a glob
+    to a directory relative to the source directory of the project:
+
+    - ``{"prefix": "/build/", "dir": "public/build"}``: /build/app.js is served from <src>/public/build/app.js.
+    - ``{"glob": "/*.ico", "dir": "public"}``: /favicon.ico is served from <src>/public/favicon.ico.
+    """
+
+    def __init__(self, rules: list[dict[str, str]]):
+        self.prefixes: list[tuple[str, str]] = []
+        globs: list[str] = []
+        self.glob_dirs: list[str] = []
+        for rule in rules:
+            directory = rule["dir"].strip("/")
+            if "prefix" in rule:
+                self.prefixes.append((rule["prefix"], directory))
+            else:
+                globs.append(f"(?P<g{len(globs)}>{fnmatch.translate(rule['glob'])})")
+                self.glob_dirs.append(directory)
+        # All globs in one expression, the name of the matching group is the index of the glob
+        self.globs = re.compile("|".join(globs)) if globs else None
+
+    def match(self, path: str) -> tuple[str, str] | None:
+        """The directory (relative to the source directory) and the file in it for a request path, if a rule matches."""
+        for prefix, directory in self.prefixes:
+            if path.startswith(prefix):
+                return directory, path[len(prefix) :]
+        if self.globs is not None:
+            match = self.globs.match(path)
+            if match is not None:
+                return self.glob_dirs[int(match.lastgroup[1:])], path  # type: ignore
+        return None
+
+
+class StaticFile:
+    """An open file of the open file cache, valid as long as the file at its path has the same inode, size and mtime."""
+
+    __slots__ = ("fd", "key", "size", "mtime", "etag", "content_type", "users", "evicted")
+
+    def __init__(self, path: str, fd: int, stat: os.stat_result):
+        self.fd = fd
+        # Number of requests sending the file. The file is closed once it was evicted from the cache and is unused.
+        self.users = 0
+        self.evicted = False
+        self.key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        self.content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+    def read(self, offset: int, size: int) -> bytes:
+        # pread doesn't move a shared file position, so concurrent requests can read the same file.
+        return os.pread(self.fd, size, offset)
+
+    def acquire(self):
+        self.users += 1
+
+    def release(self):
+        self.users -= 1
+        if self.evicted and not self.users:
+            os.close(self.fd)
+
+    def evict(self):
+        self.evicted = True
+        if not self.users:
+            os.close(self.fd)
+
+
+class StaticFiles:
+    """
+    The static file rules of all projects, loaded from a JSON file that maps project names to service names to lists
+    of rules (see StaticRules). Requests that don't match a rule, or whose file doesn't exist, are sent to the service.
+
+    Recently served files are kept open (up to STATIC_FILE_HANDLE_CACHE_SIZE), so a request costs one stat call
+    to check that the file was not changed.
+    """
+
+    def __init__(self, rules: dict[str, dict[str, list[dict[str, str]]]]):
+        # (project name, service name) => rules
+        self.rules = {
+            (project_name, service_name): StaticRules(service_rules)
+            for project_name, services in rules.items()
+            for service_name, service_rules in services.items()
+        }
+        self._open_files: OrderedDict[str, StaticFile] = OrderedDict()
+
+    @classmethod
+    def from_file(cls, path: str) -> StaticFiles:
+        """
+        :raises OSError: if the file can't be read
+        :raises ValueError: if the file is not valid
+        """
+        with open(path) as f:
+            rules = json.load(f)
+        try:
+            return cls(rules)
+        except (KeyError, TypeError, AttributeError, re.error) as ex:
+            raise ValueError(f"Invalid static file rules in {path}: {ex!r}") from ex
+
+    def lookup(self, project_name: str, service_name: str, src: str, path: str) -> StaticFile | None:
+        """
+        The file to serve for a request path, None if the request has to be sent to the service.
+        Call acquire on the file before sending it and release afterwards.
+        """
+        rules = self.rules.get((project_name, service_name))
+        if rules is None:
+            return None
+        match = rules.match(path)
+        if match is None:
+            return None
+        directory, file = match
+        base = os.path.normpath(os.path.join(src, directory))
+        file_path = os.path.normpath(os.path.join(base, unquote(file).lstrip("/")))
+        if not file_path.startswith(base + os.sep) or "\0" in file_path:
+            return None
+        return self._open(file_path)
+
+    def _open(self, path: str) -> StaticFile | None:
+        try:
+            stat = os.stat(path)
+        except (OSError, ValueError):
+            return None
+        cached = self._open_files.get(path)
+        if cached is not None:
+            if cached.key == (stat.st_ino, stat.st_size, stat.st_mtime_ns):
+                self._open_files.move_to_end(path)
+                return cached
+            del self._open_files[path]
+            cached.evict()
+        if not S_ISREG(stat.st_mode):
+            return None
+        try:
+            static_file = StaticFile(path, os.open(path, os.O_RDONLY), stat)
+        except OSError as ex:
+            logger.debug(f"Could not open static file {path}: {ex}")
+            return None
+        self._open_files[path] = static_file
+        if len(self._open_files) > STATIC_FILE_HANDLE_CACHE_SIZE:
+            _, evicted = self._open_files.popitem(last=False)
+            evicted.evict()
+        return static_file
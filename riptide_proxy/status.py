@@ -0,0 +1,218 @@
+"""A shared snapshot of the status of all projects, for the landing page and the status API"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import TYPE_CHECKING, Any
+
+from riptide.config.document.project import Project
+from riptide_proxy import LOGGER_NAME, STATUS_REFRESH_INTERVAL, STATUS_REMOVED_HISTORY, project_loader
+
+if TYPE_CHECKING:
+    from riptide_proxy.project_loader import RuntimeStorage
+
+logger = logging.getLogger(LOGGER_NAME)
+
+
+def project_status(project: Project, service_statuses: dict[str, bool]) -> dict[str, Any]:
+    """The JSON status of a project: whether its services run and the URLs of the services that have a port."""
+    services = {}
+    for service_name, service in sorted(project["app"]["services"].items()):
+        urls = []
+        if "port" in service:
+            urls = ["//" + service.domain()] + ["//" + domain for domain in service.additional_domains().values()]
+        services[service_name] = {"running": bool(service_statuses.get(service_name)), "urls": urls}
+    return {"name": project["name"], "services": services}
+
+
+class StatusBoard:
+    """
+    The status of all projects, refreshed at most once every STATUS_REFRESH_INTERVAL seconds no matter how many
+    clients ask for it. While clients wait for changes, it is refreshed in the background in this interval.
+
+    Each refresh that changes anything increases the version. Every project remembers the version it last changed
+    in, so clients that know version N only need the projects changed since. Versions start at 0 with each process,
+    so clients get them (and ETags) as "<epoch>-<version>" tokens with a random id of the process. Tokens of another
+    process, or too old to know which projects were removed since, get the status of all projects.
+    """
+
+    def __init__(self):
+        self.version = 0
+        # Loaded projects and their status, sorted by name
+        self.projects: list[Project] = []
+        self.service_statuses: dict[str, dict[str, bool]] = {}
+        self.load_errors: list[list[str]] = []
+        # Project name => JSON status, version it last changed in
+        self._statuses: dict[str, tuple[dict[str, Any], int]] = {}
+        # Names of removed projects => version they were removed in, oldest first, at most STATUS_REMOVED_HISTORY
+        self._removed: dict[str, int] = {}
+        # Clients with versions before this one may not know about all removed projects
+        self._removed_since = 0
+        self._errors_version = 0
+        self._epoch = os.urandom(4).hex()
+        self._refreshed_at = float("-inf")
+        self._refreshing: asyncio.Future[None] | None = None
+        # Resolved on the next change
+        self._changed: asyncio.Future[None] | None = None
+        # Number of clients waiting for changes and the background refresh that runs for them
+        self._watchers = 0
+        self._ticker: asyncio.Task | None = None
+        # Storage of the latest waiting client, it changes when the system config is reloaded
+        self._runtime_storage: RuntimeStorage | None = None
+        # Encoded responses of the current version, by project name (None for all projects)
+        self._encoded: dict[str | None, bytes] = {}
+
+    async def refresh(self, runtime_storage: RuntimeStorage):
+        """Refresh the snapshot, unless that was done within STATUS_REFRESH_INTERVAL seconds."""
+        if time.monotonic() - self._refreshed_at < STATUS_REFRESH_INTERVAL:
+            return
+        if self._refreshing is None:
+            self._refreshing = asyncio.ensure_future(self._refresh(runtime_storage))
+        await asyncio.shield(self._refreshing)
+
+    @property
+    def token(self) -> str:
+        """The current version, as clients get it."""
+        return f"{self._epoch}-{self.version}"
+
+    def _version_of(self, token: str | None) -> int | None:
+        """The version of a token of this process, None if it is not one or too old for changes."""
+        epoch, _, version = (token or "").rpartition("-")
+        if epoch != self._epoch or not version.isdigit():
+            return None
+        number = int(version)
+        if number > self.version or number < self._removed_since:
+            return None
+        return number
+
+    async def wait(self, runtime_storage: RuntimeStorage, since: str | None, timeout: float) -> bool:
+        """
+        Wait until the version is another one than the token since (right away if since is not a token of this
+        process). False if it was not within timeout seconds.
+        """
+        self._watchers += 1
+        self._runtime_storage = runtime_storage
+        if self._ticker is None:
+            self._ticker = asyncio.create_task(self._tick())
+        try:
+            await self.refresh(runtime_storage)
+            deadline = time.monotonic() + timeout
+            while self.version == self._version_of(since):
+                if self._changed is None:
+                    self._changed = asyncio.get_running_loop().create_future()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                try:
+                    await asyncio.wait_for(asyncio.shield(self._changed), remaining)
+                except asyncio.TimeoutError:
+                    return False
+            return True
+        finally:
+            self._watchers -= 1
+
+    def etag(self, project_name: str | None = None) -> str | None:
+        """The ETag of the status of a project, or of all projects. None if the project is unknown."""
+        if project_name is None:
+            return f'"{self.token}"'
+        status = self._statuses.get(project_name)
+        if status is None:
+            return None
+        return f'"{self._epoch}-{status[1]}"'
+
+    def encoded(self, project_name: str | None = None) -> bytes | None:
+        """The JSON status of a project, or of all projects. None if the project is unknown."""
+        encoded = self._encoded.get(project_name)
+        if encoded is None:
+            if project_name is None:
+                body: dict[str, Any] = {
+                    "version": self.token,
+                    "projects": [status for status, _ in self._statuses.values()],
+                    "load_errors": self.load_errors,
+                }
+            elif project_name in self._statuses:
+                body = {"version": self.token, **self._statuses[project_name][0]}
+            else:
+                return None
+            encoded = self._encoded[project_name] = json.dumps(body).encode()
+        return encoded
+
+    def changes(self, since: str | None) -> dict[str, Any]:
+        """
+        The projects that changed or were removed after the version of the token since. All projects ("full"), if
+        since is not a token of this process or too old.
+        """
+        version = self._version_of(since)
+        full = version is None
+        if version is None:
+            version = -1
+        changes: dict[str, Any] = {
+            "version": self.token,
+            "full": full,
+            "projects": [status for status, changed in self._statuses.values() if changed > version],
+            "removed": [] if full else [name for name, removed in self._removed.items() if removed > version],
+        }
+        if full or self._errors_version > version:
+            changes["load_errors"] = self.load_errors
+        return changes
+
+    async def _refresh(self, runtime_storage: RuntimeStorage):
+        try:
+            projects, errors = project_loader.get_all_projects(runtime_storage)
+            service_statuses = await runtime_storage.async_engine.statuses(projects)
+            self._update(projects, service_statuses, [project_loader.format_load_error(error) for error in errors])
+        except Exception as ex:
+            logger.warning(f"Could not refresh the status of the projects: {ex}")
+        finally:
+            self._refreshed_at = time.monotonic()
+            self._refreshing = None
+
+    def _update(
+        self, projects: list[Project], service_statuses: dict[str, dict[str, bool]], load_errors: list[list[str]]
+    ):
+        self.projects = projects
+        self.service_statuses = service_statuses
+        version = self.version + 1
+        changed = False
+        statuses = {}
+        for project in projects:
+            status = project_status(project, service_statuses[project["name"]])
+            previous = self._statuses.get(project["name"])
+            if previous is not None and previous[0] == status:
+                statuses[project["name"]] = previous
+            else:
+                statuses[project["name"]] = (status, version)
+                self._removed.pop(project["name"], None)
+                changed = True
+        for name in self._statuses.keys() - statuses.keys():
+            self._removed[name] = version
+            changed = True
+        while len(self._removed) > STATUS_REMOVED_HISTORY:
+            # Forget the oldest removal, clients that don't know it yet get all projects.
+            name = next(iter(self._removed))
+            self._removed_since = self._removed.pop(name)
+        if load_errors != self.load_errors:
+            self.load_errors = load_errors
+            self._errors_version = version
+            changed = True
+        if not changed:
+            return
+        self._statuses = statuses
+        self.version = version
+        self._encoded.clear()
+        if self._changed is not None:
+            self._changed.set_result(None)
+            self._changed = None
+
+    async def _tick(self):
+        try:
+            while self._watchers:
+                assert self._runtime_storage is not None
+                await self.refresh(self._runtime_storage)
+                await asyncio.sleep(STATUS_REFRESH_INTERVAL)
+        finally:
+            self._ticker = None
@@ -0,0 +1,167 @@
+"""
+Lightweight request tracing.
+
+A Trace is started for each request (if tracing is enabled) and records spans for the phases of handling it.
+Finished traces are written as JSON lines to a local file. Optionally the trace context is propagated to the
+upstream containers using the W3C ``traceparent`` header.
+
+When tracing is disabled, handlers have no Trace and ``span`` returns a shared no-op context manager.
+"""
+
+from __future__ import annotations
+
+import json
+import random
+import re
+import time
+from contextlib import AbstractContextManager, nullcontext
+from typing import Any
+
+from riptide_proxy import TRACE_BUFFER_SIZE, TRACE_FLUSH_INTERVAL
+from riptide_proxy.batched_writer import BatchedWriter
+
+TRACEPARENT_HEADER = "traceparent"
+TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+_NULL_SPAN: AbstractContextManager[None] = nullcontext()
+
+
+def span(trace: Trace | None, name: str, **attributes: Any) -> AbstractContextManager[Any]:
+    """Returns a context manager that records a span in trace, or a no-op if the trace is None."""
+    if trace is None:
+        return _NULL_SPAN
+    return trace.span(name, **attributes)
+
+
+def event(trace: Trace | None, name: str):
+    """Record a point in time in trace, if it is not None."""
+    if trace is not None:
+        trace.event(name)
+
+
+class Span:
+    __slots__ = ("trace", "name", "span_id", "start", "end", "attributes")
+
+    def __init__(self, trace: Trace, name: str, attributes: dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.start = 0.0
+        self.end: float | None = None
+        self.attributes = attributes
+
+    def __enter__(self) -> Span:
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.end = time.monotonic()
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        self.trace.spans.append(self)
+
+    def traceparent(self) -> str:
+        """W3C traceparent header value for requests made as part of this span."""
+        return f"00-{self.trace.trace_id}-{self.span_id}-{self.trace.flags}"
+
+
+class Trace:
+    __slots__ = (
+        "tracer",
+        "trace_id",
+        "parent_id",
+        "flags",
+        "name",
+        "wall_start",
+        "start",
+        "spans",
+        "events",
+        "attributes",
+    )
+
+    def __init__(self, tracer: Tracer, name: str, traceparent: str | None = None):
+        self.tracer = tracer
+        self.name = name
+        self.parent_id: str | None = None
+        self.trace_id: str | None = None
+        # Trace flags of the traceparent header sent upstream. Only the sampled flag of an incoming header is kept,
+        # new traces are sampled.
+        self.flags = "01"
+        if traceparent is not None:
+            match = TRACEPARENT_RE.match(traceparent.strip())
+            if match:
+                self.trace_id, self.parent_id = match.group(1), match.group(2)
+                self.flags = "01" if int(match.group(3), 16) & 1 else "00"
+        if self.trace_id is None:
+            self.trace_id = f"{random.getrandbits(128):032x}"
+        self.wall_start = time.time()
+        self.start = time.monotonic()
+        self.spans: list[Span] = []
+        self.events: list[tuple[str, float]] = []
+        self.attributes: dict[str, Any] = {}
+
+    def span(self, name: str, **attributes: Any) -> Span:
+        return Span(self, name, attributes)
+
+    def event(self, name: str):
+        self.events.append((name, time.monotonic()))
+
+    def finish(self, **attributes: Any):
+        """Finish the trace and hand it to the exporter."""
+        self.attributes.update(attributes)
+        self.tracer.exporter.append((self, time.monotonic()))
+
+
+class Tracer:
+    """Creates traces for requests and owns the exporter finished traces are written to."""
+
+    def __init__(self, exporter: FileTraceExporter, propagate: bool = False):
+        """
+        :param exporter:    Exporter for finished traces
+        :param propagate:   Whether to send a traceparent header to upstream containers
+        """
+        self.exporter = exporter
+        self.propagate = propagate
+
+    def start_trace(self, name: str, traceparent: str | None = None) -> Trace:
+        """Start a trace. The trace of an incoming traceparent header is only continued if propagate is set."""
+        return Trace(self, name, traceparent if self.propagate else None)
+
+
+class FileTraceExporter(BatchedWriter[tuple[Trace, float]]):
+    """Writes finished traces as JSON lines to a local file. Span times are in ms relative to the trace start."""
+
+    def __init__(
+        self,
+        target: str,
+        buffer_size: int = TRACE_BUFFER_SIZE,
+        flush_interval: float = TRACE_FLUSH_INTERVAL,
+    ):
+        super().__init__(target, buffer_size, flush_interval)
+
+    def format(self, record: tuple[Trace, float]) -> str:
+        trace, end = record
+        entry = {
+            "trace_id": trace.trace_id,
+            "parent_id": trace.parent_id,
+            "name": trace.name,
+            "time": trace.wall_start,
+            "duration_ms": _ms(end - trace.start),
+            "attributes": trace.attributes,
+            "spans": [
+                {
+                    "name": s.name,
+                    "span_id": s.span_id,
+                    "start_ms": _ms(s.start - trace.start),
+                    "duration_ms": _ms(s.end - s.start) if s.end is not None else None,
+                    "attributes": s.attributes,
+                }
+                for s in trace.spans
+            ],
+            "events": [{"name": name, "at_ms": _ms(at - trace.start)} for name, at in trace.events],
+        }
+        return json.dumps(entry, separators=(",", ":"), default=str) + "\n"
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 3)
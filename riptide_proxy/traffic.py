@@ -0,0 +1,61 @@
+"""Measures the recent throughput of the proxy per project"""
+
+from __future__ import annotations
+
+import time
+from collections import deque
+
+from riptide_proxy import TRAFFIC_WINDOW
+
+
+class TrafficMeter:
+    """
+    Counts requests and transferred bytes per project in buckets of one second. Rates are averaged over the last
+    TRAFFIC_WINDOW seconds, totals count since the start of the proxy.
+    """
+
+    def __init__(self):
+        # (second, project name => [requests, bytes in, bytes out]), oldest first
+        self._buckets: deque[tuple[int, dict[str, list[int]]]] = deque()
+        # Project name => [requests, bytes in, bytes out]
+        self.totals: dict[str, list[int]] = {}
+
+    def record(self, project_name: str, requests: int, bytes_in: int, bytes_out: int):
+        """Count finished requests (or WebSocket messages, with requests 0) of a project."""
+        second = int(time.monotonic())
+        if not self._buckets or self._buckets[-1][0] != second:
+            self._buckets.append((second, {}))
+            self._expire(second)
+        for counters in (self._buckets[-1][1], self.totals):
+            counter = counters.get(project_name)
+            if counter is None:
+                counter = counters[project_name] = [0, 0, 0]
+            counter[0] += requests
+            counter[1] += bytes_in
+            counter[2] += bytes_out
+
+    def rates(self) -> dict[str, dict[str, float]]:
+        """Requests and bytes per second of each project that had traffic since the start, and its totals."""
+        self._expire(int(time.monotonic()))
+        recent: dict[str, list[int]] = {}
+        for _, bucket in self._buckets:
+            for project_name, counter in bucket.items():
+                summed = recent.setdefault(project_name, [0, 0, 0])
+                for i in range(3):
+                    summed[i] += counter[i]
+        rates = {}
+        for project_name, total in sorted(self.totals.items()):
+            counter = recent.get(project_name, [0, 0, 0])
+            rates[project_name] = {
+                "requests_per_second": counter[0] / TRAFFIC_WINDOW,
+                "bytes_in_per_second": counter[1] / TRAFFIC_WINDOW,
+                "bytes_out_per_second": counter[2] / TRAFFIC_WINDOW,
+                "requests": total[0],
+                "bytes_in": total[1],
+                "bytes_out": total[2],
+            }
+        return rates
+
+    def _expire(self, second: int):
+        while self._buckets and self._buckets[0][0] <= second - TRAFFIC_WINDOW:
+            self._buckets.popleft()
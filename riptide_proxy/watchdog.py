@@ -0,0 +1,187 @@
+"""Detects IOLoop stalls: synchronous work that blocks all other requests for longer than a threshold"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from collections.abc import Coroutine, Generator
+from types import FrameType
+
+import tornado.ioloop
+import tornado.web
+import tornado.websocket
+
+from riptide_proxy import LOGGER_NAME, WATCHDOG_HEARTBEAT_INTERVAL, WATCHDOG_STALL_HISTORY
+from riptide_proxy.project_loader import ProjectRoute
+
+logger = logging.getLogger(LOGGER_NAME)
+
+
+class Stall:
+    __slots__ = ("started", "wall_started", "duration", "stack", "callback", "handler", "host", "uri", "project")
+
+    def __init__(self, started: float, stack: list[str], callback: asyncio.Handle | None):
+        self.started = started
+        self.wall_started = time.time() - (time.monotonic() - started)
+        # Only final once the loop has recovered.
+        self.duration = 0.0
+        self.stack = stack
+        # The IOLoop callback that was running, until its request handler is looked up
+        self.callback = callback
+        self.handler: str | None = None
+        self.host: str | None = None
+        self.uri: str | None = None
+        self.project: str | None = None
+
+    def describe(self) -> str:
+        active = f"{self.handler} for {self.host}{self.uri or ''}" if self.handler else "no request handler"
+        if self.project:
+            active += f" (project {self.project})"
+        return f"IOLoop stalled for {self.duration * 1000:.0f}ms in {active}"
+
+
+class LoopWatchdog:
+    """
+    Measures IOLoop latency with a heartbeat callback and watches it from a separate thread.
+
+    When the heartbeat is late by more than the threshold, the watchdog thread captures the stack of the IOLoop thread
+    and the IOLoop callback that is running. When the loop has recovered, the request handler of that callback is
+    looked up on the IOLoop thread and the stall is logged and recorded. Callbacks are recorded by a wrapper of
+    asyncio.Handle._run, the cost is an attribute assignment per callback and one heartbeat callback per interval.
+    """
+
+    def __init__(self, threshold: float, heartbeat_interval: float = WATCHDOG_HEARTBEAT_INTERVAL):
+        """
+        :param threshold:           A heartbeat that is late by more than this many seconds is a stall.
+        :param heartbeat_interval:  Interval of the heartbeat callback in seconds.
+        """
+        self.threshold = threshold
+        self.heartbeat_interval = heartbeat_interval
+        self.stall_count = 0
+        self.total_stall_time = 0.0
+        self.max_stall_time = 0.0
+        self.recent_stalls: deque[Stall] = deque(maxlen=WATCHDOG_STALL_HISTORY)
+        self.last_beat = time.monotonic()
+        self._loop_thread_id = 0
+        self._current: Stall | None = None
+        # The IOLoop callback that is running, set on the IOLoop thread
+        self._running: asyncio.Handle | None = None
+        self._run = asyncio.Handle._run
+        self._heartbeat: tornado.ioloop.PeriodicCallback | None = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        """Start the heartbeat on the current IOLoop and the watchdog thread. Must be called on the IOLoop thread."""
+        self._loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self._run = run = asyncio.Handle._run
+
+        def recorded_run(handle: asyncio.Handle):
+            self._running = handle
+            run(handle)
+            self._running = None
+
+        asyncio.Handle._run = recorded_run  # type: ignore
+        self._heartbeat = tornado.ioloop.PeriodicCallback(self._beat, self.heartbeat_interval * 1000)
+        self._heartbeat.start()
+        self._thread = threading.Thread(target=self._watch, name="riptide_proxy_watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.stop()
+            self._heartbeat = None
+            asyncio.Handle._run = self._run  # type: ignore
+            self._running = None
+
+    @property
+    def current_stall(self) -> Stall | None:
+        """The stall that is currently in progress, if any."""
+        return self._current
+
+    def _beat(self):
+        now = time.monotonic()
+        stall = self._current
+        if stall is not None:
+            self._current = None
+            stall.duration = now - stall.started
+            _find_handler(stall)
+            self.stall_count += 1
+            self.total_stall_time += stall.duration
+            self.max_stall_time = max(self.max_stall_time, stall.duration)
+            self.recent_stalls.append(stall)
+            logger.warning(stall.describe() + ". Stack at the time of detection:\n" + "".join(stall.stack))
+        self.last_beat = now
+
+    def _watch(self):
+        while not self._stop.wait(self.heartbeat_interval):
+            last_beat = self.last_beat
+            if self._current is None and time.monotonic() - last_beat > self.heartbeat_interval + self.threshold:
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is None:
+                    continue
+                stall = Stall(last_beat + self.heartbeat_interval, traceback.format_stack(frame), self._running)
+                # The loop may have recovered while the stack was captured.
+                if self.last_beat == last_beat:
+                    self._current = stall
+
+
+def _find_handler(stall: Stall):
+    """
+    Record the request handler of the callback that was running during the stall. Runs on the IOLoop thread, where
+    the frames of the callback can be inspected. For steps of tasks, the coroutines the task awaits are searched from
+    the innermost one for a request handler as ``self``. If the handler doesn't know its project yet, a project_name
+    local of the coroutines it awaits is used.
+    """
+    callback, stall.callback = stall.callback, None
+    owner = getattr(callback._callback, "__self__", None) if callback is not None else None  # type: ignore
+    if isinstance(owner, asyncio.Task):
+        frames = _awaited_frames(owner.get_coro())
+    elif isinstance(owner, (tornado.web.RequestHandler, tornado.websocket.WebSocketHandler)):
+        frames = []
+        _record_handler(stall, owner, None)
+    else:
+        frames = []
+    project_name = None
+    for frame in reversed(frames):
+        frame_locals = frame.f_locals
+        if project_name is None and isinstance(frame_locals.get("project_name"), str):
+            project_name = frame_locals["project_name"]
+        handler = frame_locals.get("self")
+        if isinstance(handler, (tornado.web.RequestHandler, tornado.websocket.WebSocketHandler)):
+            _record_handler(stall, handler, project_name)
+            return
+
+
+def _awaited_frames(coro: Coroutine | Generator | None) -> list[FrameType]:
+    """The frames of a (running) coroutine and of the coroutines it awaits, outermost first."""
+    frames = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        frames.append(frame)
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return frames
+
+
+def _record_handler(stall: Stall, handler: tornado.web.RequestHandler, project_name: str | None):
+    stall.handler = handler.__class__.__name__
+    stall.host = handler.request.host
+    stall.uri = handler.request.uri
+    # ProxyHttpHandler remembers the resolved project, the WebSocket proxy its route and autostart the project.
+    project = getattr(handler, "project", None)
+    if getattr(handler, "resolved_project_name", None) is not None:
+        project_name = handler.resolved_project_name  # type: ignore
+    elif isinstance(project, ProjectRoute):
+        project_name = project.name
+    elif project is not None:
+        project_name = project["name"]
+    stall.project = project_name